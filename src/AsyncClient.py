@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds an asyncio version of the Client that doesn't print or read
+# from the terminal, so it can be used from other programs. Every client is
+# a socket and a couple of tasks on the event loop, so thousands of them can
+# run in one process
+
+import asyncio
+import socket
+import traceback
+from AsyncUDPSocket import AsyncUDPSocket
+from PeerCache import PeerCache
+from FileTransfer import FileTransfer
+
+class AsyncClient:
+    """
+    This class will register with a Server, keep the client table up to date
+    and send and recieve messages, the same way the Client does, but every
+    operation is a coroutine and incoming messages come out of an async
+    iterator instead of being printed.
+
+        async with AsyncClient('alice','127.0.0.1',0,50000) as client:
+            if await client.register() == 'registered':
+                await client.send('bob','hello')
+                async for kind,message in client:
+                    ...
+
+    Methods:
+        Constructor:
+            Sets up the client, open (or async with) binds the socket
+        open/close:
+            Binds the socket and starts reading from it, or stops
+        register:
+            Registers with the Server and waits for the client table
+        send:
+            Sends a message to a client directly, or to the Server to store
+            if the client is offline or doesn't answer
+        sendfile/sendFileTo:
+            Sends a file to a client directly in chunks, or to the Server to
+            pass on if the client is offline or doesn't answer
+        clients:
+            The client table, optionally asking the Server for changes first
+        lookup:
+            Asks the Server for the entry of a client that isn't in our
+            table, like one on another node of a federation
+        dereg:
+            Deregisters from the Server
+        join/leave:
+            Joins or leaves a channel on the Server
+        post:
+            Posts a message to every other member of a channel
+        messages:
+            An async iterator of the messages that arrive, iterating over
+            the client itself does the same thing
+        processMessage:
+            Handles every data packet that arrives
+        applyDelta:
+            Applies changes to the table sent by the Server
+        heartbeat:
+            Lets the Server know we are still here every keepalive seconds
+        retryAfter:
+            How long until the Server takes a command from us again, if we
+            went over its rate limits
+    Attributes:
+        Nick: Holds the Nickname of the Client
+        udp: The AsyncUDPSocket we talk to the Server and clients with
+        serverIP/serverPort: The Server's IP and Port
+        keepalive: How often we send the Server a heartbeat, it should
+                   match the keepalive of the Server
+        timeout: How many seconds we wait for the Server to answer a
+                 request once it has been ACKed
+        peers: A PeerCache of the clients we recently couldn't reach, they
+               are sent to through the Server until it forgets them
+        probe: If it is set, how many seconds a message sent directly to a
+               client gets before we race it against sending it through the
+               Server, rather than going through every retry
+        clientTable: The client table, as sent from the Server
+        tableVersion: The version of the clientTable we have
+        tableUpdated: Set whenever the table is updated
+        inbox: A bounded queue of (kind,message) tuples for messages, when
+               nobody reads them it fills up and the socket stops accepting
+               packets like the Client's would
+        replies: The futures of the requests waiting on a reply from the
+                 Server, keyed by the command
+        retryAt: When the Server will take each command we were throttled
+                 on again, in the time of the event loop
+        files: The FileTransfer that reads the files we send and writes the
+               ones we are sent to downloadDir, we only take in maxDownload
+               bytes of files at once
+        onOffer: If it is set, it is called with every file we are offered
+                 and we only take the ones it returns True for
+        reader/beater: The tasks reading packets and sending heartbeats
+
+    Messages:
+        messages yields (kind,message) tuples where kind is
+            'MSG' - a message sent to us directly by another client
+            'post' - a post to a channel we are in, of the form
+                     '[channel] Nick: message'
+            'stored' - a message the Server stored for us while we were
+                       offline (or relayed because we didn't answer)
+            'ERROR' - an error from the Server about a message we sent,
+                      or a request it dropped because we sent too many
+            'file' - a file we were sent was saved, the message says where
+    """
+    def __init__(self,Nick,IP,PORT,ServerPort,ServerIP='127.0.0.1',
+                 codec='binary',keepalive=5.0,timeout=5.0,inboxSize=1024,
+                 metrics=None,peerTtl=30.0,probe=None,compression=True,
+                 downloadDir='downloads',maxDownload=256*1024*1024):
+        self.Nick = Nick
+        self.serverPort = ServerPort
+        self.serverIP = ServerIP
+        self.serverAddress = None
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.peers = PeerCache(ttl=peerTtl)
+        self.probe = probe
+        self.udp = AsyncUDPSocket(PORT,IP,codec=codec,metrics=metrics,
+                                  compression=compression)
+        self.clientTable = dict()
+        self.tableVersion = 0
+        self.tableUpdated = asyncio.Event()
+        self.inbox = asyncio.Queue(maxsize=inboxSize)
+        self.replies = dict()
+        self.retryAt = dict()
+        self.files = FileTransfer(downloadDir,maxPerNick=maxDownload,
+                                  maxSpool=maxDownload)
+        self.onOffer = None
+        self.reader = None
+        self.beater = None
+    async def __aenter__(self):
+        return await self.open()
+    async def __aexit__(self,*exception):
+        await self.close()
+    def __aiter__(self):
+        return self.messages()
+    async def open(self):
+        """
+        This method will bind the socket and start reading from it, it does
+        nothing if we are already open
+        """
+        if self.reader is None:
+            await self.udp.bind()
+            #The packets from the Server come from its resolved address
+            self.serverAddress = (socket.gethostbyname(self.serverIP),
+                                  self.serverPort)
+            self.reader = asyncio.ensure_future(self.readLoop())
+        return self
+    async def close(self):
+        """
+        This method will stop the tasks and close the socket. Anyone
+        iterating over the messages stops once they have read the rest.
+        """
+        for task in (self.reader,self.beater):
+            if task is not None:
+                task.cancel()
+        self.beater = None
+        self.files.close()
+        self.udp.close()
+        if self.udp.closed is not None:
+            await self.udp.closed
+        if self.inbox.full():
+            #We need room to let the readers know we are done
+            self.inbox.get_nowait()
+        self.inbox.put_nowait(None)
+    async def readLoop(self):
+        """
+        This method will read every data packet that arrives and process it
+        in order
+        """
+        while True:
+            data,address = await self.udp.secureRecieve()
+            try:
+                await self.processMessage(data,address)
+            except Exception:
+                #One bad packet shouldn't stop us from reading the rest
+                traceback.print_exc()
+    async def request(self,command,MSG,address=None):
+        """
+        This method will send a request to the Server (or to the client at
+        address) and wait for processMessage to complete the future for the
+        command with the reply
+
+        Output:
+            The reply - if the Server answered
+            None - otherwise
+        """
+        if address is None:
+            address = (self.serverIP,self.serverPort)
+        reply = asyncio.get_running_loop().create_future()
+        self.replies[command] = reply
+        try:
+            response = await self.udp.secureSend(MSG,address[1],address[0])
+            if response != 200:
+                return None
+            return await asyncio.wait_for(reply,self.timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if self.replies.get(command) is reply:
+                del self.replies[command]
+    def reply(self,command,value):
+        """
+        This method will complete the request waiting on a command, if there
+        is one
+        """
+        reply = self.replies.get(command)
+        if reply is not None and not reply.done():
+            reply.set_result(value)
+    async def register(self):
+        """
+        This method will register with the Server (or log back in with the
+        same Nickname) and wait for the client table
+
+        Output:
+            'registered' - if we are registered and have the table
+            'taken' - if another client is using the Nickname
+            'throttled' - if we tried too often, see retryAfter
+            'failed' - if the Server didn't answer
+        """
+        await self.open()
+        if self.retryAfter('reg'):
+            #The Server would drop it without a word
+            return 'throttled'
+        #We offer the Server our compression, if we have one
+        MSG = [1,'reg:'+(self.udp.compression or ''),self.Nick]
+        registered = await self.request('reg',MSG)
+        if registered is None:
+            return 'throttled' if self.retryAfter('reg') else 'failed'
+        if not registered:
+            return 'taken'
+        if self.beater is None:
+            self.beater = asyncio.ensure_future(self.heartbeat())
+        return 'registered'
+    async def dereg(self):
+        """
+        This method will deregister from the Server, setting us to Offline
+        in its table. We can register again later.
+
+        Output:
+            200 - if the Server deregistered us
+            100 - if the Server didn't answer
+        """
+        if self.beater is not None:
+            self.beater.cancel()
+            self.beater = None
+        acked = await self.request('dereg',[1,'dereg:',self.Nick])
+        return 200 if acked else 100
+    async def send(self,nick,MSG):
+        """
+        This method will send a message to a client. It will try to send the
+        message directly to the client, if the client is offline or is
+        unreachable the message is sent to the Server to store instead. A
+        client we couldn't reach recently isn't tried again until the Server
+        sends a change to its entry (or peerTtl runs out).
+
+        Output:
+            'delivered' - if the client got the message
+            'stored' - if the Server got the message
+            'failed' - if neither of them did
+            'unknown' - if the client isn't in the table
+        """
+        entry = self.clientTable.get(nick)
+        if entry is None:
+            #The client might be registered with another node
+            entry = await self.lookup(nick)
+            if entry is None:
+                return 'unknown'
+        MSG = [1,'MSG:'+nick,self.Nick+": "+MSG]
+        address = (entry['IP'],entry['PORT'])
+        if entry['Online'] and not self.peers.unreachable(nick,address):
+            result = await self.sendDirect(MSG,address)
+            if result == 'delivered':
+                return result
+            self.peers.failed(nick,address)
+            if result is not None:
+                #The Server was raced against the client already
+                return result
+        response = await self.udp.secureSend(MSG,self.serverPort,
+                                             self.serverIP)
+        if response == 200:
+            return 'stored'
+        return 'failed'
+    async def sendfile(self,nick,path):
+        """
+        This method will send a file to a client, the way send sends a
+        message. If the client doesn't take it the file goes to the Server,
+        which passes it on when the client is back. Sending a file again
+        after it was cut off picks up from the last chunk that got there.
+
+        Output:
+            'delivered' - if the client has the whole file
+            'stored' - if the Server has it
+            'failed' - if neither of them has all of it
+            'unknown' - if the client isn't in the table
+        """
+        entry = self.clientTable.get(nick)
+        if entry is None:
+            entry = await self.lookup(nick)
+            if entry is None:
+                return 'unknown'
+        offer = self.files.offer(path,self.Nick,nick)
+        address = (entry['IP'],entry['PORT'])
+        if entry['Online'] and not self.peers.unreachable(nick,address):
+            if await self.sendFileTo(offer,path,address) == 200:
+                return 'delivered'
+            self.peers.failed(nick,address)
+        if await self.sendFileTo(offer,path,self.serverAddress) == 200:
+            return 'stored'
+        return 'failed'
+    async def sendFileTo(self,offer,path,address,attempts=3):
+        """
+        This method will offer a file to a client (or the Server) and send
+        it the chunks it needs through the sliding window, a batch at a
+        time. When we are done it tells us the chunk it needs next, which
+        is all of them once it has the whole file.
+
+        Output:
+            200 - if it has the whole file
+            100 - otherwise
+        """
+        transferId = offer['id']
+        command = 'accept:'+transferId
+        start = await self.request(command,[1,'offer:'+transferId,offer],
+                                   address)
+        for attempt in range(attempts):
+            if start is None:
+                return 100
+            for MSGS in self.files.batches(offer,path,start):
+                response = await self.udp.windowSend(MSGS,address[1],
+                                                     address[0])
+                if response != 200:
+                    return 100
+            start = await self.request(command,[1,'done:'+transferId,None],
+                                       address)
+            if start == offer['chunks']:
+                return 200
+        return 100
+    async def sendDirect(self,MSG,address):
+        """
+        This method will send a message straight to a client. With a probe
+        set, once the client has gone probe seconds without ACKing it the
+        message is sent to the Server too, and the two sends race. The first
+        one to be ACKed wins and the other is cancelled, so a client that
+        is gone costs a fraction of the full retries. If the client ACKs
+        just as the Server does, it can get the message twice.
+
+        Output:
+            'delivered' - if the client ACKed the message
+            'stored' - if the Server ACKed it first
+            'failed' - if neither of them did
+            None - if the client didn't ACK it and the Server wasn't tried
+        """
+        direct = asyncio.ensure_future(self.udp.secureSend(MSG,address[1],
+                                                           address[0]))
+        if self.probe is not None:
+            await asyncio.wait([direct],timeout=self.probe)
+        if self.probe is None or direct.done():
+            return 'delivered' if await direct == 200 else None
+        relay = asyncio.ensure_future(self.udp.secureSend(MSG,self.serverPort,
+                                                          self.serverIP))
+        sends = {direct:'delivered',relay:'stored'}
+        try:
+            while sends:
+                done,pending = await asyncio.wait(
+                    list(sends),return_when=asyncio.FIRST_COMPLETED)
+                for send in done:
+                    result = sends.pop(send)
+                    if send.result() == 200:
+                        return result
+            return 'failed'
+        finally:
+            for send in sends:
+                send.cancel()
+    async def join(self,channel):
+        """
+        This method will join a channel, making it if it is new. The Server
+        sends an 'ERROR' message if it can't.
+
+        Output:
+            200 - if the Server got the request
+            100 - otherwise
+        """
+        return await self.udp.secureSend([1,'join:'+channel,None],
+                                         self.serverPort,self.serverIP)
+    async def leave(self,channel):
+        """
+        This method will leave a channel, like join
+        """
+        return await self.udp.secureSend([1,'leave:'+channel,None],
+                                         self.serverPort,self.serverIP)
+    async def post(self,channel,MSG):
+        """
+        This method will post a message to a channel. It is only sent to the
+        Server, which sends it on to every other member.
+
+        Output:
+            200 - if the Server got the post
+            100 - otherwise
+        """
+        return await self.udp.secureSend([1,'post:'+channel,MSG],
+                                         self.serverPort,self.serverIP)
+    async def clients(self,refresh=False):
+        """
+        This method will return a copy of the client table
+
+        Parameters:
+            refresh: If it is True we first ask the Server for the changes
+                     we are missing and wait for them
+        Output:
+            {Nick:{'IP':IP,'PORT':PORT,'Online':True/False}}
+        """
+        if refresh:
+            self.tableUpdated.clear()
+            MSG = [1,'table:',self.tableVersion]
+            response = await self.udp.secureSend(MSG,self.serverPort,
+                                                 self.serverIP)
+            if response == 200:
+                try:
+                    await asyncio.wait_for(self.tableUpdated.wait(),
+                                           self.timeout)
+                except asyncio.TimeoutError:
+                    pass
+        return {nick:dict(entry) for nick,entry in self.clientTable.items()}
+    async def lookup(self,nick):
+        """
+        This method will ask the Server for the entry of a client. A node of
+        a federation asks the node the client registered with.
+
+        Output:
+            {'IP':IP,'PORT':PORT,'Online':True/False} - if it was found
+            None - otherwise
+        """
+        return await self.request('lookup:'+nick,[1,'lookup:'+nick,None])
+    async def messages(self):
+        """
+        This method is an async iterator of the (kind,message) tuples of the
+        messages that arrive, it ends once the client is closed
+        """
+        while True:
+            item = await self.inbox.get()
+            if item is None:
+                #Let anyone else iterating know too
+                self.inbox.put_nowait(None)
+                return
+            yield item
+    async def processMessage(self,data,address):
+        """
+        This method processes all incoming data packets
+        """
+        command = str(data[1]).split(':')
+        data = data[2]
+        if command[0] == '1':
+            #The Server's replies to reg (if the Nickname is taken) and dereg
+            if data == 'ERROR':
+                self.reply('reg',False)
+            elif data == 'ACK':
+                self.reply('dereg',True)
+        elif command[0] == 'update':
+            for nick,entry in data.items():
+                if self.clientTable.get(nick) != entry:
+                    #The client might be back, so it is worth trying again
+                    self.peers.forget(nick)
+            self.clientTable = data
+            if len(command) > 1 and command[1] != '':
+                self.tableVersion = int(command[1])
+            if self.udp.compression in command[2:]:
+                #The Server took our offer, so it can read them too
+                self.udp.allowCompression(self.serverAddress)
+            self.tableUpdated.set()
+            self.reply('reg',True)
+        elif command[0] == 'delta':
+            self.applyDelta(data)
+            self.tableUpdated.set()
+        elif command[0] == 'found':
+            self.reply('lookup:'+command[1],data)
+        elif command[0] == 'MSG':
+            kind = 'stored' if address == self.serverAddress else 'MSG'
+            await self.inbox.put((kind,data))
+        elif command[0] == 'post':
+            await self.inbox.put(('post',data))
+        elif command[0] == 'batch':
+            #The Server packed a few of our stored messages together
+            for message in data:
+                await self.inbox.put(('stored',message))
+        elif command[0] == 'ERROR':
+            await self.inbox.put(('ERROR',data))
+        elif command[0] == 'offer':
+            start = None
+            if isinstance(data,dict) and (self.onOffer is None or
+                                          self.onOffer(dict(data))):
+                start = self.files.accept(command[1],data)
+            asyncio.ensure_future(self.udp.secureSend(
+                [1,'accept:'+command[1],start],address[1],address[0]))
+        elif command[0] == 'chunk':
+            self.files.write(command[1],data)
+        elif command[0] == 'done':
+            have,path,offer = self.files.finish(command[1])
+            asyncio.ensure_future(self.udp.secureSend(
+                [1,'accept:'+command[1],have],address[1],address[0]))
+            if path is not None:
+                await self.inbox.put(('file','{} sent you {}, saved to {}'
+                                      .format(offer['from'],offer['name'],
+                                              path)))
+        elif command[0] == 'accept':
+            self.reply('accept:'+command[1],data)
+        elif command[0] == 'throttled':
+            #The Server dropped a request, data is how long until it takes
+             # that command again
+            self.retryAt[command[1]] = asyncio.get_running_loop().time()+data
+            #Whoever is waiting on the reply doesn't need to wait any longer
+            self.reply(command[1],None)
+            self.reply(':'.join(command[1:3]),None)
+            await self.inbox.put(('ERROR',"The Server is busy, try {} again "
+                                  "in {:.2f}s".format(command[1],data)))
+        return None
+    def applyDelta(self,delta):
+        """
+        This method will apply changes to the table sent by the Server. If
+        we are missing some changes we ask the Server for the table again.
+
+        Parameters:
+            delta: A dictionary of the form
+                   {'from':version,'to':version,'changes':{Nick:entry}}
+        """
+        if delta['to'] <= self.tableVersion:
+            #We already have these changes
+            return None
+        if delta['from'] > self.tableVersion:
+            #We missed some changes so we need the table from the Server,
+             # we don't wait for the ACK so the reader can keep going
+            MSG = [1,'table:',self.tableVersion]
+            asyncio.ensure_future(self.udp.secureSend(MSG,self.serverPort,
+                                                      self.serverIP))
+            return None
+        for nick,entry in delta['changes'].items():
+            self.clientTable[nick] = entry
+            self.peers.forget(nick)
+        self.tableVersion = delta['to']
+        return None
+    def retryAfter(self,command):
+        """
+        This method will return how many seconds until the Server takes a
+        command from us again, 0 if it isn't limiting us
+        """
+        retryAt = self.retryAt.get(command)
+        if retryAt is None:
+            return 0
+        return max(0,retryAt - asyncio.get_running_loop().time())
+    async def heartbeat(self):
+        """
+        This method will send the Server a heartbeat every keepalive seconds
+        until we deregister. Heartbeats aren't ACKed, the Server only needs
+        to get one every so often to know we are online.
+        """
+        count = 0
+        while True:
+            await asyncio.sleep(self.keepalive)
+            count += 1
+            self.udp.send(['BEAT',count],self.serverPort,self.serverIP)
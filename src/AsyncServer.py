@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+
+#Created By Adithya Shastry
+#This file holds an asyncio version of the Server. Instead of creating a new
+# thread for every datagram, everything runs on one event loop, so a single
+# process can hold a very large number of clients cheaply
+import asyncio
+import time
+from AsyncUDPSocket import AsyncUDPSocket
+from Server import Server
+
+class AsyncServer(Server):
+    """
+    This class is a version of the Server that runs on an asyncio event loop.
+    It uses an AsyncUDPSocket, which speaks the same packets, sequence
+    numbers and ACKs as the UDPSocket class so clients can't tell the
+    difference, but waiting on an ACK doesn't block anyone else.
+
+    Methods:
+        Constructor:
+            Will create the event loop and start serving on the given Port
+        peerStats:
+            The round trip time estimates and timeouts for each peer
+        processMessage,registerUser,storeMessage,sendStored,
+        updateAllClients,deRegister,sendTable,flushChanges,watchSessions,
+        presenceChanged:
+            Coroutine versions of the Server methods with the same name
+        clientBeat:
+            Restarts a client's timer, like Server.clientBeat
+        dispatch:
+            Starts a task for every data packet that is within the rate
+            limits
+        backlogged:
+            Never turns a request down, there are no workers to wait for
+        throttle:
+            Tells a client it went over the rate limits, like
+            Server.throttle
+        forwardFiles:
+            Starts a task passing the spooled files on to a client
+        fileReply:
+            Completes the future of a file waiting on a client's answer
+        handleMessage,sendStats,joinChannel,leaveChannel,channelRequest,
+        postMessage,queueMessages,lookupUser,offerFile,finishFile,
+        sendFiles,sendFile,fileRequest:
+            Coroutine versions of the Server methods with the same name
+        tableChanged:
+            Records a change and schedules the update on the event loop
+    Attributes:
+        udp: The AsyncUDPSocket we talk to the clients with, every data
+             packet it accepts that is within the rate limits is handled in
+             a task of its own
+        restored: Whether we started from a snapshot
+    """
+    def __init__(self,PORT,HOST='127.0.0.1',windowSize=8,codec='binary',
+                 store=None,retries=5,minRto=0.05,maxRto=4.0,keepalive=5.0,
+                 misses=3,metricsPort=None,compression=True,
+                 snapshotDir=None,snapshotInterval=1.0,limits=None,
+                 spoolDir=None):
+        self.udp = AsyncUDPSocket(PORT,HOST,windowSize=windowSize,
+                                  codec=codec,retries=retries,minRto=minRto,
+                                  maxRto=maxRto,compression=compression)
+        self.udp.onData = self.dispatch
+        self.udp.onBeat = self.clientBeat
+        self.udp.admit = self.admit
+        self.initState(store,keepalive=keepalive,misses=misses,
+                       limits=limits)
+        self.restored = self.initSnapshots(snapshotDir,snapshotInterval)
+        self.initFiles(spoolDir)
+        self.initMetrics(self.udp.metrics,metricsPort)
+        asyncio.run(self.MainThread())
+    async def MainThread(self):
+        """
+        This method will bind the socket to the event loop and then serve
+        forever. All of the work happens in the callbacks from the loop.
+        """
+        await self.udp.bind()
+        print("Server all set up! Waiting for Connections")
+        self.watcher = asyncio.ensure_future(self.watchSessions())
+        if self.restored:
+            #Everyone that was online gets the table we came back with
+            asyncio.ensure_future(self.updateAllClients())
+        #We just need to keep the loop running
+        await asyncio.get_running_loop().create_future()
+    def peerStats(self):
+        """
+        This method will return the round trip time estimates and the current
+        timeout for each peer, like UDPSocket.peerStats
+        """
+        return self.udp.peerStats()
+    def dispatch(self,data,address):
+        """
+        This method will handle every data packet the socket accepts (after
+        it was admitted) in a task of its own
+        """
+        asyncio.ensure_future(self.handleMessage(data,address))
+    def backlogged(self,address):
+        """
+        Every request gets a task of its own, so none waits for a worker
+        """
+        return False
+    def throttle(self,command,retryAfter,address):
+        """
+        This method will tell a client it went over the rate limits, like
+        Server.throttle
+        """
+        MSG = [1,'throttled:'+command,round(retryAfter,3)]
+        asyncio.ensure_future(self.udp.secureSend(MSG,address[1],address[0]))
+    async def handleMessage(self,data,address):
+        """
+        This method will process a message and record how long it took, the
+        same way Server.handleMessage does
+        """
+        start = time.perf_counter()
+        try:
+            await self.processMessage(data,address)
+        finally:
+            name = str(data[1]).split(':')[0]
+            if name not in self.COMMANDS:
+                name = 'unknown'
+            self.commandTime.observe(time.perf_counter() - start,name)
+    async def processMessage(self,data,address):
+        """
+        This method will process any inputs that is receieved, the same way
+        Server.processMessage does
+        """
+        command = data[1].split(':')
+        data = data[2]
+        if command[0] == 'reg':
+            if self.udp.compression in command[1:]:
+                self.udp.allowCompression(address)
+            await self.registerUser(data,address[0],address[1])
+        elif command[0] == 'dereg':
+            await self.deRegister(data)
+        elif command[0] == 'MSG':
+            await self.storeMessage(command[1],data,address)
+        elif command[0] == 'table':
+            await self.sendTable(address[0],address[1],data)
+        elif command[0] == 'stats':
+            await self.sendStats(address)
+        elif command[0] == 'join':
+            await self.joinChannel(command[1],address)
+        elif command[0] == 'leave':
+            await self.leaveChannel(command[1],address)
+        elif command[0] == 'post':
+            await self.postMessage(command[1],data,address)
+        elif command[0] == 'lookup':
+            await self.lookupUser(command[1],address)
+        elif command[0] == 'offer':
+            await self.offerFile(command[1],data,address)
+        elif command[0] == 'chunk':
+            if self.files is not None:
+                self.files.write(command[1],data)
+        elif command[0] == 'done':
+            await self.finishFile(command[1],address)
+        elif command[0] == 'accept':
+            self.fileReply(command[1],data)
+        else:
+            print("Incorrect Command")
+            return None
+    async def sendStats(self,address):
+        """
+        This method will send the metrics to a local client that asked for
+        them, the same way Server.sendStats does
+        """
+        if not address[0].startswith('127.'):
+            print("Stats can only be asked for from this machine")
+            return None
+        await self.udp.secureSend([1,'stats:',self.metrics.snapshot()],
+                              address[1],address[0])
+    async def lookupUser(self,nick,address):
+        """
+        This method will send a client the entry of one client, like
+        Server.lookupUser
+        """
+        entry = self.clientTable.get(nick)
+        if entry is not None:
+            entry = dict(entry)
+        await self.udp.secureSend([1,'found:'+nick,entry],address[1],
+                                  address[0])
+    async def joinChannel(self,channel,address):
+        """
+        This method will add a client to a channel, like
+        Server.joinChannel
+        """
+        nick = await self.channelRequest(channel,address)
+        if nick is not None:
+            self.addMember(channel,nick)
+        return None
+    async def leaveChannel(self,channel,address):
+        """
+        This method will take a client out of a channel, like
+        Server.leaveChannel
+        """
+        nick = await self.channelRequest(channel,address)
+        if nick is not None:
+            self.removeMember(channel,nick)
+        return None
+    async def channelRequest(self,channel,address):
+        """
+        This method will find the Nickname of the client asking to do
+        something with a channel, like Server.channelRequest
+        """
+        error = self.channelError(channel,address)
+        if error is not None:
+            await self.udp.secureSend([1,"ERROR",error],address[1],address[0])
+            return None
+        return self.addresses[address]
+    async def postMessage(self,channel,MSG,address):
+        """
+        This method will send a post to every other member of a channel,
+        like Server.postMessage. Every send is its own coroutine so they all
+        wait on their ACKs at the same time.
+        """
+        nick = await self.channelRequest(channel,address)
+        if nick is None:
+            return None
+        members = self.channelMembers(channel,nick)
+        if members is None:
+            Error = [1,"ERROR","You aren't in {}".format(channel)]
+            await self.udp.secureSend(Error,address[1],address[0])
+            return None
+        text = '[{}] {}: {}'.format(channel,nick,MSG)
+        online,offline = self.splitMembers(members)
+        clients = list(online)
+        MSG = [1,'post:'+channel,text]
+        responses = await asyncio.gather(*[self.udp.secureSend(MSG,PORT,IP)
+                                           for IP,PORT in clients])
+        for client,response in zip(clients,responses):
+            if response != 200:
+                member = online[client]
+                self.markOffline(member,client[0],client[1])
+                offline.append(member)
+        await self.queueMessages(offline,text,address)
+        return None
+    async def queueMessages(self,nicks,MSG,address):
+        """
+        This method will store a message for many clients at once, like
+        Server.queueMessages
+        """
+        if not nicks:
+            return None
+        full = self.store.appendMany(nicks,MSG)
+        if full:
+            Error = [1,"ERROR","{} have too many messages waiting".format(
+                ', '.join(sorted(full)))]
+            await self.udp.secureSend(Error,address[1],address[0])
+        return None
+    async def storeMessage(self,nick,MSG,address):
+        """
+        This method will first try to contact the client and if that fails
+        will store the message and relay it to the client when they reregister
+        """
+        with self.tableLock:
+            entry = self.clientTable[nick]
+            IP,PORT,online = entry['IP'],entry['PORT'],entry['Online']
+        if online:
+            response = await self.udp.secureSend([1,"MSG:",MSG],PORT,IP)
+            if response == 200:
+                #Then the client was online! so we notify the requester
+                Error = [1,"ERROR",'The client is online!']
+                await self.udp.secureSend(Error,address[1],address[0])
+                return None
+            self.markOffline(nick,IP,PORT)
+        if not self.queueMessage(nick,MSG):
+            Error = [1,"ERROR","{} has too many messages waiting".format(nick)]
+            await self.udp.secureSend(Error,address[1],address[0])
+        return None
+    async def sendStored(self,nick):
+        """
+        This method will send registered users offline messages a page at a
+        time, like Server.sendStored
+        """
+        with self.tableLock:
+            IP = self.clientTable[nick]['IP']
+            PORT = self.clientTable[nick]['PORT']
+        while True:
+            page = self.store.pending(nick,limit=self.pageSize)
+            batches = self.makeBatches(page)
+            if not batches:
+                return None
+            MSGS = [[1,"batch:",messages] for lastId,messages in batches]
+            response = await self.udp.windowSend(MSGS,PORT,IP,
+                onAck=lambda index: self.store.ack(nick,batches[index][0]))
+            if response != 200 or len(page) < self.pageSize:
+                return None
+    async def offerFile(self,transferId,offer,address):
+        """
+        This method will take a file for a client that is offline, like
+        Server.offerFile
+        """
+        start = None
+        if (self.files is not None and isinstance(offer,dict) and
+                offer.get('to') in self.clientTable):
+            sender = self.addresses.get(address,address)
+            start = self.files.accept(transferId,offer,sender)
+        await self.udp.secureSend([1,'accept:'+transferId,start],address[1],
+                                  address[0])
+    async def finishFile(self,transferId,address):
+        """
+        This method will tell a client how much of a file we have, like
+        Server.finishFile
+        """
+        have,path,offer = (None,None,None)
+        if self.files is not None:
+            have,path,offer = self.files.finish(transferId)
+        await self.udp.secureSend([1,'accept:'+transferId,have],address[1],
+                                  address[0])
+        if path is not None:
+            entry = self.clientTable.get(offer['to'])
+            if entry is not None and entry['Online']:
+                self.forwardFiles(offer['to'])
+    def forwardFiles(self,nick):
+        """
+        This method will pass the files spooled for a client on to it in a
+        task of its own
+        """
+        if self.files is None or nick in self.forwarding:
+            return None
+        if self.files.spooled(nick):
+            self.forwarding.add(nick)
+            asyncio.ensure_future(self.sendFiles(nick))
+    async def sendFiles(self,nick):
+        """
+        This method will send a client every file spooled for it, like
+        Server.sendFiles
+        """
+        try:
+            for offer,path in self.files.spooled(nick):
+                entry = self.clientTable.get(nick)
+                if entry is None or not entry['Online']:
+                    break
+                response = await self.sendFile(offer,path,entry['IP'],
+                                               entry['PORT'])
+                if response != 200:
+                    break
+                self.files.remove(offer['id'])
+                print("Passed {} on to {}".format(offer['name'],nick))
+        finally:
+            self.forwarding.discard(nick)
+    async def sendFile(self,offer,path,IP,PORT,attempts=3):
+        """
+        This method will send a file to a client, like Server.sendFile
+        """
+        transferId = offer['id']
+        start = await self.fileRequest(transferId,
+                                       [1,'offer:'+transferId,offer],IP,PORT)
+        for attempt in range(attempts):
+            if start is None:
+                return 100
+            for MSGS in self.files.batches(offer,path,start):
+                if await self.udp.windowSend(MSGS,PORT,IP) != 200:
+                    return 100
+            start = await self.fileRequest(transferId,
+                                           [1,'done:'+transferId,None],
+                                           IP,PORT)
+            if start == offer['chunks']:
+                return 200
+        return 100
+    async def fileRequest(self,transferId,MSG,IP,PORT):
+        """
+        This method will send a client a request about a file and wait for
+        its answer, like Server.fileRequest
+        """
+        reply = asyncio.get_running_loop().create_future()
+        self.fileReplies[transferId] = reply
+        try:
+            if await self.udp.secureSend(MSG,PORT,IP) != 200:
+                return None
+            return await asyncio.wait_for(reply,self.fileTimeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.fileReplies.pop(transferId,None)
+    def fileReply(self,transferId,value):
+        if self.files is None:
+            return None
+        reply = self.fileReplies.get(transferId)
+        if reply is not None and not reply.done():
+            reply.set_result(value)
+    async def registerUser(self,Nick,IP,PORT):
+        """
+        This method is used to register a user by adding them to the
+        table along with their IP,PORT, and Online Status
+        """
+        #The table is changed under the tableLock, so a snapshot being
+         # taken on another thread never copies it halfway through
+        with self.tableLock:
+            entry = self.clientTable.get(Nick)
+            if entry is None:
+                client = dict()
+                client['IP'] = IP
+                client['PORT'] = PORT
+                client['Online'] = True
+                self.clientTable[Nick] = client
+                status = 'new'
+            elif not entry['Online']:
+                #this means the client is logging back in, maybe from a
+                 # different address like in Server.registerUser
+                old = (entry['IP'],entry['PORT'])
+                entry['IP'] = IP
+                entry['PORT'] = PORT
+                entry['Online'] = True
+                status = 'back'
+            else:
+                status = 'taken'
+        if status == 'back':
+            if old != (IP,PORT):
+                if self.addresses.get(old) == Nick:
+                    self.addresses.pop(old,None)
+                self.udp.forget(old)
+            self.sessionStarted(Nick,IP,PORT)
+            self.tableChanged(Nick)
+            await self.sendTable(IP,PORT)
+            await self.sendStored(Nick)
+            self.forwardFiles(Nick)
+            return None
+        if status == 'taken':
+            print("The Nickname already exist, please exit the program")
+            await self.udp.secureSend([1,1,"ERROR"],PORT,IP)
+            return None
+        print("Registered {} at {}:{}".format(Nick,IP,PORT))
+        self.sessionStarted(Nick,IP,PORT)
+        self.tableChanged(Nick)
+        await self.sendTable(IP,PORT)
+        return None
+    async def updateAllClients(self):
+        """
+        This method will send the clientTable to every online client. Since
+        the sends don't block each other we send to all of them at once.
+        """
+        MSG = self.tableMessage()
+        with self.tableLock:
+            clients = self.onlineClients()
+        sends = [self.udp.secureSend(MSG,PORT,IP) for IP,PORT in clients]
+        await asyncio.gather(*sends)
+        print("Updated All Clients")
+        return None
+    async def deRegister(self,nick):
+        """
+        This method will deregister a client, setting its online status in the
+        table to Offline
+        """
+        with self.tableLock:
+            entry = self.clientTable[nick]
+            entry['Online'] = False
+            PORT = entry['PORT']
+            IP = entry['IP']
+        self.wheel.cancel(nick)
+        self.addresses.pop((IP,PORT),None)
+        self.udp.forget((IP,PORT))
+        self.tableChanged(nick)
+        await self.udp.secureSend([1,1,'ACK'],PORT,IP)
+    def clientBeat(self,address):
+        """
+        This method will restart the timer of the client that sent a
+        heartbeat, bringing it back if it was marked Offline
+        """
+        nick = self.addresses.get(address)
+        if nick is None:
+            return None
+        self.wheel.schedule(nick,self.keepalive * self.misses)
+        if not self.clientTable[nick]['Online']:
+            asyncio.ensure_future(self.presenceChanged(nick,True))
+        return None
+    async def watchSessions(self):
+        """
+        This method will move the timer wheel along and mark the clients
+        whose timers ran out Offline, like Server.watchSessions
+        """
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            for nick in self.wheel.advance():
+                await self.presenceChanged(nick,False)
+            if self.files is not None:
+                self.files.expire()
+    async def presenceChanged(self,nick,online):
+        """
+        This method will update a client's Online status when its heartbeats
+        stop or start again, the same way Server.presenceChanged does
+        """
+        with self.tableLock:
+            entry = self.clientTable.get(nick)
+            if entry is None or entry['Online'] == online:
+                return None
+            entry['Online'] = online
+            IP,PORT = entry['IP'],entry['PORT']
+        self.tableChanged(nick)
+        if online:
+            print("{} is back".format(nick))
+            await self.sendTable(IP,PORT)
+            await self.sendStored(nick)
+            self.forwardFiles(nick)
+        else:
+            print("{} stopped responding".format(nick))
+            self.udp.forget((IP,PORT))
+        return None
+    async def sendTable(self,IP,PORT,version=None):
+        """
+        This method will send a client the table, or only the changes since
+        the version it has if we still have them
+        """
+        delta = None
+        if version is not None:
+            with self.tableLock:
+                delta = self.deltaSince(version)
+        if delta is not None:
+            MSG = [1,'delta:',delta]
+        else:
+            MSG = self.tableMessage()
+            if self.udp.compresses((IP,PORT)):
+                MSG[1] += ':' + self.udp.compression
+        await self.udp.secureSend(MSG,PORT,IP)
+    def tableChanged(self,nick):
+        """
+        This method will record that a client's entry in the table changed
+        and schedule an update, so changes that happen within coalesceDelay
+        of each other are sent together
+        """
+        with self.tableLock:
+            self.recordChange(nick)
+        if self.flushTimer is None:
+            loop = asyncio.get_running_loop()
+            self.flushTimer = loop.call_later(self.coalesceDelay,
+                lambda: asyncio.ensure_future(self.flushChanges()))
+    async def flushChanges(self):
+        """
+        This method will send the changes since the last update to all of
+        the clients that are online at once
+        """
+        self.flushTimer = None
+        with self.tableLock:
+            delta = self.deltaSince(self.flushedVersion)
+            self.flushedVersion = self.tableVersion
+            clients = self.onlineClients()
+        if delta is None:
+            await self.updateAllClients()
+            return None
+        if not delta['changes']:
+            return None
+        MSG = [1,'delta:',delta]
+        sends = [self.udp.secureSend(MSG,PORT,IP) for IP,PORT in clients]
+        await asyncio.gather(*sends)
+        print("Updated All Clients")
+        return None
+
+if __name__ == '__main__':
+    server = AsyncServer(50000)
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds an asyncio version of the UDPSocket. It speaks the same
+# packets, sequence numbers and ACKs, but waiting on an ACK is a coroutine
+# instead of a blocked thread, so any number of them can share one event loop
+
+import asyncio
+import socket
+import zlib
+from UDPSocket import UDPSocket,BUFFERSIZE
+from WireCodec import makeCodec
+from Fragmenter import Fragmenter
+from RTTEstimator import RTTEstimator
+from DuplicateCache import DuplicateCache
+from Metrics import MetricsRegistry,TrafficMetrics,peerLabel
+
+class AsyncUDPSocket(asyncio.DatagramProtocol):
+    """
+    This class is a version of the UDPSocket that runs on an asyncio event
+    loop. The event loop calls datagram_received when the socket is ready,
+    so there is no dispatcher thread, and ACKs and retransmissions are
+    handled with event loop timers instead of blocking on the socket.
+
+    The event loop only reads one datagram each time, so datagram_received
+    reads the rest of what has arrived (up to batchSize) itself and ACKs
+    the batch with one cumulative ACK per peer, like the UDPSocket does.
+
+    Methods:
+        Constructor:
+            Sets up the socket's state, bind has to be awaited before it
+            can be used
+        bind:
+            Binds the socket to the Port on the running event loop
+        dispatch/datagramReceived:
+            Sorts incoming datagrams into ACKs, heartbeats and data packets,
+            dropping the ones that can't be handled
+        sendAck/flushAcks:
+            Queues a cumulative ACK for a peer, and sends the queued ones
+            once the batch is done (or ackDelay has passed)
+        send/sendRaw:
+            Sends a packet (or bytes that are already encoded) right away
+        secureSend/windowSend:
+            Coroutine versions of the UDPSocket methods with the same name
+        secureRecieve:
+            Waits for the next data packet on the inbound queue
+        peerStats:
+            The round trip time estimates and timeouts for each peer
+        forget:
+            Forgets the stream we were recieving from a peer, like in
+            UDPSocket
+        allowCompression/compresses:
+            Records that a peer can read compressed packets, or checks it,
+            like in UDPSocket
+        close:
+            Closes the socket
+    Attributes:
+        HOST: Holds the Host IP
+        PORT: Holds the Port Number, if it was 0 it is the Port the
+              operating system picked once we are bound
+        transport: The asyncio transport for our socket
+        socket: Our socket, which we read the rest of a batch from
+        codec: Turns packets into bytes and back, like in UDPSocket
+        fragmenter: Splits big packets into fragments, like in UDPSocket
+        compression: The compression our codec offers, or None
+        compressPeers: The peers we compress big packets for, like in
+                       UDPSocket
+        rtt: Estimates the round trip time to each peer and decides how long
+             we wait for an ACK before resending, like in UDPSocket
+        retries: How many timeouts in a row a send will put up with
+        windowSize: The default number of packets windowSend keeps in flight
+        sendSeq: The next sequence number we will use for each peer
+        sendLocks: The [lock,users,failures] of every peer we are sending
+                   to, so sends to the same peer go one at a time like in
+                   UDPSocket
+        expectSeq: The next sequence number we expect from each peer
+        ackWaiters: The future of the send waiting on each peer, an ACK or
+                    a NACK from the peer finishes it
+        acks: The furthest ACK from each peer that its send hasn't looked
+              at yet. The send might be busy when an ACK comes, so it is
+              kept here instead of only being handed to the waiter
+        nacked: The packet each peer last NACKed that its send hasn't
+                looked at yet, see UDPSocket
+        duplicates: Remembers the packets we recently accepted from each
+                    peer, like in UDPSocket
+        metrics: The MetricsRegistry our metrics are kept in, many sockets
+                 can share one
+        traffic: The metrics of our socket, like in UDPSocket
+        inbound: A bounded queue of the data packets that have been
+                 recieved, when it is full new packets are dropped without
+                 an ACK like in UDPSocket
+        onData: If it is set, it is called with (data,(IP,PORT)) for every
+                data packet instead of putting it on the inbound queue
+        onBeat: Called with the (IP,PORT) tuple of the peer whenever a
+                heartbeat arrives, like in UDPSocket
+        admit: Called before a new packet is ACKed, like in UDPSocket
+        closed: A future that is done once the socket has been closed
+        batchSize: The most datagrams we read each time the socket is ready
+        ackDelay: How long an ACK can wait for later packets from the same
+                  peer, like in UDPSocket
+        ackDue: The ACK we owe each peer that hasn't been sent yet
+        ackTimer: The timer that sends the ACKs after ackDelay
+    """
+    def __init__(self,PORT=0,HOST='127.0.0.1',windowSize=8,codec='binary',
+                 inboundSize=1024,retries=5,minRto=0.05,maxRto=4.0,
+                 metrics=None,compression=True,batchSize=64,ackDelay=0.0):
+        self.HOST = HOST
+        self.PORT = PORT
+        self.transport = None
+        self.socket = None
+        self.closed = None
+        self.fragmenter = Fragmenter()
+        self.rtt = RTTEstimator(minRto=minRto,maxRto=maxRto)
+        self.retries = retries
+        self.windowSize = windowSize
+        self.sendSeq = dict()
+        self.sendLocks = dict()
+        self.expectSeq = dict()
+        self.ackWaiters = dict()
+        self.acks = dict()
+        self.nacked = dict()
+        self.duplicates = DuplicateCache()
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.traffic = TrafficMetrics(self.metrics)
+        self.codec = makeCodec(codec,self.traffic)
+        self.compression = self.codec.compression if compression else None
+        self.compressPeers = set()
+        self.inbound = asyncio.Queue(maxsize=inboundSize)
+        self.metrics.gauge('udp_inbound_depth',
+                           'Packets waiting on the inbound queue',
+                           self.inbound.qsize)
+        self.onData = None
+        self.onBeat = None
+        self.admit = None
+        self.batchSize = batchSize
+        self.ackDelay = ackDelay
+        self.ackDue = dict()
+        self.ackTimer = None
+    async def bind(self):
+        """
+        This method will bind the socket to our Port on the running event
+        loop, after which every datagram is handed to datagramReceived
+        """
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+        #We make the socket ourselves so we can read from it too
+        self.socket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        try:
+            self.socket.bind((self.HOST,self.PORT))
+        except OSError:
+            self.socket.close()
+            raise
+        await loop.create_datagram_endpoint(lambda: self,sock=self.socket)
+        return self
+    def connection_made(self,transport):
+        self.transport = transport
+        self.HOST,self.PORT = transport.get_extra_info('sockname')[:2]
+    def connection_lost(self,exception):
+        if not self.closed.done():
+            self.closed.set_result(None)
+    def datagram_received(self,data,address):
+        self.traffic.wakeups.inc()
+        self.dispatch(data,address)
+        #Read the rest of what has arrived before going back to the loop
+        for i in range(self.batchSize - 1):
+            if self.transport.is_closing():
+                break
+            try:
+                data,address = self.socket.recvfrom(BUFFERSIZE)
+            except OSError:
+                #Nothing else has arrived (anything worse is reported to
+                 # the transport the next time it reads)
+                break
+            self.dispatch(data,address)
+        self.flushAcks()
+    def dispatch(self,data,address):
+        """
+        This method will handle one datagram, dropping and counting it if
+        that fails (like a bad admit or onBeat), like the dispatcher of the
+        UDPSocket does
+        """
+        try:
+            self.datagramReceived(data,address)
+        except Exception:
+            self.traffic.dropped.inc()
+    def send(self,MSG,PORT,IP='127.0.0.1'):
+        """
+        This method will send a packet to the destination Port and IP
+        """
+        self.sendRaw(self.codec.encode(MSG),PORT,IP)
+    def sendRaw(self,data,PORT,IP='127.0.0.1'):
+        """
+        This method will send bytes that have already been encoded
+        """
+        self.transport.sendto(data,(IP,PORT))
+        self.traffic.datagramsOut.inc()
+        self.traffic.bytesOut.inc(len(data))
+    def datagramReceived(self,data,address):
+        """
+        This method is called by the event loop for every datagram. ACKs wake
+        up the sends that are waiting on them and data packets that are in
+        order are ACKed and handed to onData (or the inbound queue).
+        """
+        self.traffic.datagramsIn.inc()
+        self.traffic.bytesIn.inc(len(data))
+        if self.fragmenter.isFragment(data):
+            data,status = self.fragmenter.add(data,address)
+            if status is not None:
+                self.sendRaw(status,address[1],address[0])
+            if data is None:
+                return None
+        elif self.fragmenter.isStatus(data):
+            for fragment in self.fragmenter.handleStatus(data,address):
+                self.sendRaw(fragment,address[1],address[0])
+            return None
+        rdata = self.codec.decode(data)
+        if UDPSocket.isAck(rdata):
+            #The ACKs are cumulative so the furthest one is all the send
+             # needs, even if a few came before it looked
+            ACK = self.acks.get(address)
+            if ACK is None or rdata[1] > ACK:
+                self.acks[address] = rdata[1]
+            self.wake(address)
+            return None
+        if UDPSocket.isNack(rdata):
+            #The send to this peer checks whether it is one of its packets
+            self.nacked[address] = rdata[1]
+            self.wake(address)
+            return None
+        if UDPSocket.isBeat(rdata):
+            if self.onBeat is not None:
+                self.onBeat(address)
+            return None
+        if not UDPSocket.checkPacket(rdata):
+            return None
+        if self.onData is None and self.inbound.full():
+            #Nobody is keeping up with the packets, so we act like we never
+             # got this one and the sender will resend it later
+            return None
+        seq = rdata[0]
+        digest = zlib.crc32(data)
+        expected = self.expectSeq.get(address)
+        if seq == 0:
+            #Packet 1 is only sent once packet 0 is ACKed, so once we have
+             # accepted more than packet 0 a packet 0 has to be a new stream
+            if (expected in (None,1) and
+                    self.duplicates.seen(address,seq,digest)):
+                #We already have this one, our ACK must have been lost
+                self.traffic.duplicates.inc()
+                self.sendAck(seq,address)
+                return None
+            #This is a new stream from this peer
+            expected = seq
+        if expected is None:
+            #Only packet 0 can start a stream, so the peer has to start over
+            self.traffic.nacks.inc()
+            self.send(['NACK',seq],address[1],address[0])
+            return None
+        if seq == expected and self.admit is not None:
+            if not self.admit(rdata,address):
+                #We act like we never got it, like in UDPSocket
+                return None
+        if seq != expected:
+            #This packet is a duplicate or came out of order
+            if seq < expected:
+                self.traffic.duplicates.inc()
+            if expected > 0:
+                self.sendAck(expected-1,address)
+            return None
+        self.expectSeq[address] = seq + 1
+        self.duplicates.add(address,seq,digest)
+        self.sendAck(seq,address)
+        if self.onData is not None:
+            self.onData(rdata,address)
+        else:
+            self.inbound.put_nowait((rdata,address))
+        return None
+    def sendAck(self,seq,address):
+        """
+        This method will queue a cumulative ACK for a peer, replacing any ACK
+        for the peer that hasn't been sent yet
+        """
+        if address in self.ackDue:
+            self.traffic.acksCoalesced.inc()
+        self.ackDue[address] = seq
+    def flushAcks(self):
+        """
+        This method will send the queued ACKs, or start the timer that sends
+        them after ackDelay
+        """
+        if not self.ackDue or self.ackTimer is not None:
+            return None
+        if self.ackDelay > 0:
+            loop = asyncio.get_running_loop()
+            self.ackTimer = loop.call_later(self.ackDelay,self.sendAcks)
+        else:
+            self.sendAcks()
+        return None
+    def sendAcks(self):
+        self.ackTimer = None
+        due,self.ackDue = self.ackDue,dict()
+        if self.transport is None or self.transport.is_closing():
+            return None
+        for address,seq in due.items():
+            self.send(['ACK',seq],address[1],address[0])
+            self.traffic.acksSent.inc()
+        return None
+    def peerStats(self):
+        """
+        This method will return the round trip time estimates and the current
+        timeout for each peer, like UDPSocket.peerStats
+        """
+        return self.rtt.stats()
+    def wake(self,peer):
+        """
+        This method will wake up the send waiting on a peer, if there is one
+        """
+        waiter = self.ackWaiters.pop(peer,None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+    def forget(self,peer):
+        self.expectSeq.pop(peer,None)
+        self.duplicates.forget(peer)
+        self.compressPeers.discard(peer)
+    def allowCompression(self,peer):
+        if self.compression is None:
+            return False
+        self.compressPeers.add(peer)
+        return True
+    def compresses(self,peer):
+        return peer in self.compressPeers
+    async def secureRecieve(self):
+        """
+        This method will wait for the next data packet, which has already
+        been checked and ACKed
+
+        Output:
+            A tuple of the packet and the (IP,PORT) tuple of the sender
+        """
+        return await self.inbound.get()
+    async def secureSend(self,MSG,PORT,IP='127.0.0.1'):
+        """
+        This method will send a message and wait for it to be ACKed
+
+        Output:
+            200 - if the Message was sent successfully
+            100 - if the Message was not sent Successfully
+        """
+        return await self.windowSend([MSG],PORT,IP,windowSize=1)
+    async def windowSend(self,MSGS,PORT,IP='127.0.0.1',windowSize=None,
+                         onAck=None):
+        """
+        This method will send a list of messages using the same Go-Back-N
+        algorithm as UDPSocket.windowSend, except that waiting on an ACK
+        doesn't block anyone else
+
+        Output:
+            200 - if all of the Messages were sent successfully
+            100 - if the Messages were not sent Successfully
+        """
+        if windowSize is None:
+            windowSize = self.windowSize
+        peer = (socket.gethostbyname(IP),PORT)
+        #Only one send to a peer at a time, like in UDPSocket
+        entry = self.sendLocks.setdefault(peer,[asyncio.Lock(),0,0])
+        entry[1] += 1
+        failures = entry[2]
+        try:
+            async with entry[0]:
+                if entry[2] != failures:
+                    #The send we waited on gave up on the peer, like in
+                     # UDPSocket we give up too
+                    self.traffic.sendFailures.inc(1,peerLabel(peer))
+                    return 100
+                response = await self.goBackN(MSGS,peer,windowSize,onAck)
+                if response != 200:
+                    entry[2] += 1
+                return response
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.sendLocks[peer]
+    async def goBackN(self,MSGS,peer,windowSize,onAck):
+        """
+        This method does the sending for windowSend, once it holds the
+        peer's send lock
+        """
+        loop = asyncio.get_running_loop()
+        PORT,IP = peer[1],peer[0]
+        firstSeq,packets = self.preparePackets(MSGS,peer)
+        base = 0 #The oldest packet that hasn't been ACKed
+        nextPacket = 0 #The next packet we need to send
+        highest = 0 #Every packet before this one has been sent at least once
+        timeouts = 0
+        #When each packet was first sent, None once it has been resent
+        sentAt = [None] * len(packets)
+        #Anything left over is from an earlier send
+        self.acks.pop(peer,None)
+        self.nacked.pop(peer,None)
+        while base < len(packets):
+            #Fill up the window, the first packet of a new stream goes out on
+             # its own so that it is sure to arrive before the rest
+            window = 1 if firstSeq + base == 0 else windowSize
+            while nextPacket < len(packets) and nextPacket < base+window:
+                msgId,fragments = packets[nextPacket]
+                resend = nextPacket < highest
+                sentAt[nextPacket] = None if resend else loop.time()
+                if resend:
+                    self.traffic.retransmits.inc(1,peerLabel(peer))
+                if resend and msgId is not None:
+                    #We only resend the fragments the peer is missing
+                    fragments = self.fragmenter.resendList(peer,msgId)
+                for fragment in fragments:
+                    self.sendRaw(fragment,PORT,IP)
+                nextPacket += 1
+                highest = max(highest,nextPacket)
+            if peer not in self.acks and peer not in self.nacked:
+                waiter = loop.create_future()
+                self.ackWaiters[peer] = waiter
+                try:
+                    #wait doesn't swallow a cancel that comes just as the
+                     # waiter is finished, like wait_for can
+                    await asyncio.wait([waiter],timeout=self.rtt.rto(peer))
+                except asyncio.CancelledError:
+                    #Whoever is sending gave up on us, and the peer's idea
+                     # of our sequence numbers is now unknown so we start a
+                     # new stream
+                    self.fragmenter.releasePackets(packets,peer)
+                    self.sendSeq[peer] = 0
+                    raise
+                finally:
+                    waiter.cancel()
+                    if self.ackWaiters.get(peer) is waiter:
+                        del self.ackWaiters[peer]
+            ACK = self.acks.pop(peer,None)
+            nack = self.nacked.pop(peer,None)
+            if ACK is not None and ACK - firstSeq >= highest:
+                #We haven't sent that packet in this stream, the ACK is a
+                 # late one from a stream we gave up on
+                ACK = None
+                if nack is None:
+                    continue
+            if ACK is None and nack is None:
+                timeouts += 1
+                if timeouts >= self.retries:
+                    break
+                print("Timed Out, will try again...")
+                self.rtt.backoff(peer)
+                #Go back and resend everything that wasn't ACKed
+                nextPacket = base
+                continue
+            acked = -1 if ACK is None else ACK - firstSeq
+            if base <= acked < len(packets) and sentAt[acked] is not None:
+                sample = loop.time() - sentAt[acked]
+                self.rtt.sample(peer,sample)
+                self.traffic.ackRtt.observe(sample)
+            if acked >= base:
+                #The ACK is cumulative, so everything up to it got through
+                if onAck is not None:
+                    for index in range(base,min(acked+1,len(packets))):
+                        onAck(index)
+                base = min(acked + 1,len(packets))
+                timeouts = 0
+            if (nack is not None and
+                    firstSeq + base <= nack < firstSeq + len(packets)):
+                #The peer doesn't know our stream, so what is left goes out
+                 # as a new one
+                self.fragmenter.releasePackets(packets,peer)
+                self.sendSeq.pop(peer,None)
+                restartSeq,restart = self.preparePackets(MSGS[base:],peer)
+                firstSeq = restartSeq - base
+                packets[base:] = restart
+                nextPacket = highest = base
+        else:
+            self.fragmenter.releasePackets(packets,peer)
+            return 200
+        #The peer's idea of our sequence numbers is now unknown so we start
+         # a new stream
+        self.fragmenter.releasePackets(packets,peer)
+        self.sendSeq[peer] = 0
+        self.traffic.sendFailures.inc(1,peerLabel(peer))
+        print("Message was not Sent Successfully")
+        return 100
+    def preparePackets(self,MSGS,peer):
+        """
+        This method will number and encode messages for a peer, like
+        UDPSocket.preparePackets but without futures
+
+        Output:
+            A tuple of the first sequence number and the list of
+            (msgId,fragments) tuples
+        """
+        firstSeq = self.sendSeq.get(peer,0)
+        self.sendSeq[peer] = firstSeq + len(MSGS)
+        packets = []
+        compress = peer in self.compressPeers
+        for i,MSG in enumerate(MSGS):
+            packet = UDPSocket.makePacket(firstSeq+i,MSG[1],MSG[2])
+            data = self.codec.encode(packet,compress)
+            packets.append(self.fragmenter.split(data,peer))
+        return firstSeq,packets
+    def close(self):
+        """
+        This method will close the socket, sends that are still waiting on
+        an ACK will time out. The socket is closed on the next turn of the
+        event loop, closed can be awaited to know when the Port is free.
+        """
+        if self.ackTimer is not None:
+            self.ackTimer.cancel()
+            self.ackTimer = None
+        if self.transport is not None:
+            self.transport.close()
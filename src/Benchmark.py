@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds the benchmarks for the chat application. It starts a Server,
+# simulates many clients over loopback and reports how fast things were as
+# JSON, optionally comparing them to a saved baseline
+
+import os
+import sys
+import json
+import signal
+import math
+import time
+import queue
+import argparse
+import contextlib
+import threading
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from UDPSocket import UDPSocket
+from Server import Server
+from AsyncServer import AsyncServer
+from ShardedServer import ShardedServer
+from RateLimiter import RateLimiter
+from ImpairmentProxy import ImpairmentProxy,addImpairments,impairments
+
+#The Servers the benchmark can run
+SERVERS = {'sync':Server,'async':AsyncServer,'sharded':ShardedServer.serve}
+#The simulated clients register and send far faster than people do, so by
+ # default the Server's rate limits are raised out of their way
+LOADLIMITS = {command:(1e6,1e6) for command in RateLimiter.LIMITS}
+
+def runServer(serverType,PORT,limits):
+    """
+    This function runs in the process of the Server. It puts the process in
+    a group of its own so the Server and any processes it starts can be
+    stopped together. What the Server prints is thrown away so it doesn't
+    get mixed in with the JSON.
+    """
+    os.setpgrp()
+    sys.stdout = open(os.devnull,'w')
+    SERVERS[serverType](PORT,limits=limits)
+
+def runProxy(server,addresses,impair,control):
+    """
+    This function runs in the process of the ImpairmentProxy. It makes the
+    aliases of the clients before they start sending, so they know where to
+    reach each other, and sends them back over control with the address of
+    the proxy.
+    """
+    proxy = ImpairmentProxy(server[1],serverIP=server[0],**impair)
+    aliases = {address:proxy.alias(address) for address in addresses}
+    control.send((proxy.address,aliases))
+    proxy.serve(control)
+    proxy.close()
+
+class SimClient:
+    """
+    This class is a client without the user interface. It speaks the same
+    protocol as the Client class, but is driven by the benchmark instead of
+    by input().
+
+    Methods:
+        register:
+            Registers with the Server and waits for the table
+        deregister:
+            Deregisters and waits for the Server's ACK
+        sendDirect:
+            Sends a message straight to another client
+        sendToServer:
+            Sends a message to the Server to store for an offline client
+        readLoop:
+            Sorts the packets we recieve into messages and replies
+    Attributes:
+        udp: The UDPSocket of the client, bound to a free Port
+        nick: The Nickname of the client
+        address: The (IP,PORT) tuple the other clients reach us at
+        replies: The packets from the Server that aren't table updates or
+                 messages, like the ACK for dereg:
+        received: How many messages we have gotten
+        arrivals: The time each benchmark message arrived, by its ID
+    """
+    def __init__(self,nick,server,codec='binary'):
+        self.nick = nick
+        self.server = server
+        self.udp = UDPSocket(0,codec=codec)
+        self.address = self.udp.socket.getsockname()
+        self.replies = queue.Queue()
+        self.received = 0
+        self.arrivals = dict()
+        self.online = False
+        self.reader = threading.Thread(target=self.readLoop,daemon=True)
+        self.reader.start()
+
+    def readLoop(self):
+        """
+        This method runs in its own thread and keeps the inbound queue empty
+        so the Server never has to wait on us
+        """
+        while True:
+            data,address = self.udp.secureRecieve()
+            command = data[1]
+            if not isinstance(command,str):
+                self.replies.put(data)
+            elif command.startswith('delta') or command.startswith('ERROR'):
+                continue
+            elif command.startswith('MSG'):
+                self.arrived([data[2]])
+            elif command.startswith('batch'):
+                self.arrived(data[2])
+            else:
+                self.replies.put(data)
+
+    def arrived(self,messages):
+        now = time.perf_counter()
+        for message in messages:
+            #Benchmark messages are of the form 'nick: bench <ID>'
+            self.arrivals[message.rsplit(' ',1)[-1]] = now
+        self.received += len(messages)
+
+    def waitReply(self,test,timeout):
+        """
+        This method will wait for a reply from the Server that passes test,
+        throwing away the ones that don't
+
+        Output:
+            The reply - if it came in time
+            None - otherwise
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                data = self.replies.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if test(data):
+                return data
+
+    def register(self,timeout=10.0):
+        """
+        This method will register with the Server
+
+        Output:
+            200 - if we got the table back
+            100 - otherwise
+        """
+        response = self.udp.secureSend([1,'reg:',self.nick],self.server[1],
+                                       self.server[0])
+        if response != 200:
+            return 100
+        reply = self.waitReply(lambda data: str(data[1]).startswith('update'),
+                               timeout)
+        if reply is None:
+            return 100
+        self.online = True
+        return 200
+
+    def deregister(self,timeout=10.0):
+        """
+        This method will deregister from the Server and wait for its ACK
+        """
+        self.online = False
+        response = self.udp.secureSend([1,'dereg:',self.nick],self.server[1],
+                                       self.server[0])
+        if response != 200:
+            return 100
+        reply = self.waitReply(lambda data: data[2] == 'ACK',timeout)
+        return 200 if reply is not None else 100
+
+    def sendDirect(self,peer,message):
+        return self.udp.secureSend([1,'MSG:'+peer.nick,message],
+                                   peer.address[1],peer.address[0])
+
+    def sendToServer(self,nick,message):
+        return self.udp.secureSend([1,'MSG:'+nick,message],self.server[1],
+                                   self.server[0])
+
+    def close(self):
+        self.udp.close()
+
+class Benchmark:
+    """
+    This class will run the benchmark scenarios. Every scenario gets a new
+    Server (in its own process, so it doesn't share the GIL with the
+    clients) and a new set of simulated clients.
+
+    Impairments:
+        With impair (the arguments of an ImpairmentProxy, like
+        {'loss':0.01,'delay':0.02,'seed':1}) every scenario runs through an
+        ImpairmentProxy in a process of its own, so the clients talk to the
+        Server and to each other over a network that loses, duplicates,
+        reorders, delays and slows down datagrams. What the proxy did is
+        added to the results of each scenario under 'proxy'.
+
+    Scenarios:
+        registration: Every client registers at the same time
+        direct: Clients send messages straight to each other
+        offline: Half of the clients go offline, the other half send them
+                 messages through the Server and then they come back and
+                 get them (store and forward)
+        churn: Every client deregisters and registers again a few times
+
+    Methods:
+        run:
+            Runs the scenarios and returns the results
+        summarize:
+            Turns the latencies of a scenario into its results
+        compare:
+            Finds the results that got worse than a baseline
+    Attributes:
+        serverType: 'sync', 'async' or 'sharded'
+        clients: How many clients to simulate
+        messages: How many messages each client sends
+        cycles: How many times each client deregisters in the churn scenario
+        concurrency: How many clients do something at the same time
+        port: The Port of the Server
+        impair: The impairments of the proxy, None to run without one
+        limits: The rate limits of the Server, None for its own
+        target: The address the clients send to, the Server's or the
+                proxy's
+    """
+    SCENARIOS = ['registration','direct','offline','churn']
+
+    def __init__(self,serverType='sync',clients=200,messages=20,cycles=3,
+                 concurrency=64,port=51000,codec='binary',impair=None,
+                 limits=LOADLIMITS):
+        self.serverType = serverType
+        self.clients = clients
+        self.messages = messages
+        self.cycles = cycles
+        self.concurrency = concurrency
+        self.port = port
+        self.codec = codec
+        self.server = ('127.0.0.1',port)
+        self.impair = impair
+        self.limits = limits
+        self.target = self.server
+        self.proxy = None
+
+    def startServer(self):
+        """
+        This method will start the Server in its own process
+        """
+        context = multiprocessing.get_context('fork')
+        self.process = context.Process(target=runServer,
+                                       args=(self.serverType,self.port,
+                                             self.limits))
+        self.process.start()
+        #Give it a moment to bind its socket
+        time.sleep(0.5)
+
+    def stopServer(self):
+        #The sharded Server starts processes of its own, so we kill the
+         # whole group of them
+        os.killpg(self.process.pid,signal.SIGKILL)
+        self.process.join()
+
+    def startProxy(self,clients):
+        """
+        This method will start the ImpairmentProxy in its own process and
+        point the clients at it, and at each other's aliases
+        """
+        context = multiprocessing.get_context('fork')
+        self.control,control = context.Pipe()
+        addresses = [client.address for client in clients]
+        self.proxy = context.Process(target=runProxy,args=(self.server,
+                                     addresses,self.impair,control))
+        self.proxy.start()
+        self.target,aliases = self.control.recv()
+        for client in clients:
+            client.server = self.target
+            client.address = aliases[client.address]
+
+    def stopProxy(self):
+        """
+        This method will stop the proxy and return what it did
+        """
+        self.control.send('stop')
+        stats = self.control.recv() if self.control.poll(5.0) else None
+        self.proxy.join(5.0)
+        if self.proxy.is_alive():
+            self.proxy.kill()
+        self.proxy = None
+        self.target = self.server
+        return stats
+
+    def makeClients(self,prefix):
+        return [SimClient('{}{}'.format(prefix,i),self.server,self.codec)
+                for i in range(self.clients)]
+
+    def closeClients(self,clients):
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            list(executor.map(SimClient.close,clients))
+
+    def heartbeat(self,clients,stop,keepalive=5.0):
+        """
+        This method runs in its own thread and sends heartbeats for all of
+        the clients that are online, so the Server doesn't time them out
+        """
+        count = 0
+        while not stop.wait(keepalive):
+            count += 1
+            for client in clients:
+                if client.online:
+                    client.udp.send(['BEAT',count],self.target[1],
+                                    self.target[0])
+
+    def timed(self,executor,function,items):
+        """
+        This method will call function on every item using the executor and
+        time each call
+
+        Output:
+            A tuple of the latencies of the calls that succeeded (in
+            seconds), the number that failed and the wall time of all of them
+        """
+        def call(item):
+            start = time.perf_counter()
+            response = function(item)
+            return response,time.perf_counter() - start
+        start = time.perf_counter()
+        results = list(executor.map(call,items))
+        seconds = time.perf_counter() - start
+        latencies = [latency for response,latency in results
+                     if response == 200]
+        return latencies,len(results) - len(latencies),seconds
+
+    def run(self,scenarios=None):
+        """
+        This method will run the scenarios and return their results, keyed
+        by the name of the scenario
+        """
+        results = dict()
+        for name in scenarios or self.SCENARIOS:
+            self.startServer()
+            clients = self.makeClients(name[:3])
+            if self.impair is not None:
+                self.startProxy(clients)
+            stop = threading.Event()
+            beats = threading.Thread(target=self.heartbeat,
+                                     args=(clients,stop),daemon=True)
+            beats.start()
+            try:
+                with ThreadPoolExecutor(self.concurrency) as executor:
+                    results[name] = getattr(self,name)(executor,clients)
+            finally:
+                stop.set()
+                if self.proxy is not None:
+                    proxy = self.stopProxy()
+                    if name in results:
+                        results[name]['proxy'] = proxy
+                self.stopServer()
+                self.closeClients(clients)
+        return results
+
+    def retransmits(self,clients):
+        return sum(client.udp.traffic.retransmits.total()
+                   for client in clients)
+
+    def registerAll(self,executor,clients):
+        self.timed(executor,SimClient.register,clients)
+
+    def registration(self,executor,clients):
+        latencies,errors,seconds = self.timed(executor,SimClient.register,
+                                              clients)
+        return self.summarize(latencies,errors,seconds,
+                              self.retransmits(clients))
+
+    def direct(self,executor,clients):
+        self.registerAll(executor,clients)
+        before = self.retransmits(clients)
+        #Every client sends messages to the next one
+        sent = dict()
+        def send(index):
+            client = clients[index]
+            peer = clients[(index + 1) % len(clients)]
+            for i in range(self.messages):
+                msgId = '{}-{}'.format(index,i)
+                sent[msgId] = (peer,time.perf_counter())
+                client.sendDirect(peer,'{}: bench {}'.format(client.nick,
+                                                             msgId))
+        start = time.perf_counter()
+        list(executor.map(send,range(len(clients))))
+        seconds = time.perf_counter() - start
+        latencies = [peer.arrivals[msgId] - sentAt
+                     for msgId,(peer,sentAt) in sent.items()
+                     if msgId in peer.arrivals]
+        #Messages that failed to send never arrived either
+        errors = len(sent) - len(latencies)
+        return self.summarize(latencies,errors,seconds,
+                              self.retransmits(clients) - before)
+
+    def offline(self,executor,clients):
+        self.registerAll(executor,clients)
+        half = len(clients) // 2
+        senders,receivers = clients[:half],clients[half:]
+        list(executor.map(SimClient.deregister,receivers))
+        before = self.retransmits(clients)
+        def send(index):
+            client = senders[index]
+            peer = receivers[index % len(receivers)]
+            for i in range(self.messages):
+                message = '{}: bench {}-{}'.format(client.nick,index,i)
+                client.sendToServer(peer.nick,message)
+        #Sender i sends its messages to receiver i % len(receivers)
+        expected = Counter(i % len(receivers) for i in range(len(senders)))
+        start = time.perf_counter()
+        list(executor.map(send,range(len(senders))))
+        #Now the receivers come back and should get everything
+        def collect(index):
+            client = receivers[index]
+            waiting = self.messages * expected[index]
+            started = time.perf_counter()
+            if client.register() != 200:
+                return []
+            deadline = time.monotonic() + 10.0
+            while client.received < waiting and time.monotonic() < deadline:
+                time.sleep(0.001)
+            return [arrival - started for arrival in client.arrivals.values()]
+        latencies = []
+        for arrived in executor.map(collect,range(len(receivers))):
+            latencies += arrived
+        seconds = time.perf_counter() - start
+        errors = self.messages * len(senders) - len(latencies)
+        return self.summarize(latencies,errors,seconds,
+                              self.retransmits(clients) - before)
+
+    def churn(self,executor,clients):
+        self.registerAll(executor,clients)
+        before = self.retransmits(clients)
+        def cycle(client):
+            latencies = []
+            for i in range(self.cycles):
+                for operation in (client.deregister,client.register):
+                    start = time.perf_counter()
+                    if operation() == 200:
+                        latencies.append(time.perf_counter() - start)
+            return latencies
+        start = time.perf_counter()
+        latencies = []
+        for done in executor.map(cycle,clients):
+            latencies += done
+        seconds = time.perf_counter() - start
+        errors = 2 * self.cycles * len(clients) - len(latencies)
+        return self.summarize(latencies,errors,seconds,
+                              self.retransmits(clients) - before)
+
+    @staticmethod
+    def percentile(ordered,fraction):
+        if not ordered:
+            return None
+        index = max(0,math.ceil(fraction * len(ordered)) - 1)
+        return ordered[min(index,len(ordered)-1)]
+
+    def summarize(self,latencies,errors,seconds,retransmits):
+        """
+        This method will turn the latencies of a scenario into its results
+
+        Output:
+            A dictionary with the number of operations that succeeded and
+            failed, the wall time, the throughput (operations per second),
+            the latency percentiles in milliseconds and the retransmissions
+        """
+        ordered = sorted(latencies)
+        def ms(value):
+            return None if value is None else round(value * 1000,3)
+        return {'ops':len(ordered),'errors':errors,
+                'seconds':round(seconds,3),
+                'throughput':round(len(ordered) / seconds,1) if seconds else 0,
+                'latencyMs':{'p50':ms(self.percentile(ordered,0.50)),
+                             'p99':ms(self.percentile(ordered,0.99)),
+                             'p999':ms(self.percentile(ordered,0.999)),
+                             'max':ms(ordered[-1] if ordered else None)},
+                'retransmits':retransmits}
+
+    @staticmethod
+    def compare(results,baseline,tolerance=0.2):
+        """
+        This method will compare results to a baseline. A scenario regressed
+        if its throughput dropped, or its p99 latency or error count went up,
+        by more than the tolerance.
+
+        Parameters:
+            results: The scenarios of a run
+            baseline: The scenarios of the baseline run
+            tolerance: How much worse (as a fraction) is still fine
+        Output:
+            A list of strings describing each regression
+        """
+        regressions = []
+        for name,result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            if result['throughput'] < base['throughput'] * (1 - tolerance):
+                regressions.append('{}: throughput {} < {}'.format(
+                    name,result['throughput'],base['throughput']))
+            p99,baseP99 = result['latencyMs']['p99'],base['latencyMs']['p99']
+            if (p99 is not None and baseP99 is not None and
+                    p99 > baseP99 * (1 + tolerance)):
+                regressions.append('{}: p99 {}ms > {}ms'.format(
+                    name,p99,baseP99))
+            if result['errors'] > base['errors']:
+                regressions.append('{}: errors {} > {}'.format(
+                    name,result['errors'],base['errors']))
+        return regressions
+
+def Main(arguments):
+    """
+    This method will run the benchmarks from the command line, print the
+    results as JSON and return 1 if anything regressed from the baseline
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the chat Server')
+    parser.add_argument('--server',default='sync',
+                        choices=['sync','async','sharded'])
+    parser.add_argument('--clients',type=int,default=200)
+    parser.add_argument('--messages',type=int,default=20)
+    parser.add_argument('--cycles',type=int,default=3)
+    parser.add_argument('--concurrency',type=int,default=64)
+    parser.add_argument('--port',type=int,default=51000)
+    parser.add_argument('--scenario',action='append',
+                        choices=Benchmark.SCENARIOS,
+                        help='Can be given more than once, all by default')
+    parser.add_argument('--output',help='Also write the results here')
+    parser.add_argument('--baseline',help='Results to compare against')
+    parser.add_argument('--tolerance',type=float,default=0.2)
+    parser.add_argument('--impair',action='store_true',
+                        help='Run through an ImpairmentProxy')
+    parser.add_argument('--rate-limits',action='store_true',
+                        help="Keep the Server's own rate limits")
+    addImpairments(parser)
+    options = parser.parse_args(arguments)
+    impair = impairments(options) if options.impair else None
+    benchmark = Benchmark(options.server,options.clients,options.messages,
+                          options.cycles,options.concurrency,options.port,
+                          impair=impair,
+                          limits=None if options.rate_limits else LOADLIMITS)
+    #The sockets print when they time out, that goes to stderr so stdout
+     # is only the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        scenarios = benchmark.run(options.scenario)
+    report = {'server':options.server,'clients':options.clients,
+              'messages':options.messages,'cycles':options.cycles,
+              'rateLimits':options.rate_limits,'scenarios':scenarios}
+    if impair is not None:
+        report['impairment'] = impair
+    if options.baseline:
+        with open(options.baseline) as baseline:
+            report['regressions'] = Benchmark.compare(
+                report['scenarios'],json.load(baseline)['scenarios'],
+                options.tolerance)
+    text = json.dumps(report,indent=2)
+    print(text)
+    if options.output:
+        with open(options.output,'w') as output:
+            output.write(text + '\n')
+    return 1 if report.get('regressions') else 0
+
+if __name__ == '__main__':
+    sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds the cache the reciever uses to recognize packets it has
+# already accepted so that resent packets aren't processed twice
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+class DuplicateCache:
+    """
+    This class will remember the packets that were recently accepted from
+    each peer, keyed by the (sender,sequence number) pair along with a digest
+    of the packet's bytes. The sliding window already throws away old
+    packets, but when a packet with sequence number 0 arrives it could be a
+    resent copy of the start of the stream (whose ACK was lost) or a peer
+    starting a new stream, and only the digest can tell them apart.
+
+    Methods:
+        seen:
+            Whether a packet was already accepted from a peer
+        add:
+            Remembers a packet that was accepted from a peer
+        forget:
+            Forgets every packet from a peer
+    Attributes:
+        perPeer: The most packets we remember for each peer
+        maxPeers: The most peers we remember packets for, the least recently
+                  used ones are forgotten first
+        ttl: How many seconds we remember a packet for
+        peers: {peer:OrderedDict({seq:(digest,time)})}, oldest first
+    """
+    def __init__(self,perPeer=64,maxPeers=4096,ttl=30.0):
+        self.perPeer = perPeer
+        self.maxPeers = maxPeers
+        self.ttl = ttl
+        self.peers = OrderedDict()
+        self.lock = Lock()
+
+    def seen(self,peer,seq,digest):
+        """
+        This method will check if a packet was already accepted
+
+        Parameters:
+            peer: The (IP,PORT) tuple of the sender
+            seq: The sequence number of the packet
+            digest: A checksum of the packet's bytes
+        Output:
+            True - if we accepted the same packet less than ttl seconds ago
+            False - otherwise
+        """
+        now = time.monotonic()
+        with self.lock:
+            packets = self.peers.get(peer)
+            if packets is None:
+                return False
+            self.expire(packets,now)
+            entry = packets.get(seq)
+            return entry is not None and entry[0] == digest
+
+    def add(self,peer,seq,digest):
+        """
+        This method will remember a packet that was accepted from a peer
+        """
+        now = time.monotonic()
+        with self.lock:
+            packets = self.peers.get(peer)
+            if packets is None:
+                packets = OrderedDict()
+                self.peers[peer] = packets
+                if len(self.peers) > self.maxPeers:
+                    self.peers.popitem(last=False)
+            else:
+                self.peers.move_to_end(peer)
+            packets.pop(seq,None)
+            packets[seq] = (digest,now)
+            if len(packets) > self.perPeer:
+                packets.popitem(last=False)
+            self.expire(packets,now)
+
+    def forget(self,peer):
+        with self.lock:
+            self.peers.pop(peer,None)
+
+    def expire(self,packets,now):
+        """
+        This method will forget the packets of a peer that are older than
+        the ttl. They are ordered by when we got them so we only need to look
+        at the front. The lock must be held.
+        """
+        while packets:
+            seq,(digest,added) = next(iter(packets.items()))
+            if now - added < self.ttl:
+                break
+            packets.popitem(last=False)
@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds a version of the Server that runs as one node of a federation
+# of Servers, each on its own Port (or host), so no one Server has to know
+# every client
+
+import hmac
+import time
+import random
+import socket
+import hashlib
+import itertools
+from threading import Lock,Thread
+from UDPSocket import UDPSocket
+from WorkerPool import WorkerPool
+from Server import Server
+
+class FederatedServer(Server):
+    """
+    This class is a Server that works together with other Servers, called
+    nodes. Each node owns the nicknames that registered with it: it keeps
+    their entries, sends them table updates and stores their messages, the
+    same way a Server does. The nodes talk to each other over the same UDP
+    protocol the clients use, so a node is just another peer of the socket.
+
+    Gossip:
+        Every gossipInterval a node sends a few other nodes a digest of
+        the version of every node's membership it knows of, as
+        'gossip:' {node:version}. The node that gets it answers with
+        'members:' holding the memberships it has that are newer, of the
+        form {node:[version,{Nick:Online}]}, and the nodes it wants newer
+        memberships of, which are sent back the same way. A node's version
+        is its tableVersion (with the time it started, so a node that
+        restarts isn't mistaken for an old one), so any change to its table
+        gets around. Memberships are passed along to nodes that never talk
+        to the owner directly.
+
+    Trust:
+        Anyone can send us a datagram, so only nodes can gossip with us or
+        send us memberships and requests. The nodes are the ones we were
+        started with and the ones the nodes tell us about in their digests
+        and memberships. A node we don't know yet can only join by
+        gossiping to us with a secret the whole federation shares, the
+        digest then comes as [digest,proof] where proof is an HMAC of its
+        own 'IP:PORT' keyed by the secret. Without a secret, every node has
+        to be told about the new one. Digests and memberships that aren't
+        the shape they should be are disregarded.
+
+    Routing:
+        The memberships make up the routing table, the node that owns each
+        nickname we don't. A client that sends 'MSG:<Nick>' for a nickname
+        on another node has it relayed there as 'relay:<Nick>', and that
+        node delivers or stores it and answers with 'relayed:<Nick>' and
+        what happened, which we pass on to the client like storeMessage
+        does. A 'lookup:<Nick>' for a nickname on another node is asked of
+        that node and its 'found:<Nick>' answer is passed on. Nodes never
+        wait on each other's answers, they are matched up with the request
+        by its id. A nickname that another node owns can't register here.
+
+    Methods:
+        Constructor:
+            Starts a node on a Port, knowing the addresses of some others
+        gossip:
+            Sends a few nodes our digest
+        processMessage:
+            Handles the requests of other nodes, and the rest like Server
+        handleGossip/handleMembers:
+            Answers a digest, and applies the memberships that are newer
+        storeMessage/lookupUser:
+            Relay the request to the owner of a nickname on another node
+        handleRelay/handleLookup:
+            Run on the owner when another node relays a request
+        admit:
+            Only checks the rate limits of clients, not of other nodes
+        handleAnswer:
+            Passes an answer from another node on to the client that asked
+        routeSize:
+            How many nicknames are in the routing table
+    Attributes:
+        nodeId: Our name in the memberships, 'IP:PORT'
+        nodes: The (IP,PORT) of every other node we know of
+        secret: The bytes the nodes of the federation prove they are one
+                with, or None if only nodes we were told about can join
+        memberships: {node:[version,{Nick:Online}]} for every other node
+        routes: The node that owns every nickname on another node
+        pending: The requests waiting on another node, keyed by their id
+        gossipInterval: How often we gossip
+        fanout: How many nodes we gossip to each time
+        requestTimeout: How long we wait for another node to answer
+        nodeTime: A histogram of how long other nodes take to answer
+    """
+    COMMANDS = Server.COMMANDS + ('gossip','members','relay','relayed',
+                                  'found')
+
+    def __init__(self,PORT,nodes,HOST='127.0.0.1',codec='binary',workers=8,
+                 queueSize=256,store=None,keepalive=5.0,misses=3,
+                 metricsPort=None,compression=True,snapshotDir=None,
+                 snapshotInterval=1.0,limits=None,spoolDir=None,
+                 gossipInterval=1.0,fanout=2,requestTimeout=10.0,
+                 secret=None):
+        """
+        Parameters:
+            PORT: The Port our clients and the other nodes talk to us on
+            nodes: A list of (IP,PORT) tuples of other nodes, we learn about
+                   the rest of them through gossip
+            secret: A string every node of the federation is started with,
+                    so nodes we weren't told about can join
+        """
+        self.udp = UDPSocket(PORT,HOST,codec=codec,compression=compression)
+        self.pool = WorkerPool(workers,queueSize)
+        self.initState(store,keepalive=keepalive,misses=misses,
+                       limits=limits)
+        if self.initSnapshots(snapshotDir,snapshotInterval):
+            Thread(target=self.updateAllClients,daemon=True).start()
+        self.initFiles(spoolDir)
+        self.initFederation(nodes,gossipInterval,fanout,requestTimeout,
+                            secret)
+        self.initMetrics(self.udp.metrics,metricsPort)
+        self.metrics.gauge('server_worker_queue_depth',
+                           'Messages waiting for a worker',self.pool.depth)
+        self.udp.onBeat = self.clientBeat
+        self.udp.admit = self.admit
+        self.watcher = Thread(target=self.watchSessions,daemon=True)
+        self.watcher.start()
+        self.gossiper = Thread(target=self.gossipLoop,daemon=True)
+        self.gossiper.start()
+        print("Node {} all set up! Waiting for Connections".format(
+            self.nodeId))
+        self.MainThread()
+
+    def initFederation(self,nodes,gossipInterval=1.0,fanout=2,
+                       requestTimeout=10.0,secret=None):
+        """
+        This method will set up what we know about the other nodes
+        """
+        self.nodeId = self.nodeName((socket.gethostbyname(self.udp.HOST),
+                                     self.udp.PORT))
+        self.started = int(time.time() * 1000)
+        self.secret = secret.encode('utf-8') if secret else None
+        self.nodes = set()
+        for IP,PORT in nodes:
+            self.addNode(self.nodeName((socket.gethostbyname(IP),PORT)))
+        self.memberships = dict()
+        self.routes = dict()
+        self.pending = dict()
+        self.requestIds = itertools.count(1)
+        self.gossipInterval = gossipInterval
+        self.fanout = fanout
+        self.requestTimeout = requestTimeout
+        self.federationLock = Lock()
+
+    def initMetrics(self,metrics,metricsPort=None):
+        Server.initMetrics(self,metrics,metricsPort)
+        self.nodeTime = metrics.histogram('federation_request_seconds',
+            'Time for another node to answer a relayed request','node')
+        metrics.gauge('federation_routes',
+                      'Nicknames in the routing table',self.routeSize)
+        metrics.gauge('federation_nodes','Other nodes we know of',
+                      lambda: len(self.nodes))
+
+    @staticmethod
+    def nodeName(address):
+        return '{}:{}'.format(address[0],address[1])
+
+    @staticmethod
+    def nodeAddress(node):
+        IP,colon,PORT = node.rpartition(':')
+        return (IP,int(PORT))
+
+    def addNode(self,node):
+        #The federationLock must be held when it is called
+        if node != self.nodeId:
+            self.nodes.add(self.nodeAddress(node))
+
+    @staticmethod
+    def isNode(node):
+        """
+        This method will check that a node from another node is a name of
+        the form 'IP:PORT'
+        """
+        if not isinstance(node,str):
+            return False
+        IP,colon,PORT = node.rpartition(':')
+        return bool(IP) and PORT.isdigit() and 0 < int(PORT) < 65536
+
+    @staticmethod
+    def isVersion(version):
+        #A version is [started,tableVersion]
+        return (isinstance(version,list) and len(version) == 2 and
+                all(type(number) is int for number in version))
+
+    def proof(self,node):
+        """
+        This method will return the proof a node gossips with, an HMAC of
+        its name keyed by the secret
+        """
+        return hmac.new(self.secret,node.encode('utf-8'),
+                        hashlib.sha256).digest()
+
+    def routeSize(self):
+        return len(self.routes)
+
+    def version(self):
+        return [self.started,self.tableVersion]
+
+    def membership(self):
+        """
+        This method will return our own membership, {Nick:Online} for every
+        client registered with us
+        """
+        with self.tableLock:
+            return {nick:entry['Online']
+                    for nick,entry in list(self.clientTable.items())}
+
+    def gossipLoop(self):
+        """
+        This method runs in its own thread, it gossips every gossipInterval
+        and gives up on the requests that weren't answered in time
+        """
+        while True:
+            time.sleep(self.gossipInterval)
+            self.expireRequests()
+            self.gossip()
+
+    def gossip(self):
+        """
+        This method will send a few of the other nodes our digest
+        """
+        with self.federationLock:
+            digest = {node:membership[0]
+                      for node,membership in self.memberships.items()}
+            nodes = random.sample(sorted(self.nodes),
+                                  min(self.fanout,len(self.nodes)))
+        digest[self.nodeId] = self.version()
+        if self.secret is not None:
+            digest = [digest,self.proof(self.nodeId)]
+        for IP,PORT in nodes:
+            self.udp.secureSend([1,'gossip:',digest],PORT,IP)
+        return None
+
+    def admit(self,data,address):
+        """
+        This method will let the requests of other nodes through, they carry
+        the requests of many clients that were already limited
+        """
+        if address in self.nodes:
+            return True
+        return Server.admit(self,data,address)
+
+    def processMessage(self,data,address):
+        """
+        This method will handle the requests of the other nodes, anything
+        from a client goes to Server.processMessage
+        """
+        command = str(data[1]).split(':')
+        if command[0] == 'gossip':
+            digest = self.checkGossip(data[2],address)
+            if digest is not None:
+                self.handleGossip(digest,address)
+            return None
+        if address not in self.nodes:
+            return Server.processMessage(self,data,address)
+        if command[0] == 'members':
+            self.handleMembers(data[2],address)
+        elif command[0] == 'relay':
+            self.handleRelay(command[1],data[2],address)
+        elif command[0] == 'lookup':
+            self.handleLookup(command[1],data[2],address)
+        elif command[0] in ('relayed','found'):
+            self.handleAnswer(command[0],command[1],data[2],address)
+        else:
+            print("Incorrect Command from {}".format(self.nodeName(address)))
+        return None
+
+    def checkGossip(self,data,address):
+        """
+        This method will check that gossip is from a node, letting a node we
+        don't know join if it proved it knows the secret
+
+        Output:
+            The digest - if it is from a node and is {node:version}
+            None - otherwise
+        """
+        digest = data
+        if isinstance(data,list) and len(data) == 2:
+            digest,proof = data
+            if (address not in self.nodes and self.secret is not None and
+                    isinstance(proof,bytes) and hmac.compare_digest(
+                        proof,self.proof(self.nodeName(address)))):
+                #A node we don't know yet is joining the federation
+                with self.federationLock:
+                    self.addNode(self.nodeName(address))
+        if address not in self.nodes:
+            print("Gossip from {}, which isn't a node".format(
+                self.nodeName(address)))
+            return None
+        if not isinstance(digest,dict) or not all(
+                self.isNode(node) and self.isVersion(version)
+                for node,version in digest.items()):
+            return None
+        return digest
+
+    def handleGossip(self,digest,address):
+        """
+        This method will answer a digest with the memberships we have that
+        are newer and the ones we want
+
+        Parameters:
+            digest: {node:version} of the node that sent it
+            address: The (IP,PORT) of the node that sent it
+        """
+        newer = self.newerMemberships(digest)
+        want = []
+        with self.federationLock:
+            for node,version in digest.items():
+                self.addNode(node)
+                known = self.memberships.get(node)
+                if node != self.nodeId and (known is None or
+                                            known[0] < version):
+                    want.append(node)
+        if newer or want:
+            self.udp.secureSend([1,'members:',{'view':newer,'want':want}],
+                                address[1],address[0])
+        return None
+
+    def newerMemberships(self,digest,nodes=None):
+        """
+        This method will return the memberships we have that are newer than
+        the versions in a digest
+
+        Parameters:
+            nodes: Only look at these nodes, if it is given
+        """
+        newer = dict()
+        with self.federationLock:
+            for node,membership in self.memberships.items():
+                if nodes is not None and node not in nodes:
+                    continue
+                if node not in digest or digest[node] < membership[0]:
+                    newer[node] = membership
+        if nodes is None or self.nodeId in nodes:
+            version = self.version()
+            if self.nodeId not in digest or digest[self.nodeId] < version:
+                newer[self.nodeId] = [version,self.membership()]
+        return newer
+
+    def handleMembers(self,members,address):
+        """
+        This method will apply the memberships another node sent us and send
+        it the ones it wants
+
+        Parameters:
+            members: {'view':{node:[version,{Nick:Online}]},'want':[nodes]}
+            address: The (IP,PORT) of the node that sent it
+        """
+        if not self.isMembers(members):
+            print("Bad memberships from {}".format(self.nodeName(address)))
+            return None
+        with self.federationLock:
+            for node,(version,nicks) in members['view'].items():
+                if node == self.nodeId:
+                    continue
+                self.addNode(node)
+                known = self.memberships.get(node)
+                if known is not None and known[0] >= version:
+                    continue
+                if known is not None:
+                    for nick in known[1]:
+                        if self.routes.get(nick) == node:
+                            del self.routes[nick]
+                for nick in nicks:
+                    if nick in self.clientTable:
+                        print("{} is registered here and on {}".format(
+                            nick,node))
+                    self.routes[nick] = node
+                self.memberships[node] = [version,nicks]
+        if members['want']:
+            newer = self.newerMemberships(dict(),set(members['want']))
+            if newer:
+                self.udp.secureSend([1,'members:',{'view':newer,'want':[]}],
+                                    address[1],address[0])
+        return None
+
+    def isMembers(self,members):
+        """
+        This method will check that memberships from another node are the
+        shape handleMembers expects
+        """
+        if (not isinstance(members,dict) or
+                not isinstance(members.get('view'),dict) or
+                not isinstance(members.get('want'),list) or
+                not all(self.isNode(node) for node in members['want'])):
+            return False
+        for node,membership in members['view'].items():
+            if (not self.isNode(node) or not isinstance(membership,list) or
+                    len(membership) != 2 or
+                    not self.isVersion(membership[0]) or
+                    not isinstance(membership[1],dict)):
+                return False
+            if not all(isinstance(nick,str) for nick in membership[1]):
+                return False
+        return True
+
+    def registerUser(self,Nick,IP,PORT):
+        """
+        This method will register a client like Server.registerUser, unless
+        another node owns the nickname
+        """
+        if Nick not in self.clientTable and Nick in self.routes:
+            print("{} is registered with {}".format(Nick,self.routes[Nick]))
+            self.udp.secureSend([1,1,"ERROR"],PORT,IP)
+            return None
+        return Server.registerUser(self,Nick,IP,PORT)
+
+    def request(self,node,MSG,kind,nick,address):
+        """
+        This method will send a request to another node and remember who to
+        pass the answer on to
+
+        Parameters:
+            node: The node that owns the nickname
+            MSG: The request, its data is filled in with [id,data]
+            kind: 'relay' or 'lookup'
+            nick: The nickname the request is about
+            address: The address of the client that asked
+        """
+        requestId = next(self.requestIds)
+        with self.federationLock:
+            self.pending[requestId] = (kind,nick,address,node,
+                                       time.monotonic())
+        MSG = [MSG[0],MSG[1],[requestId,MSG[2]]]
+        IP,PORT = self.nodeAddress(node)
+        if self.udp.secureSend(MSG,PORT,IP) != 200:
+            with self.federationLock:
+                request = self.pending.pop(requestId,None)
+            if request is not None:
+                self.answer(kind,nick,address,None)
+        return None
+
+    def storeMessage(self,nick,MSG,address):
+        """
+        This method will handle a message for a client, the way
+        Server.storeMessage does if it is registered with us, otherwise it
+        is relayed to its node
+        """
+        if nick in self.clientTable:
+            return Server.storeMessage(self,nick,MSG,address)
+        node = self.routes.get(nick)
+        if node is None:
+            Error = [1,"ERROR","No Record of {}".format(nick)]
+            self.udp.secureSend(Error,address[1],address[0])
+            return None
+        self.request(node,[1,'relay:'+nick,MSG],'relay',nick,address)
+        return None
+
+    def lookupUser(self,nick,address):
+        """
+        This method will send a client the entry of another client, asking
+        its node for it if it is registered somewhere else
+        """
+        node = self.routes.get(nick)
+        if nick in self.clientTable or node is None:
+            return Server.lookupUser(self,nick,address)
+        self.request(node,[1,'lookup:'+nick,None],'lookup',nick,address)
+        return None
+
+    def handleRelay(self,nick,data,address):
+        """
+        This method will deliver or store a message another node relayed to
+        us and tell it what happened
+        """
+        requestId,MSG = data
+        result = 'unknown'
+        if nick in self.clientTable:
+            result = self.deliverMessage(nick,MSG)
+        self.udp.secureSend([1,'relayed:'+nick,[requestId,result]],
+                            address[1],address[0])
+        return None
+
+    def handleLookup(self,nick,data,address):
+        """
+        This method will send another node the entry of a client registered
+        with us
+        """
+        requestId,ignored = data
+        entry = self.clientTable.get(nick)
+        if entry is not None:
+            entry = dict(entry)
+        self.udp.secureSend([1,'found:'+nick,[requestId,entry]],
+                            address[1],address[0])
+        return None
+
+    def handleAnswer(self,command,nick,data,address):
+        """
+        This method will pass the answer to a request we relayed on to the
+        client that asked
+        """
+        requestId,value = data
+        with self.federationLock:
+            request = self.pending.pop(requestId,None)
+        if request is None:
+            #We already gave up on it
+            return None
+        kind,nick,client,node,sentAt = request
+        self.nodeTime.observe(time.monotonic() - sentAt,node)
+        self.answer(kind,nick,client,value)
+        return None
+
+    def answer(self,kind,nick,address,value):
+        """
+        This method will let a client know how its request went, None means
+        the other node didn't answer
+        """
+        if kind == 'lookup':
+            MSG = [1,'found:'+nick,value]
+        elif value == 'delivered':
+            MSG = [1,"ERROR",'The client is online!']
+        elif value == 'full':
+            MSG = [1,"ERROR","{} has too many messages waiting".format(nick)]
+        elif value == 'unknown':
+            MSG = [1,"ERROR","No Record of {}".format(nick)]
+        elif value is None:
+            MSG = [1,"ERROR","Couldn't reach the Server of {}".format(nick)]
+        else:
+            return None
+        self.udp.secureSend(MSG,address[1],address[0])
+        return None
+
+    def expireRequests(self):
+        """
+        This method will give up on the requests other nodes haven't
+        answered in requestTimeout
+        """
+        now = time.monotonic()
+        with self.federationLock:
+            expired = [(requestId,request)
+                       for requestId,request in self.pending.items()
+                       if now - request[4] > self.requestTimeout]
+            for requestId,request in expired:
+                del self.pending[requestId]
+        for requestId,(kind,nick,address,node,sentAt) in expired:
+            self.pool.submit(address,self.answer,kind,nick,address,None)
+        return None
+
+if __name__ == '__main__':
+    server = FederatedServer(50000,[('127.0.0.1',50001)])
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds the code that sends files between clients (or through the
+# Server) in chunks, so a file never has to fit in one packet or in memory,
+# and a transfer that is cut off can pick up where it stopped
+
+import os
+import json
+import mmap
+import zlib
+import hashlib
+from threading import Lock
+from TimerWheel import TimerWheel
+
+class FileTransfer:
+    """
+    This class will read the files we send in chunks and write the chunks
+    of the files we are sent to disk. It doesn't talk to the network, the
+    AsyncClient and the Server send the packets it makes and hand it the
+    ones that arrive.
+
+    Protocol:
+        The sender offers a file with 'offer:<id>' and
+        {'id','name','size','chunkSize','chunks','from','to'}, and the
+        reciever answers with 'accept:<id>' and the index of the first
+        chunk it needs (0 unless it has part of the file already from
+        before), or None if it won't take it. The chunks go out through the
+        sliding window as 'chunk:<id>' with [index,crc,bytes], a batch at a
+        time. At the end the sender sends 'done:<id>' and the reciever
+        answers with 'accept:<id>' again, which is the number of chunks if
+        it has all of them, otherwise the sender goes back to the chunk it
+        says. The id comes from the names of the clients and the file's
+        name, size and modification time, so offering the same file again
+        resumes it.
+
+    Recieving:
+        A chunk is only written if it is the next one we need and its crc
+        (the CRC32 of its bytes) is right, anything else is left for the
+        sender to send again. Chunks are written straight to <id>.part in
+        the directory, next to <id>.offer which holds the offer, so a
+        transfer can be resumed even after we restart. When the last chunk
+        is in, the file is moved to its name in the directory, or with
+        spool set (on the Server) it is kept as <id>.file until it is
+        passed on to the client it is for. A chunk that isn't
+        [int,int,bytes] or can't be written is treated like a bad one.
+
+    Quotas:
+        An offer is only taken if the files we hold (or have taken the
+        offers of) for the client it is for stay under maxPerNick bytes,
+        and all of them under maxSpool bytes. They are added up from the
+        saved offers, so they still count after a restart. A client only
+        keeps the offers of the files it is still recieving, so for it the
+        quotas are how much it takes in at once. Every file counts as at
+        least minCost bytes, so empty files can't be offered without end.
+
+    Open Transfers:
+        Every transfer we are recieving holds a file descriptor, so a sender
+        can only have maxOpen of them at once, and one that gets no chunks
+        for idleTimeout seconds is closed (the part we have stays, so it
+        can still be resumed). expire closes them, accept calls it and the
+        Server calls it as its timers go around.
+
+    Sending:
+        The file is mapped with mmap, so only the chunks of the batch being
+        sent are ever copied out of it.
+
+    Methods:
+        offer:
+            Makes the offer for a file
+        batches:
+            The chunk packets of a file, a batch at a time
+        accept:
+            Takes an offer and says which chunk to start from
+        write:
+            Writes a chunk that arrived
+        finish:
+            Checks whether we have every chunk and puts the file in place
+        expire:
+            Closes the transfers that have been idle too long
+        spooled/remove:
+            The files waiting for a client on the Server, and forgetting one
+            once it has been passed on
+    Attributes:
+        directory: Where the files we recieve are written
+        spool: Whether finished files are kept for passing on
+        chunkSize: The size of the chunks of the files we send
+        batchSize: How many chunks are sent through the window at once
+        maxChunk: The biggest chunks we will take
+        maxPerNick/maxSpool/minCost: The quotas, see Quotas
+        incoming: {id:[offer,file descriptor,next chunk,sender]} of the
+                  transfers we are recieving
+        maxOpen/idleTimeout: The limits on open transfers, see Open
+                             Transfers
+        timers: A TimerWheel with the idle timer of every open transfer
+        lock: Has to be held to change incoming or write to a transfer,
+              the Server's workers and its timers share them
+    """
+    def __init__(self,directory,spool=False,chunkSize=1024,batchSize=256,
+                 maxChunk=65536,maxPerNick=256*1024*1024,
+                 maxSpool=4*1024*1024*1024,minCost=4096,maxOpen=8,
+                 idleTimeout=60.0):
+        self.directory = directory
+        self.spool = spool
+        self.chunkSize = chunkSize
+        self.batchSize = batchSize
+        self.maxChunk = maxChunk
+        self.maxPerNick = maxPerNick
+        self.maxSpool = maxSpool
+        self.minCost = minCost
+        self.maxOpen = maxOpen
+        self.idleTimeout = idleTimeout
+        self.timers = TimerWheel(tick=idleTimeout/4)
+        self.incoming = dict()
+        self.lock = Lock()
+
+    def path(self,name):
+        return os.path.join(self.directory,name)
+
+    def offer(self,path,sender,reciever):
+        """
+        This method will make the offer for a file
+
+        Parameters:
+            path: Where the file is
+            sender/reciever: The Nicknames of the two clients
+        """
+        info = os.stat(path)
+        name = os.path.basename(path)
+        key = '{}|{}|{}|{}|{}'.format(sender,reciever,name,info.st_size,
+                                      info.st_mtime_ns)
+        chunks = -(-info.st_size // self.chunkSize)
+        return {'id':hashlib.sha1(key.encode('utf-8')).hexdigest()[:16],
+                'name':name,'size':info.st_size,'chunkSize':self.chunkSize,
+                'chunks':chunks,'from':sender,'to':reciever}
+
+    def batches(self,offer,path,start=0):
+        """
+        This method will yield the packets of the chunks of a file from the
+        chunk start on, a list of batchSize of them at a time
+        """
+        if offer['size'] == 0:
+            return
+        size = offer['chunkSize']
+        command = 'chunk:'+offer['id']
+        with open(path,'rb') as file:
+            with mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ) as data:
+                for first in range(start,offer['chunks'],self.batchSize):
+                    last = min(first+self.batchSize,offer['chunks'])
+                    MSGS = []
+                    for index in range(first,last):
+                        chunk = data[index*size:(index+1)*size]
+                        MSGS.append([1,command,
+                                     [index,zlib.crc32(chunk),chunk]])
+                    yield MSGS
+
+    def accept(self,transferId,offer,sender=None):
+        """
+        This method will take an offer and open the part of the file we
+        have, if any
+
+        Parameters:
+            transferId: The id the offer came with
+            offer: The offer
+            sender: Who the transfer counts against for maxOpen, the 'from'
+                    of the offer if it isn't given
+
+        Output:
+            The index of the first chunk we need - if we take it
+            None - if the offer doesn't make sense or is over the quotas
+        """
+        try:
+            if offer['id'] != transferId:
+                return None
+            size = int(offer['size'])
+            chunkSize = int(offer['chunkSize'])
+            chunks = int(offer['chunks'])
+        except (KeyError,TypeError,ValueError):
+            return None
+        if (not transferId.isalnum() or size < 0 or chunkSize <= 0 or
+                chunkSize > self.maxChunk or
+                chunks != -(-size // chunkSize)):
+            return None
+        offer.update(size=size,chunkSize=chunkSize,chunks=chunks)
+        #Only the name of the file is kept, never the folders
+        offer['name'] = os.path.basename(str(offer.get('name'))) or transferId
+        if sender is None:
+            sender = offer.get('from')
+        self.expire()
+        with self.lock:
+            if transferId in self.incoming:
+                self.timers.schedule(transferId,self.idleTimeout)
+                return self.incoming[transferId][2]
+            opened = sum(1 for transfer in self.incoming.values()
+                         if transfer[3] == sender)
+            if opened >= self.maxOpen:
+                return None
+            os.makedirs(self.directory,exist_ok=True)
+            if self.spool and os.path.exists(self.path(transferId+'.file')):
+                #We already have all of it, waiting to be passed on
+                return chunks
+            if not self.fits(transferId,offer):
+                return None
+            try:
+                descriptor = os.open(self.path(transferId+'.part'),
+                                     os.O_RDWR | os.O_CREAT,0o644)
+            except OSError:
+                return None
+            #Whatever is past the last whole chunk was cut off mid write
+            have = os.fstat(descriptor).st_size // chunkSize
+            os.ftruncate(descriptor,have * chunkSize)
+            with open(self.path(transferId+'.offer'),'w') as saved:
+                json.dump(offer,saved)
+            self.incoming[transferId] = [offer,descriptor,min(have,chunks),
+                                         sender]
+            self.timers.schedule(transferId,self.idleTimeout)
+            return self.incoming[transferId][2]
+
+    def write(self,transferId,chunk):
+        """
+        This method will write a chunk if it is the next one we need
+
+        Parameters:
+            chunk: [index,crc,bytes]
+        Output:
+            True - if it was written
+            False - otherwise
+        """
+        if not (isinstance(chunk,list) and len(chunk) == 3 and
+                isinstance(chunk[0],int) and isinstance(chunk[1],int) and
+                isinstance(chunk[2],bytes)):
+            return False
+        index,crc,data = chunk
+        if zlib.crc32(data) != crc:
+            return False
+        #The transfer can't be closed under us while we write
+        with self.lock:
+            transfer = self.incoming.get(transferId)
+            if transfer is None:
+                return False
+            offer,descriptor,expected,sender = transfer
+            if index != expected:
+                return False
+            if len(data) != min(offer['chunkSize'],
+                                offer['size'] - index * offer['chunkSize']):
+                return False
+            try:
+                os.pwrite(descriptor,data,index * offer['chunkSize'])
+            except OSError:
+                #Like a bad chunk, the sender will send it again
+                return False
+            transfer[2] += 1
+            self.timers.schedule(transferId,self.idleTimeout)
+            return True
+
+    def finish(self,transferId):
+        """
+        This method will put the file in place if we have all of it
+
+        Output:
+            (chunks,path,offer) - if we have every chunk, path is where
+                                  the file is now
+            (next chunk,None,offer) - if we are still missing some
+            (None,None,None) - if we don't know the transfer
+        """
+        with self.lock:
+            transfer = self.incoming.get(transferId)
+            if transfer is not None and transfer[2] == transfer[0]['chunks']:
+                #It is done, so it isn't open anymore
+                del self.incoming[transferId]
+                self.timers.cancel(transferId)
+        if transfer is None:
+            if self.spool and os.path.exists(self.path(transferId+'.file')):
+                offer = self.savedOffer(transferId)
+                return (offer['chunks'],self.path(transferId+'.file'),offer)
+            return (None,None,None)
+        offer,descriptor,have,sender = transfer
+        if have < offer['chunks']:
+            return (have,None,offer)
+        os.fsync(descriptor)
+        os.close(descriptor)
+        if self.spool:
+            path = self.path(transferId+'.file')
+        else:
+            path = self.freePath(offer['name'])
+            os.remove(self.path(transferId+'.offer'))
+        os.replace(self.path(transferId+'.part'),path)
+        return (have,path,offer)
+
+    def fits(self,transferId,offer):
+        """
+        This method will check whether a spool has room for an offer under
+        its quotas, the offer's own saved copy (if we are resuming it)
+        doesn't count
+        """
+        mine = total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.offer') or name == transferId+'.offer':
+                continue
+            try:
+                saved = self.savedOffer(name[:-len('.offer')])
+                size = int(saved['size'])
+            except (OSError,ValueError,KeyError,TypeError):
+                continue
+            size = max(size,self.minCost)
+            total += size
+            if saved.get('to') == offer.get('to'):
+                mine += size
+        size = max(offer['size'],self.minCost)
+        return (mine + size <= self.maxPerNick and
+                total + size <= self.maxSpool)
+
+    def freePath(self,name):
+        #We don't write over a file that is already there
+        path = self.path(name)
+        base,extension = os.path.splitext(name)
+        copy = 1
+        while os.path.exists(path):
+            path = self.path('{} ({}){}'.format(base,copy,extension))
+            copy += 1
+        return path
+
+    def savedOffer(self,transferId):
+        with open(self.path(transferId+'.offer')) as saved:
+            return json.load(saved)
+
+    def spooled(self,nick):
+        """
+        This method will return (offer,path) for every finished file that
+        is waiting to be passed on to a client
+        """
+        files = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return files
+        for name in sorted(names):
+            if not name.endswith('.file'):
+                continue
+            transferId = name[:-len('.file')]
+            try:
+                offer = self.savedOffer(transferId)
+            except (OSError,ValueError):
+                continue
+            if offer.get('to') == nick:
+                files.append((offer,self.path(name)))
+        return files
+
+    def remove(self,transferId):
+        """
+        This method will delete a spooled file once it has been passed on
+        """
+        for extension in ('.file','.offer'):
+            try:
+                os.remove(self.path(transferId+extension))
+            except FileNotFoundError:
+                pass
+
+    def expire(self,now=None):
+        """
+        This method will close the transfers that haven't had a chunk for
+        idleTimeout seconds, what we have of them stays for a resume
+        """
+        for transferId in self.timers.advance(now):
+            with self.lock:
+                transfer = self.incoming.pop(transferId,None)
+            if transfer is not None:
+                os.close(transfer[1])
+        return None
+
+    def close(self):
+        with self.lock:
+            transfers,self.incoming = self.incoming,dict()
+        for offer,descriptor,have,sender in transfers.values():
+            os.close(descriptor)
+            self.timers.cancel(offer['id'])
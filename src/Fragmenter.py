@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds the code that splits datagrams that are too big to send in
+# one piece into fragments and puts them back together on the other side
+
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from threading import Lock
+
+class Fragmenter:
+    """
+    This class will split encoded packets that are bigger than fragmentSize
+    into fragments and reassemble fragments that are recieved back into the
+    original packet. It sits below the codec, so it works on raw bytes.
+
+    Fragment datagram:
+        A header of the form (mark,msgId,index,count,total,offset,crc)
+        followed by the bytes of the fragment. The mark tells it apart from a
+        normal datagram, msgId identifies the packet the fragment belongs to,
+        offset is where the bytes go in the packet and crc is the CRC32 of
+        the fragment's bytes.
+
+    Status datagram:
+        A header of the form (mark,msgId,count) followed by a bitmap with a
+        bit set for every fragment that has been recieved. The reciever sends
+        one when the last fragment of a packet arrives but some are missing,
+        so the sender only has to resend the ones that are missing.
+
+    Methods:
+        split:
+            Splits an encoded packet into fragments for a peer
+        release/releasePackets:
+            Forgets about the fragments of packets once they have been ACKed
+        resendList:
+            The fragments that need to be resent after a timeout
+        add:
+            Adds a recieved fragment to its packet
+        handleStatus:
+            Reads a status datagram and returns the fragments to resend
+    Attributes:
+        fragmentSize: The most bytes of a packet a fragment will carry
+        maxMessages: The most packets we will reassemble at the same time
+        timeout: How long we hold on to a packet that isn't complete
+        maxBytes: The biggest packet we are willing to reassemble
+        maxBuffered: The most bytes all the packets we are reassembling can
+                     take up together. Anyone can send us a fragment, so a
+                     packet that would go over it isn't started at all
+        buffered: The bytes the packets in incoming take up
+        outgoing: The fragments of packets we sent that haven't been ACKed
+        incoming: The packets we are reassembling, oldest first
+    """
+    MARK = 0xF5
+    STATUS = 0xF6
+    HEADER = struct.Struct('!BIHHIII')
+    STATUS_HEADER = struct.Struct('!BIH')
+
+    def __init__(self,fragmentSize=1400,maxMessages=64,timeout=5.0,
+                 maxBytes=16*1024*1024,maxBuffered=32*1024*1024):
+        self.fragmentSize = fragmentSize
+        self.maxMessages = maxMessages
+        self.timeout = timeout
+        self.maxBytes = maxBytes
+        self.maxBuffered = maxBuffered
+        self.buffered = 0
+        self.nextId = 0
+        self.outgoing = dict()
+        self.incoming = OrderedDict()
+        self.lock = Lock()
+
+    def isFragment(self,data):
+        return len(data) > 0 and data[0] == self.MARK
+
+    def isStatus(self,data):
+        return len(data) > 0 and data[0] == self.STATUS
+
+    def split(self,data,peer):
+        """
+        This method will split an encoded packet into fragments if it is too
+        big to send in one datagram
+
+        Parameters:
+            data: The encoded packet
+            peer: The (IP,PORT) tuple of the peer it is going to
+        Output:
+            A tuple of the message ID (None if the packet wasn't split) and
+            the list of datagrams to send
+        """
+        if len(data) <= self.fragmentSize:
+            return None,[data]
+        view = memoryview(data)
+        count = (len(data) + self.fragmentSize - 1) // self.fragmentSize
+        with self.lock:
+            msgId = self.nextId
+            self.nextId = (self.nextId + 1) & 0xFFFFFFFF
+        fragments = []
+        for index in range(count):
+            start = index * self.fragmentSize
+            chunk = view[start:start+self.fragmentSize]
+            header = self.HEADER.pack(self.MARK,msgId,index,count,len(data),
+                                      start,zlib.crc32(chunk))
+            fragments.append(header + chunk)
+        with self.lock:
+            #We remember which fragments the peer is still missing
+            self.outgoing[(peer,msgId)] = [fragments,None]
+        return msgId,fragments
+
+    def release(self,peer,msgId):
+        """
+        This method will forget the fragments of a packet we sent
+        """
+        with self.lock:
+            self.outgoing.pop((peer,msgId),None)
+
+    def releasePackets(self,packets,peer):
+        """
+        This method will forget the fragments of a list of (msgId,fragments)
+        tuples returned by split once they are done being sent
+        """
+        for msgId,fragments in packets:
+            if msgId is not None:
+                self.release(peer,msgId)
+
+    def resendList(self,peer,msgId):
+        """
+        This method will return the fragments that should be resent after a
+        timeout. If the peer told us which fragments it is missing we only
+        send those plus the last fragment, which makes the peer send us a new
+        status in case it gave up on the packet.
+        """
+        with self.lock:
+            entry = self.outgoing.get((peer,msgId))
+            if entry is None:
+                return []
+            fragments,missing = entry
+            if missing is None:
+                return list(fragments)
+            indices = sorted(set(missing) | {len(fragments)-1})
+            return [fragments[i] for i in indices]
+
+    def handleStatus(self,data,peer):
+        """
+        This method will read a status datagram from a peer and return the
+        fragments that it is missing so they can be resent right away
+        """
+        try:
+            mark,msgId,count = self.STATUS_HEADER.unpack_from(data)
+        except struct.error:
+            return []
+        bitmap = memoryview(data)[self.STATUS_HEADER.size:]
+        with self.lock:
+            entry = self.outgoing.get((peer,msgId))
+            if entry is None or len(entry[0]) != count:
+                return []
+            missing = [i for i in range(count)
+                       if i//8 >= len(bitmap) or
+                       not bitmap[i//8] & (1 << (i % 8))]
+            entry[1] = missing
+            return [entry[0][i] for i in missing]
+
+    def add(self,data,address):
+        """
+        This method will add a fragment to the packet it belongs to
+
+        Parameters:
+            data: The fragment datagram
+            address: The (IP,PORT) tuple of the peer that sent it
+        Output:
+            A tuple of the reassembled packet (None if it isn't complete yet)
+            and a status datagram to send back to the peer (None if there
+            isn't one to send)
+        """
+        try:
+            header = self.HEADER.unpack_from(data)
+        except struct.error:
+            return None,None
+        mark,msgId,index,count,total,start,crc = header
+        chunk = memoryview(data)[self.HEADER.size:]
+        if (index >= count or count > max(total,1) or total > self.maxBytes or
+                start + len(chunk) > total or zlib.crc32(chunk) != crc):
+            return None,None
+        key = (address,msgId)
+        now = time.monotonic()
+        with self.lock:
+            self.evict(now)
+            entry = self.incoming.get(key)
+            if entry is None:
+                if self.buffered + total > self.maxBuffered:
+                    #We are holding as much as we will, the sender can
+                     # resend it once some of the others are done
+                    return None,None
+                #We allocate the whole packet up front and fill it in
+                entry = {'buffer':bytearray(total),
+                         'have':bytearray((count+7)//8),
+                         'got':0,'count':count,'started':now}
+                self.incoming[key] = entry
+                self.buffered += total
+                if len(self.incoming) > self.maxMessages:
+                    self.drop(self.incoming.popitem(last=False)[1])
+            elif entry['count'] != count or len(entry['buffer']) != total:
+                #It doesn't belong to the packet we are putting together
+                return None,None
+            have = entry['have']
+            if not have[index//8] & (1 << (index % 8)):
+                have[index//8] |= 1 << (index % 8)
+                entry['buffer'][start:start+len(chunk)] = chunk
+                entry['got'] += 1
+            if entry['got'] == count:
+                self.drop(self.incoming.pop(key))
+                return bytes(entry['buffer']),None
+            if index == count - 1:
+                #The last fragment is here but some are missing
+                status = self.STATUS_HEADER.pack(self.STATUS,msgId,count)
+                return None,status + bytes(have)
+            return None,None
+
+    def evict(self,now):
+        """
+        This method will throw away packets that have been waiting on
+        fragments for longer than the timeout. The table is ordered by when
+        we started each packet so we only need to look at the front.
+        """
+        while self.incoming:
+            key,entry = next(iter(self.incoming.items()))
+            if now - entry['started'] < self.timeout:
+                break
+            self.drop(self.incoming.popitem(last=False)[1])
+
+    def drop(self,entry):
+        #The packet is no longer taking up any of maxBuffered
+        self.buffered -= len(entry['buffer'])
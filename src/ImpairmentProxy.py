@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds a UDP proxy that sits between the clients and the Server and
+# makes loopback behave like a real network, losing, duplicating, reordering,
+# delaying and slowing down packets, so the retransmissions and timeouts can
+# be tested and benchmarked the same way every time
+
+import sys
+import heapq
+import random
+import socket
+import argparse
+import selectors
+import time
+from collections import Counter
+
+class ImpairmentProxy:
+    """
+    This class will forward datagrams between the clients and the Server
+    (and between the clients themselves), impairing them on the way.
+
+    Aliases:
+        Every address the proxy talks to gets an alias, a socket of the
+        proxy that stands in for it. A datagram that arrives at the alias
+        of Y from X is sent on to Y from the alias of X, so both sides only
+        ever see aliases. The alias of the Server is the Port the clients
+        connect to. Since the Server only sees the aliases of the clients,
+        those are what it puts in the client table, so messages the clients
+        send each other go through the proxy too. Nobody has to be changed
+        to go through it.
+
+    Impairments:
+        Each datagram is lost with the probability loss. Otherwise it is
+        sent after delay seconds plus up to jitter more, and another copy
+        is sent too with the probability duplicate. With the probability
+        reorder it is held back reorderDelay seconds longer, so the ones
+        behind it get there first. With a bandwidth (bytes per second),
+        each address gets a link that only sends that fast. Datagrams wait
+        in line for it, and a datagram that would wait more than queueLimit
+        seconds is dropped like a full router queue would. Every decision
+        comes from one random generator made from the seed, so the same
+        seed makes the same decisions for the same datagrams.
+
+    Methods:
+        alias:
+            The address of the alias of an address, making it if it's new
+        impair:
+            Decides what happens to a datagram
+        serve:
+            Forwards datagrams until it is told to stop
+        close:
+            Closes every socket
+    Attributes:
+        server: The (IP,PORT) of the Server
+        address: The (IP,PORT) the clients connect to
+        sockets: The alias socket of every address
+        pending: A heap of (time,count,socket,data,target) of the datagrams
+                 waiting to be sent
+        linkFree: When the link of each address is free again
+        stats: How many datagrams were recieved, forwarded, lost,
+               duplicated, reordered and dropped from a full queue
+    """
+    def __init__(self,serverPort,listenPort=0,serverIP='127.0.0.1',
+                 HOST='127.0.0.1',loss=0.0,duplicate=0.0,reorder=0.0,
+                 delay=0.0,jitter=0.0,bandwidth=None,queueLimit=1.0,
+                 reorderDelay=0.01,seed=None):
+        self.HOST = HOST
+        self.server = (socket.gethostbyname(serverIP),serverPort)
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.delay = delay
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.queueLimit = queueLimit
+        self.reorderDelay = reorderDelay
+        self.random = random.Random(seed)
+        self.selector = selectors.DefaultSelector()
+        self.sockets = dict()
+        self.pending = []
+        self.count = 0
+        self.linkFree = dict()
+        self.stats = Counter()
+        self.address = self.alias(self.server,listenPort)
+
+    def alias(self,address,PORT=0):
+        """
+        This method will return the (IP,PORT) of the alias of an address,
+        binding a socket for it if it doesn't have one yet
+        """
+        alias = self.sockets.get(address)
+        if alias is None:
+            alias = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+            alias.bind((self.HOST,PORT))
+            alias.setblocking(False)
+            self.sockets[address] = alias
+            self.selector.register(alias,selectors.EVENT_READ,address)
+        return alias.getsockname()
+
+    def impair(self,size,target,now):
+        """
+        This method will decide when (if ever) a datagram gets to its target
+
+        Parameters:
+            size: How many bytes the datagram is
+            target: The address it is going to
+            now: When it arrived
+        Output:
+            A list of the times to send it at, one for every copy
+        """
+        if self.random.random() < self.loss:
+            self.stats['lost'] += 1
+            return []
+        copies = 1
+        if self.random.random() < self.duplicate:
+            self.stats['duplicated'] += 1
+            copies = 2
+        times = []
+        for copy in range(copies):
+            sendAt = now
+            if self.bandwidth:
+                #The datagram waits in line for the link of its target
+                start = max(now,self.linkFree.get(target,now))
+                if start - now > self.queueLimit:
+                    self.stats['queueDrops'] += 1
+                    continue
+                sendAt = start + size / self.bandwidth
+                self.linkFree[target] = sendAt
+            sendAt += self.delay + self.random.uniform(0,self.jitter)
+            if self.random.random() < self.reorder:
+                self.stats['reordered'] += 1
+                sendAt += self.reorderDelay
+            times.append(sendAt)
+        return times
+
+    def receive(self,alias,target,now):
+        """
+        This method will read every datagram waiting on an alias and line
+        them up to be sent to its address
+        """
+        while True:
+            try:
+                data,source = alias.recvfrom(65535)
+            except (BlockingIOError,InterruptedError):
+                return None
+            except OSError:
+                #An ICMP error from something that is gone, keep going
+                continue
+            self.stats['received'] += 1
+            self.alias(source)
+            sender = self.sockets[source]
+            for sendAt in self.impair(len(data),target,now):
+                self.count += 1
+                heapq.heappush(self.pending,
+                               (sendAt,self.count,sender,data,target))
+
+    def flush(self,now):
+        """
+        This method will send every datagram that is due
+        """
+        while self.pending and self.pending[0][0] <= now:
+            sendAt,count,sender,data,target = heapq.heappop(self.pending)
+            try:
+                sender.sendto(data,target)
+                self.stats['forwarded'] += 1
+            except OSError:
+                self.stats['sendErrors'] += 1
+
+    def serve(self,control=None):
+        """
+        This method will forward datagrams until something arrives on
+        control (a multiprocessing Connection), which is answered with the
+        stats, or forever if there isn't one
+        """
+        if control is not None:
+            self.selector.register(control,selectors.EVENT_READ,None)
+        while True:
+            timeout = None
+            if self.pending:
+                timeout = max(0,self.pending[0][0] - time.monotonic())
+            for key,events in self.selector.select(timeout):
+                if key.data is None:
+                    control.recv()
+                    control.send(dict(self.stats))
+                    return dict(self.stats)
+                self.receive(key.fileobj,key.data,time.monotonic())
+            self.flush(time.monotonic())
+
+    def close(self):
+        for alias in self.sockets.values():
+            self.selector.unregister(alias)
+            alias.close()
+        self.sockets.clear()
+        self.selector.close()
+
+def Main(arguments):
+    """
+    This method will run the proxy in front of a Server from the command
+    line, clients connect to the listen Port instead of the Server's
+    """
+    parser = argparse.ArgumentParser(
+        description='Impair the datagrams between the clients and a Server')
+    parser.add_argument('listen',type=int,help='The Port clients connect to')
+    parser.add_argument('server',type=int,help='The Port of the Server')
+    parser.add_argument('--server-ip',default='127.0.0.1')
+    addImpairments(parser)
+    options = parser.parse_args(arguments)
+    proxy = ImpairmentProxy(options.server,options.listen,options.server_ip,
+                            **impairments(options))
+    print("Proxy on {} for {}".format(proxy.address,proxy.server))
+    try:
+        proxy.serve()
+    except KeyboardInterrupt:
+        print(dict(proxy.stats))
+    finally:
+        proxy.close()
+    return 0
+
+def addImpairments(parser):
+    """
+    This function will add the options of the impairments to a parser, the
+    times are in milliseconds
+    """
+    parser.add_argument('--loss',type=float,default=0.0,
+                        help='Probability a datagram is lost')
+    parser.add_argument('--duplicate',type=float,default=0.0,
+                        help='Probability a datagram is sent twice')
+    parser.add_argument('--reorder',type=float,default=0.0,
+                        help='Probability a datagram is held back')
+    parser.add_argument('--delay',type=float,default=0.0,help='ms')
+    parser.add_argument('--jitter',type=float,default=0.0,help='ms')
+    parser.add_argument('--bandwidth',type=float,default=None,
+                        help='Bytes per second of each link')
+    parser.add_argument('--seed',type=int,default=None)
+
+def impairments(options):
+    """
+    This function will turn the options added by addImpairments into the
+    arguments of an ImpairmentProxy
+    """
+    return {'loss':options.loss,'duplicate':options.duplicate,
+            'reorder':options.reorder,'delay':options.delay / 1000,
+            'jitter':options.jitter / 1000,'bandwidth':options.bandwidth,
+            'seed':options.seed}
+
+if __name__ == '__main__':
+    sys.exit(Main(sys.argv[1:]))
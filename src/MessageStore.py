@@ -0,0 +1,621 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds the places the Server can keep messages for clients that are
+# offline. The MemoryStore is the default, the LogStore keeps the messages in
+# files on disk so they survive a restart
+
+import os
+import struct
+import time
+import zlib
+from array import array
+from collections import deque
+from threading import RLock,Thread
+from WireCodec import BinaryCodec
+
+class MemoryStore:
+    """
+    This class will keep the stored messages in a dictionary of queues, one
+    for each nickname, the same way the Server always has.
+
+    Methods:
+        append:
+            Stores a message for a client
+        appendMany:
+            Stores the same message for many clients at once
+        pending:
+            The messages waiting for a client, oldest first
+        ack:
+            Removes the messages a client has recieved
+        count/size:
+            How many messages are waiting for a client/for everyone
+        dump/load:
+            Copies a client's messages out, or puts them back, so a
+            Snapshotter can save them
+        close:
+            Nothing to do for this store
+    Attributes:
+        queues: A dictionary of {Nick:deque of (id,Message,expires)}
+        maxPerNick: The most messages we hold for one client (None for no
+                    limit)
+        ttl: How many seconds we hold on to a message (None for forever)
+        durable: Whether the messages survive a restart on their own
+        onChange: If it is set, it is called with the Nickname of every
+                  client whose messages change
+    """
+    durable = False
+
+    def __init__(self,maxPerNick=None,ttl=None):
+        self.queues = dict()
+        self.maxPerNick = maxPerNick
+        self.ttl = ttl
+        self.nextId = 1
+        self.total = 0
+        self.onChange = None
+        self.lock = RLock()
+
+    def append(self,nick,MSG):
+        """
+        This method will store a message for a client
+
+        Output:
+            True - if the message was stored
+            False - if the client already has too many messages waiting
+        """
+        with self.lock:
+            self.expire(nick)
+            messages = self.queues.setdefault(nick,deque())
+            if self.maxPerNick is not None and len(messages) >= self.maxPerNick:
+                return False
+            expires = None if self.ttl is None else time.time() + self.ttl
+            messages.append((self.nextId,MSG,expires))
+            self.nextId += 1
+            self.total += 1
+            self.changed(nick)
+            return True
+
+    def appendMany(self,nicks,MSG):
+        """
+        This method will store the same message for many clients (like the
+        members of a channel) while holding the lock once
+
+        Output:
+            A list of the clients that already had too many messages waiting
+        """
+        with self.lock:
+            return [nick for nick in nicks if not self.append(nick,MSG)]
+
+    def pending(self,nick,limit=None):
+        """
+        This method will return a list of (id,Message) tuples of the messages
+        waiting for a client, oldest first
+        """
+        with self.lock:
+            self.expire(nick)
+            messages = self.queues.get(nick,())
+            if limit is None:
+                limit = len(messages)
+            return [(msgId,MSG) for msgId,MSG,expires in list(messages)[:limit]]
+
+    def ack(self,nick,uptoId):
+        """
+        This method will remove every message for a client with an id up to
+        uptoId, once the client has recieved them
+        """
+        with self.lock:
+            messages = self.queues.get(nick)
+            if messages and messages[0][0] <= uptoId:
+                self.changed(nick)
+            while messages and messages[0][0] <= uptoId:
+                messages.popleft()
+                self.total -= 1
+            if messages is not None and not messages:
+                del self.queues[nick]
+
+    def expire(self,nick):
+        """
+        This method will throw away a client's messages that are too old.
+        Messages are in the order they were stored so we only look at the
+        front of the queue.
+        """
+        messages = self.queues.get(nick)
+        now = time.time()
+        while messages and messages[0][2] is not None and messages[0][2] <= now:
+            messages.popleft()
+            self.total -= 1
+            self.changed(nick)
+
+    def changed(self,nick):
+        if self.onChange is not None:
+            self.onChange(nick)
+
+    def dump(self,nick):
+        """
+        This method will return a list of [id,Message,expires] lists of the
+        messages waiting for a client
+        """
+        with self.lock:
+            return [list(message) for message in self.queues.get(nick,())]
+
+    def load(self,nick,messages):
+        """
+        This method will put back the messages of a client that dump
+        returned, replacing any it has
+        """
+        with self.lock:
+            old = self.queues.pop(nick,())
+            self.total -= len(old)
+            if messages:
+                self.queues[nick] = deque(tuple(message)
+                                          for message in messages)
+                self.total += len(messages)
+                self.nextId = max(self.nextId,messages[-1][0] + 1)
+
+    def count(self,nick):
+        with self.lock:
+            self.expire(nick)
+            return len(self.queues.get(nick,()))
+
+    def size(self):
+        return self.total
+
+    def close(self):
+        return None
+
+class NickQueue:
+    """
+    This class holds the index of the messages waiting for one client in
+    compact arrays, so a message costs 24 bytes of memory no matter how big
+    it is. Messages are removed from the front by moving head forward. The
+    ids are always kept in order, so the oldest message is at the front.
+    """
+    def __init__(self):
+        self.ids = array('Q')
+        self.positions = array('Q')
+        self.expires = array('d')
+        self.head = 0
+
+    def __len__(self):
+        return len(self.ids) - self.head
+
+    def append(self,msgId,position,expires):
+        self.ids.append(msgId)
+        self.positions.append(position)
+        self.expires.append(expires)
+
+    def popFront(self):
+        """
+        This method will remove the oldest message and return its position
+        """
+        position = self.positions[self.head]
+        self.head += 1
+        if self.head > 1024 and self.head * 2 > len(self.ids):
+            #Throw away the space at the front once it is half the array
+            del self.ids[:self.head]
+            del self.positions[:self.head]
+            del self.expires[:self.head]
+            self.head = 0
+        return position
+
+    def insert(self,msgId,position,expires):
+        """
+        This method will put a message in its place by id, instead of at the
+        end like append. A message compaction copied forward comes after
+        newer messages in the log, so they aren't replayed in order.
+
+        Output:
+            The position it had before - if the message was already here
+            None - otherwise
+        """
+        if len(self.ids) == self.head or self.ids[-1] < msgId:
+            self.append(msgId,position,expires)
+            return None
+        index = self.search(msgId)
+        if index < len(self.ids) and self.ids[index] == msgId:
+            #Compaction copied it but stopped before deleting the old one
+            old = self.positions[index]
+            self.positions[index] = position
+            return old
+        self.ids.insert(index,msgId)
+        self.positions.insert(index,position)
+        self.expires.insert(index,expires)
+        return None
+
+    def search(self,msgId):
+        """
+        This method will return the index of the first message with an id of
+        at least msgId, the ids are in order so we can do a binary search
+        """
+        low,high = self.head,len(self.ids)
+        while low < high:
+            middle = (low + high) // 2
+            if self.ids[middle] < msgId:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self,msgId):
+        """
+        This method will return the index of a message by its id. Returns -1
+        if it isn't here.
+        """
+        index = self.search(msgId)
+        if index < len(self.ids) and self.ids[index] == msgId:
+            return index
+        return -1
+
+class LogStore:
+    """
+    This class will keep the stored messages in an append only log on disk
+    that is split into segment files. Only a small index of where each
+    message is in the log is kept in memory, so it can hold millions of
+    messages.
+
+    Records:
+        Every record is a header of the form (type,length,crc) followed by a
+        body packed with the BinaryCodec. An APPEND record's body is
+        [id,Nick,time stored,Message] and an ACK record's body is
+        [Nick,uptoId]. When the store starts it reads the log from the start
+        to rebuild the index, putting each message in its place by id.
+
+    Writes:
+        Records are written to the newest segment right away, but they are
+        only fsynced by the flusher thread every syncInterval, so many
+        messages share one fsync.
+
+    Compaction:
+        Once most of the messages in the oldest segment have been recieved
+        or have expired, the messages that are still waiting are copied to
+        the newest segment and the old file is deleted. Segments are only
+        ever removed oldest first, so an ACK record is never kept around
+        longer than the messages it removed.
+
+    Attributes:
+        directory: Where the segment files are kept
+        segmentSize: How big a segment gets before we start a new one
+        syncInterval: How often the flusher fsyncs the log
+        maxPerNick: The most messages we hold for one client
+        ttl: How many seconds we hold on to a message
+        compactRatio: Compact the oldest segment when less than this
+                      fraction of its messages are still waiting
+        queues: A dictionary of {Nick:NickQueue}
+        live: How many messages that are still waiting each segment holds
+        written: How many messages were written to each segment
+    """
+    APPEND = 1
+    ACK = 2
+    HEADER = struct.Struct('!BII')
+    #The log is already on disk so snapshots leave the messages out
+    durable = True
+
+    def __init__(self,directory,segmentSize=64*1024*1024,syncInterval=0.05,
+                 maxPerNick=10000,ttl=7*24*60*60,compactRatio=0.5,
+                 compactInterval=10.0):
+        self.directory = directory
+        self.segmentSize = segmentSize
+        self.syncInterval = syncInterval
+        self.maxPerNick = maxPerNick
+        self.ttl = ttl
+        self.compactRatio = compactRatio
+        self.compactInterval = compactInterval
+        self.codec = BinaryCodec()
+        self.queues = dict()
+        self.live = dict()
+        self.written = dict()
+        self.readers = dict()
+        self.nextId = 1
+        self.total = 0
+        self.dirty = False
+        self.running = True
+        self.lock = RLock()
+        os.makedirs(directory,exist_ok=True)
+        segments = self.segments()
+        for segment in segments:
+            self.replay(segment)
+        self.openSegment(segments[-1] + 1 if segments else 1)
+        self.flusher = Thread(target=self.flushLoop,daemon=True)
+        self.flusher.start()
+
+    def segments(self):
+        """
+        This method will return the numbers of the segment files on disk in
+        order
+        """
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.log') and name[:-4].isdigit():
+                numbers.append(int(name[:-4]))
+        return sorted(numbers)
+
+    def path(self,segment):
+        return os.path.join(self.directory,'{:08d}.log'.format(segment))
+
+    def openSegment(self,segment):
+        """
+        This method will start writing to a new segment
+        """
+        self.active = segment
+        self.activeFile = open(self.path(segment),'ab')
+        self.offset = self.activeFile.tell()
+        self.live.setdefault(segment,0)
+        self.written.setdefault(segment,0)
+
+    def records(self,segment):
+        """
+        This generator will read the records of a segment in order, as tuples
+        of (offset,type,body). A record that was only half written when the
+        Server stopped is cut off the end of the file.
+        """
+        with open(self.path(segment),'rb') as log:
+            data = log.read()
+        view = memoryview(data)
+        offset = 0
+        while offset + self.HEADER.size <= len(view):
+            kind,length,crc = self.HEADER.unpack_from(view,offset)
+            start = offset + self.HEADER.size
+            body = view[start:start+length]
+            if len(body) != length or zlib.crc32(body) != crc:
+                break
+            yield offset,kind,self.codec.unpackValue(body,0)[0]
+            offset = start + length
+        if offset != len(view):
+            with open(self.path(segment),'r+b') as log:
+                log.truncate(offset)
+
+    def replay(self,segment):
+        """
+        This method will rebuild the index from the records of a segment
+        """
+        self.live.setdefault(segment,0)
+        self.written.setdefault(segment,0)
+        now = time.time()
+        for offset,kind,body in self.records(segment):
+            if kind == self.APPEND:
+                msgId,nick,stored,MSG = body
+                self.nextId = max(self.nextId,msgId + 1)
+                self.written[segment] += 1
+                if stored + self.ttl <= now:
+                    continue
+                position = (segment << 40) | offset
+                old = self.queues.setdefault(nick,NickQueue()).insert(
+                    msgId,position,stored + self.ttl)
+                self.live[segment] += 1
+                if old is None:
+                    self.total += 1
+                else:
+                    #This is a copy compaction made, the first one is gone
+                    self.live[old >> 40] -= 1
+            elif kind == self.ACK:
+                nick,uptoId = body
+                self.removeUpto(nick,uptoId)
+
+    def writeRecord(self,kind,body):
+        """
+        This method will write a record to the newest segment and return
+        its position, the lock must be held when it is called
+        """
+        packed = bytearray()
+        self.codec.packValue(body,packed)
+        header = self.HEADER.pack(kind,len(packed),zlib.crc32(packed))
+        position = (self.active << 40) | self.offset
+        self.activeFile.write(header + packed)
+        self.offset += len(header) + len(packed)
+        self.dirty = True
+        if self.offset >= self.segmentSize:
+            #This segment is big enough so we move on to a new one
+            self.activeFile.flush()
+            os.fsync(self.activeFile.fileno())
+            self.activeFile.close()
+            self.openSegment(self.active + 1)
+        return position
+
+    def readMessage(self,position):
+        """
+        This method will read the message of the APPEND record at a position
+        """
+        segment = position >> 40
+        offset = position & ((1 << 40) - 1)
+        if segment == self.active:
+            self.activeFile.flush()
+        if segment not in self.readers:
+            self.readers[segment] = open(self.path(segment),'rb')
+        reader = self.readers[segment]
+        reader.seek(offset)
+        kind,length,crc = self.HEADER.unpack(reader.read(self.HEADER.size))
+        body = self.codec.unpackValue(memoryview(reader.read(length)),0)[0]
+        return body[3]
+
+    def append(self,nick,MSG):
+        """
+        This method will store a message for a client
+
+        Output:
+            True - if the message was stored
+            False - if the client already has too many messages waiting
+        """
+        with self.lock:
+            self.expire(nick)
+            messages = self.queues.setdefault(nick,NickQueue())
+            if len(messages) >= self.maxPerNick:
+                return False
+            msgId = self.nextId
+            self.nextId += 1
+            now = time.time()
+            position = self.writeRecord(self.APPEND,[msgId,nick,now,MSG])
+            messages.append(msgId,position,now + self.ttl)
+            self.live[position >> 40] += 1
+            self.written[position >> 40] += 1
+            self.total += 1
+            return True
+
+    def appendMany(self,nicks,MSG):
+        """
+        This method will store the same message for many clients (like the
+        members of a channel) while holding the lock once, so the
+        records are written together and share an fsync
+
+        Output:
+            A list of the clients that already had too many messages waiting
+        """
+        with self.lock:
+            return [nick for nick in nicks if not self.append(nick,MSG)]
+
+    def pending(self,nick,limit=None):
+        """
+        This method will return a list of (id,Message) tuples of the messages
+        waiting for a client, oldest first
+        """
+        with self.lock:
+            self.expire(nick)
+            messages = self.queues.get(nick)
+            if messages is None:
+                return []
+            end = len(messages.ids)
+            if limit is not None:
+                end = min(end,messages.head + limit)
+            return [(messages.ids[i],self.readMessage(messages.positions[i]))
+                    for i in range(messages.head,end)]
+
+    def ack(self,nick,uptoId):
+        """
+        This method will remove every message for a client with an id up to
+        uptoId, once the client has recieved them
+        """
+        with self.lock:
+            if self.removeUpto(nick,uptoId):
+                self.writeRecord(self.ACK,[nick,uptoId])
+
+    def removeUpto(self,nick,uptoId):
+        """
+        This method will remove a client's messages from the index, the lock
+        must be held when it is called
+
+        Output:
+            True - if any messages were removed
+        """
+        messages = self.queues.get(nick)
+        removed = False
+        while messages and messages.ids[messages.head] <= uptoId:
+            self.live[messages.popFront() >> 40] -= 1
+            self.total -= 1
+            removed = True
+        if messages is not None and not messages:
+            del self.queues[nick]
+        return removed
+
+    def expire(self,nick):
+        """
+        This method will remove a client's messages that are too old from
+        the index, they are in the order they were stored so we only look at
+        the front. We don't need to log this since replaying the log expires
+        them again.
+        """
+        messages = self.queues.get(nick)
+        now = time.time()
+        while messages and messages.expires[messages.head] <= now:
+            self.live[messages.popFront() >> 40] -= 1
+            self.total -= 1
+        if messages is not None and not messages:
+            del self.queues[nick]
+
+    def count(self,nick):
+        with self.lock:
+            self.expire(nick)
+            return len(self.queues.get(nick,()))
+
+    def size(self):
+        return self.total
+
+    def compact(self):
+        """
+        This method will delete the oldest segments once they hold no
+        waiting messages, and copy the waiting messages out of the oldest
+        segment when few of its messages are still waiting
+        """
+        with self.lock:
+            for nick in list(self.queues):
+                self.expire(nick)
+            for segment in sorted(self.live):
+                if segment == self.active:
+                    break
+                if self.live[segment] > 0:
+                    if self.live[segment] >= self.compactRatio * self.written[segment]:
+                        #Segments are only removed oldest first
+                        break
+                    self.copyForward(segment)
+                reader = self.readers.pop(segment,None)
+                if reader is not None:
+                    reader.close()
+                os.remove(self.path(segment))
+                del self.live[segment]
+                del self.written[segment]
+
+    def copyForward(self,segment):
+        """
+        This method will copy the messages of a segment that are still waiting
+        to the newest segment, the lock must be held when it is called
+        """
+        for offset,kind,body in self.records(segment):
+            if kind != self.APPEND:
+                continue
+            msgId,nick,stored,MSG = body
+            messages = self.queues.get(nick)
+            index = -1 if messages is None else messages.find(msgId)
+            if index == -1 or messages.positions[index] != (segment << 40) | offset:
+                continue
+            position = self.writeRecord(self.APPEND,body)
+            messages.positions[index] = position
+            self.live[segment] -= 1
+            self.live[position >> 40] += 1
+            self.written[position >> 40] += 1
+
+    def flushLoop(self):
+        """
+        This method runs in its own thread. It fsyncs everything written since
+        the last time, so all of those writes share one fsync, and compacts
+        the log every compactInterval.
+        """
+        lastCompact = time.monotonic()
+        while self.running:
+            time.sleep(self.syncInterval)
+            self.sync()
+            if time.monotonic() - lastCompact >= self.compactInterval:
+                self.compact()
+                lastCompact = time.monotonic()
+        return None
+
+    def sync(self):
+        """
+        This method will make sure everything written so far is on disk
+        """
+        with self.lock:
+            if not self.dirty:
+                return None
+            self.activeFile.flush()
+            descriptor = self.activeFile.fileno()
+            self.dirty = False
+            #We fsync without holding the lock so writes can keep going
+            try:
+                descriptor = os.dup(descriptor)
+            except OSError:
+                return None
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+        return None
+
+    def close(self):
+        """
+        This method will stop the flusher and close all of the files
+        """
+        self.running = False
+        self.flusher.join()
+        self.sync()
+        with self.lock:
+            self.activeFile.close()
+            for reader in self.readers.values():
+                reader.close()
+            self.readers = dict()
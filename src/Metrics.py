@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds the metrics the UDPSocket and the Servers keep about
+# themselves, and the ways to read them (a dictionary for the stats: command
+# and the Prometheus text format for an HTTP endpoint)
+
+import bisect
+from threading import Lock,Thread
+from http.server import BaseHTTPRequestHandler,ThreadingHTTPServer
+
+class Counter:
+    """
+    This class is a number that only goes up, like the number of datagrams
+    sent. It can be split up by one label (like the peer), each value of
+    the label is a series.
+    """
+    kind = 'counter'
+
+    def __init__(self,name,help,label=None,maxSeries=1024):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.maxSeries = maxSeries
+        self.series = {None:0} if label is None else dict()
+        self.lock = Lock()
+
+    def key(self,value):
+        """
+        This method will return the series for a value of the label. Once
+        there are maxSeries of them, new values are all counted as 'other'
+        so a lot of peers can't use up our memory. The lock must be held.
+        """
+        if value in self.series or len(self.series) < self.maxSeries:
+            return value
+        return 'other'
+
+    def inc(self,amount=1,label=None):
+        with self.lock:
+            key = self.key(label)
+            self.series[key] = self.series.get(key,0) + amount
+
+    def total(self):
+        with self.lock:
+            return sum(self.series.values())
+
+    def snapshot(self):
+        with self.lock:
+            if self.label is None:
+                return self.series[None]
+            return {str(key):value for key,value in self.series.items()}
+
+    def samples(self):
+        """
+        This method will return the (suffix,labels,value) tuples of the
+        metric for the Prometheus format
+        """
+        with self.lock:
+            return [('',self.labels(key),value)
+                    for key,value in self.series.items()]
+
+    def labels(self,key):
+        if self.label is None:
+            return ''
+        return '{}="{}"'.format(self.label,escape(key))
+
+class Histogram(Counter):
+    """
+    This class will count how many observations (like round trip times)
+    fall at or below each of a fixed list of bucket bounds, along with their
+    count and sum, so percentiles can be estimated without keeping them all.
+    """
+    kind = 'histogram'
+    #From 100 microseconds to 10 seconds
+    BUCKETS = [0.0001,0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,
+               0.25,0.5,1.0,2.5,5.0,10.0]
+
+    def __init__(self,name,help,label=None,buckets=None,maxSeries=1024):
+        Counter.__init__(self,name,help,label,maxSeries)
+        self.buckets = list(buckets or self.BUCKETS)
+        self.series = dict()
+
+    def observe(self,value,label=None):
+        #The last count is for the values bigger than every bound
+        index = bisect.bisect_left(self.buckets,value)
+        with self.lock:
+            key = self.key(label)
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0]*(len(self.buckets)+1),0,0.0]
+            series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def total(self):
+        with self.lock:
+            return sum(series[1] for series in self.series.values())
+
+    def summary(self,series):
+        counts,count,total = series
+        buckets = dict()
+        running = 0
+        for bound,bucketCount in zip(self.buckets,counts):
+            running += bucketCount
+            buckets[str(bound)] = running
+        return {'count':count,'sum':total,'buckets':buckets}
+
+    def snapshot(self):
+        with self.lock:
+            if self.label is None:
+                series = self.series.get(None,[[0]*(len(self.buckets)+1),0,0.0])
+                return self.summary(series)
+            return {str(key):self.summary(series)
+                    for key,series in self.series.items()}
+
+    def samples(self):
+        with self.lock:
+            samples = []
+            for key,(counts,count,total) in self.series.items():
+                labels = self.labels(key)
+                prefix = labels + ',' if labels else ''
+                running = 0
+                for bound,bucketCount in zip(self.buckets + ['+Inf'],counts):
+                    running += bucketCount
+                    samples.append(('_bucket',
+                                    '{}le="{}"'.format(prefix,bound),running))
+                samples.append(('_sum',labels,total))
+                samples.append(('_count',labels,count))
+            return samples
+
+class Gauge:
+    """
+    This class is a number that can go up and down, like the depth of a
+    queue. It calls a function to read the number when the metrics are
+    read, so keeping it costs nothing in between.
+    """
+    kind = 'gauge'
+
+    def __init__(self,name,help,function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def snapshot(self):
+        return self.function()
+
+    def samples(self):
+        return [('','',self.function())]
+
+def escape(value):
+    return str(value).replace('\\','\\\\').replace('"','\\"')
+
+class MetricsRegistry:
+    """
+    This class will hold all of the metrics of a process. Updating a
+    metric is a dictionary lookup and an addition under the metric's own
+    lock, so they can be left on all the time.
+
+    Methods:
+        counter/histogram/gauge:
+            Make a metric (or return the one with the same name)
+        snapshot:
+            All of the metrics as a dictionary, for the stats: command
+        prometheus:
+            All of the metrics in the Prometheus text format
+        serve:
+            Serves the Prometheus text over HTTP on a Port
+    """
+    def __init__(self):
+        self.metrics = dict()
+        self.lock = Lock()
+
+    def add(self,metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name,metric)
+
+    def counter(self,name,help,label=None):
+        return self.add(Counter(name,help,label))
+
+    def histogram(self,name,help,label=None,buckets=None):
+        return self.add(Histogram(name,help,label,buckets))
+
+    def gauge(self,name,help,function):
+        #A gauge made again (by a new Server) should read the new function
+        with self.lock:
+            self.metrics[name] = Gauge(name,help,function)
+            return self.metrics[name]
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name:metric.snapshot() for metric in metrics}
+
+    def prometheus(self):
+        """
+        This method will return the metrics in the Prometheus text format
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name,metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name,metric.kind))
+            for suffix,labels,value in metric.samples():
+                if labels:
+                    lines.append('{}{}{{{}}} {}'.format(metric.name,suffix,
+                                                        labels,value))
+                else:
+                    lines.append('{}{} {}'.format(metric.name,suffix,value))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self,PORT,HOST='127.0.0.1'):
+        """
+        This method will serve the Prometheus text at /metrics on the given
+        Port from a thread of its own
+
+        Output:
+            The HTTP server, so it can be shut down
+        """
+        registry = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return None
+                body = registry.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length',str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self,format,*args):
+                #We don't want a line printed for every scrape
+                return None
+        server = ThreadingHTTPServer((HOST,PORT),Handler)
+        Thread(target=server.serve_forever,daemon=True).start()
+        return server
+
+class TrafficMetrics:
+    """
+    This class holds the metrics of a socket, so the UDPSocket and the
+    AsyncServer (which has its own socket) keep the same ones
+
+    Attributes:
+        datagramsIn/datagramsOut: How many datagrams were recieved and sent
+        bytesIn/bytesOut: How many bytes were recieved and sent
+        ackRtt: A histogram of the time from sending a packet to its ACK
+        retransmits: How many packets were resent, for each peer
+        sendFailures: How many sends gave up, for each peer
+        duplicates: How many packets we already had were recieved again
+        nacks: How many packets were NACKed because they weren't the start
+               of a stream and we didn't know the one they were part of
+        dropped: How many datagrams were dropped because handling them
+                 failed, so one bad datagram doesn't stop the socket
+        wakeups: How many times the socket woke up to read datagrams, so
+                 datagramsIn divided by it is how many were read each time
+        acksSent: How many ACKs were sent
+        acksCoalesced: How many ACKs were never sent because a later
+                       cumulative ACK to the same peer covered them
+        compressedBytes: The bytes of the bodies we tried to compress,
+                         before and after (bodies that didn't get smaller
+                         are counted as sent), so their ratio is what
+                         compression saves
+        compressionTime: The CPU seconds spent compressing and
+                         decompressing bodies, to weigh against the savings
+    """
+    def __init__(self,registry):
+        self.datagramsIn = registry.counter('udp_datagrams_received_total',
+            'Datagrams recieved')
+        self.datagramsOut = registry.counter('udp_datagrams_sent_total',
+            'Datagrams sent')
+        self.bytesIn = registry.counter('udp_bytes_received_total',
+            'Bytes recieved')
+        self.bytesOut = registry.counter('udp_bytes_sent_total','Bytes sent')
+        self.ackRtt = registry.histogram('udp_ack_rtt_seconds',
+            'Time from sending a packet (that was not resent) to its ACK')
+        self.retransmits = registry.counter('udp_retransmits_total',
+            'Packets resent after a timeout','peer')
+        self.sendFailures = registry.counter('udp_send_failures_total',
+            'Sends that gave up after too many timeouts','peer')
+        self.duplicates = registry.counter('udp_duplicates_total',
+            'Packets recieved again after they were accepted')
+        self.nacks = registry.counter('udp_nacks_sent_total',
+            'Packets NACKed because we had no stream from their sender')
+        self.dropped = registry.counter('udp_datagrams_dropped_total',
+            'Datagrams dropped because handling them failed')
+        self.wakeups = registry.counter('udp_receive_wakeups_total',
+            'Times the socket woke up to read datagrams')
+        self.acksSent = registry.counter('udp_acks_sent_total','ACKs sent')
+        self.acksCoalesced = registry.counter('udp_acks_coalesced_total',
+            'ACKs covered by a later ACK to the same peer before being sent')
+        self.compressedBytes = registry.counter(
+            'udp_compression_bytes_total',
+            'Bytes of the bodies we tried to compress','stage')
+        self.compressionTime = registry.counter(
+            'udp_compression_seconds_total',
+            'CPU seconds spent compressing and decompressing bodies',
+            'operation')
+        registry.gauge('udp_compression_ratio',
+            'Bytes of the bodies we tried to compress for every byte sent',
+            self.compressionRatio)
+
+    def compressed(self,before,after,seconds):
+        self.compressedBytes.inc(before,'before')
+        self.compressedBytes.inc(after,'after')
+        self.compressionTime.inc(seconds,'compress')
+
+    def decompressed(self,seconds):
+        self.compressionTime.inc(seconds,'decompress')
+
+    def compressionRatio(self):
+        sizes = self.compressedBytes.snapshot()
+        if not sizes.get('after'):
+            return 1.0
+        return sizes['before'] / sizes['after']
+
+def peerLabel(peer):
+    return '{}:{}'.format(peer[0],peer[1])
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds the cache a client uses to remember the peers it recently
+# couldn't reach, so it doesn't wait on them again for every message
+
+import time
+from collections import OrderedDict
+
+class PeerCache:
+    """
+    This class will remember the clients we recently failed to send a
+    message to, along with the address we tried. The table can say a client
+    is Online for a while after it is gone (until the Server notices), and
+    without this every message to it would wait through all of the retries
+    before going to the Server.
+
+    A failure is forgotten once it is older than the ttl, or as soon as the
+    Server sends a change to the client's entry in the table, since the
+    client might be back (maybe at a new address).
+
+    Methods:
+        failed:
+            Remembers that we couldn't reach a client
+        unreachable:
+            Whether we recently couldn't reach a client at an address
+        forget:
+            Forgets about a client, when its entry in the table changes
+    Attributes:
+        ttl: How many seconds we remember a failure for
+        maxPeers: The most clients we remember, the oldest failures are
+                  forgotten first
+        peers: OrderedDict({Nick:((IP,PORT),time)}), oldest first
+
+    It is only used from the event loop of an AsyncClient so it doesn't need
+    a lock.
+    """
+    def __init__(self,ttl=30.0,maxPeers=4096):
+        self.ttl = ttl
+        self.maxPeers = maxPeers
+        self.peers = OrderedDict()
+
+    def failed(self,nick,address):
+        """
+        This method will remember that we couldn't reach a client
+
+        Parameters:
+            nick: The Nickname of the client
+            address: The (IP,PORT) tuple we tried to reach it at
+        """
+        self.peers.pop(nick,None)
+        self.peers[nick] = (address,time.monotonic())
+        if len(self.peers) > self.maxPeers:
+            self.peers.popitem(last=False)
+
+    def unreachable(self,nick,address):
+        """
+        This method will check if we recently couldn't reach a client
+
+        Output:
+            True - if we couldn't reach it at this address less than ttl
+                   seconds ago
+            False - otherwise
+        """
+        entry = self.peers.get(nick)
+        if entry is None:
+            return False
+        failedAt,when = entry
+        if time.monotonic() - when >= self.ttl:
+            del self.peers[nick]
+            return False
+        return failedAt == address
+
+    def forget(self,nick):
+        self.peers.pop(nick,None)
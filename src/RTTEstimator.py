@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds the round trip time estimator that decides how long the
+# UDPSocket waits for an ACK before resending a packet
+
+from collections import OrderedDict
+from threading import Lock
+
+class RTTEstimator:
+    """
+    This class will keep an estimate of the round trip time to every peer and
+    work out the retransmission timeout (RTO) from it, the same way TCP does
+    (RFC 6298):
+        SRTT = 7/8 SRTT + 1/8 sample
+        RTTVAR = 3/4 RTTVAR + 1/4 |SRTT - sample|
+        RTO = SRTT + 4 RTTVAR, kept between minRto and maxRto
+    Every timeout doubles the RTO until a new sample comes in. Following
+    Karn's rule, the caller should only give us samples from packets that
+    were never resent, since we can't tell which copy an ACK was for.
+
+    Methods:
+        rto:
+            The current timeout for a peer
+        sample:
+            Adds a round trip time measurement for a peer
+        backoff:
+            Doubles the timeout for a peer after a timeout
+        stats:
+            The estimates for every peer, for diagnostics
+    Attributes:
+        initialRto: The timeout for a peer we haven't measured yet
+        minRto/maxRto: The smallest and biggest timeout we will use
+        maxPeers: How many peers we keep estimates for, the least recently
+                  used ones are forgotten first
+        peers: {peer:[SRTT,RTTVAR,RTO]}
+    """
+    def __init__(self,initialRto=0.5,minRto=0.05,maxRto=4.0,maxPeers=65536):
+        self.initialRto = initialRto
+        self.minRto = minRto
+        self.maxRto = maxRto
+        self.maxPeers = maxPeers
+        self.peers = OrderedDict()
+        self.lock = Lock()
+
+    def rto(self,peer):
+        with self.lock:
+            estimate = self.peers.get(peer)
+            if estimate is None:
+                return self.initialRto
+            return estimate[2]
+
+    def sample(self,peer,rtt):
+        """
+        This method will update the estimates for a peer with a new round
+        trip time measurement (in seconds)
+        """
+        with self.lock:
+            estimate = self.peers.get(peer)
+            if estimate is None or estimate[0] is None:
+                srtt = rtt
+                rttvar = rtt / 2
+            else:
+                srtt,rttvar = estimate[0],estimate[1]
+                rttvar = 0.75 * rttvar + 0.25 * abs(srtt - rtt)
+                srtt = 0.875 * srtt + 0.125 * rtt
+            rto = min(max(srtt + 4 * rttvar,self.minRto),self.maxRto)
+            self.remember(peer,[srtt,rttvar,rto])
+
+    def backoff(self,peer):
+        """
+        This method will double the timeout for a peer after a timeout
+        """
+        with self.lock:
+            estimate = self.peers.get(peer)
+            if estimate is None:
+                estimate = [None,None,self.initialRto]
+            estimate[2] = min(estimate[2] * 2,self.maxRto)
+            self.remember(peer,estimate)
+
+    def remember(self,peer,estimate):
+        """
+        This method will store the estimate for a peer, forgetting the least
+        recently used peer if we have too many. The lock must be held.
+        """
+        self.peers[peer] = estimate
+        self.peers.move_to_end(peer)
+        if len(self.peers) > self.maxPeers:
+            self.peers.popitem(last=False)
+
+    def stats(self):
+        """
+        This method will return {peer:{'srtt':,'rttvar':,'rto':}} with the
+        estimates in seconds (srtt and rttvar are None until we get a sample)
+        """
+        with self.lock:
+            return {peer:{'srtt':srtt,'rttvar':rttvar,'rto':rto}
+                    for peer,(srtt,rttvar,rto) in self.peers.items()}
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds the token buckets the Server uses to limit how fast each
+# client can send it requests, so one client can't slow down everyone else
+
+import time
+from array import array
+
+class RateLimiter:
+    """
+    This class will keep a token bucket for every address and every Nickname
+    that sends the Server requests, one for each kind of command. A bucket
+    fills up at the rate of its command, up to its burst, and every request
+    takes a token out of the buckets of its address and its Nickname. A
+    request is only admitted if all of its buckets have a token, otherwise
+    none of them lose one and we say how long until they will.
+
+    Storage:
+        There can be a lot of clients, so the buckets aren't objects. Each
+        one is three numbers in the values array, its tokens, when they
+        were last filled and when we last told the client to slow down
+        (until then there is no point telling it again). slots maps each
+        command to {key:index of the bucket}. A bucket that has been idle
+        long enough to be full again is the same as no bucket, so every
+        sweepEvery seconds those are dropped and their room reused.
+
+    Methods:
+        admit:
+            Takes a token for a request, or says how long to wait
+        sweep:
+            Drops the buckets that are full again
+        limit:
+            The (rate,burst) of a command
+    Attributes:
+        LIMITS: The (requests per second,burst) of each command, any other
+                command uses the one under None
+        limits: LIMITS with the ones we were given
+        slots: {command:{key:index}} of every bucket
+        values: The tokens,filled and quiet of every bucket
+        free: The indexes of the buckets that were dropped
+        sweepEvery: How often we drop the buckets that are full again
+
+    It is only used by the thread (or event loop) that reads the socket, so
+    it doesn't need a lock.
+    """
+    LIMITS = {'reg':(0.5,3),'dereg':(0.5,3),'MSG':(20.0,50),
+              'post':(5.0,20),'join':(2.0,10),'leave':(2.0,10),
+              'table':(2.0,10),'lookup':(10.0,30),'stats':(1.0,5),
+              'offer':(1.0,5),'chunk':(2000.0,4000),'done':(5.0,10),
+              'accept':(5.0,10),None:(10.0,20)}
+    #The numbers each bucket keeps in values
+    SIZE = 3
+
+    def __init__(self,limits=None,sweepEvery=30.0):
+        self.limits = dict(self.LIMITS)
+        if limits is not None:
+            self.limits.update(limits)
+        self.slots = dict()
+        self.values = array('d')
+        self.free = []
+        self.sweepEvery = sweepEvery
+        self.swept = time.monotonic()
+
+    def limit(self,command):
+        return self.limits.get(command,self.limits[None])
+
+    def admit(self,command,keys,now=None):
+        """
+        This method will take a token from the bucket of every key for a
+        command, if they all have one
+
+        Parameters:
+            command: The name of the command, like 'MSG'
+            keys: The address and Nickname (if we know it) of the client
+        Output:
+            (0,False) - if the request is admitted
+            (retryAfter,notify) - otherwise, where retryAfter is how many
+                seconds until it would be and notify is whether the client
+                still needs to be told
+        """
+        if now is None:
+            now = time.monotonic()
+        if now - self.swept >= self.sweepEvery:
+            self.sweep(now)
+        if command not in self.limits:
+            command = None
+        rate,burst = self.limits[command]
+        slots = self.slots.setdefault(command,dict())
+        indexes = []
+        retryAfter = 0
+        notify = False
+        values = self.values
+        for key in keys:
+            if key is None:
+                continue
+            index = slots.get(key)
+            if index is None:
+                index = self.allocate(burst,now)
+                slots[key] = index
+            tokens = min(burst,values[index] + (now - values[index+1]) * rate)
+            values[index] = tokens
+            values[index+1] = now
+            if tokens < 1:
+                wait = (1 - tokens) / rate
+                if wait > retryAfter:
+                    retryAfter = wait
+                if now >= values[index+2]:
+                    notify = True
+                    values[index+2] = now + wait
+            indexes.append(index)
+        if retryAfter:
+            return (retryAfter,notify)
+        for index in indexes:
+            values[index] -= 1
+        return (0,False)
+
+    def allocate(self,burst,now):
+        """
+        This method will return the index of a new full bucket
+        """
+        if self.free:
+            index = self.free.pop()
+            self.values[index:index+self.SIZE] = array('d',(burst,now,0))
+            return index
+        index = len(self.values)
+        self.values.extend((burst,now,0))
+        return index
+
+    def sweep(self,now=None):
+        """
+        This method will drop the buckets that have been idle long enough to
+        be full again, and that we aren't keeping quiet about
+        """
+        if now is None:
+            now = time.monotonic()
+        self.swept = now
+        values = self.values
+        for command,slots in self.slots.items():
+            rate,burst = self.limit(command)
+            idle = burst / rate
+            full = [key for key,index in slots.items()
+                    if now - values[index+1] >= idle and
+                    now >= values[index+2]]
+            for key in full:
+                self.free.append(slots.pop(key))
+        return None
+
+    def __len__(self):
+        return sum(len(slots) for slots in self.slots.values())
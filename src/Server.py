@@ -4,8 +4,16 @@
 #This file holds all the code that will be used by the Server in the UDP
 # Chat application
 from UDPSocket import UDPSocket
+from WorkerPool import WorkerPool
+from MessageStore import MemoryStore
+from TimerWheel import TimerWheel
+from Snapshotter import Snapshotter
+from RateLimiter import RateLimiter
+from FileTransfer import FileTransfer
 import time
-from threading import Thread as th
+import queue
+from threading import Lock,Timer,Thread
+from collections import deque
 
 class Server:
     """
@@ -22,13 +30,62 @@ class Server:
             This will register a user and append their nickname and 
             information to the clientTable dictionary
         updateAllClients:
-            This must happen after a user(clients) has been registered. 
-            Will send an updated table to all users on the service
+            Will send the full table to all users on the service at the
+            same time
+        tableChanged:
+            This must happen after a user(clients) has been registered or
+            their status changed. Records the change so that only the
+            changes are sent to the users on the service
+        sendTable:
+            Sends a client the full table, or the changes since the version
+            it has if we still remember them
+        clientBeat:
+            Called for every heartbeat, restarts the client's timer
+        watchSessions/sessionExpired:
+            Marks the clients whose timers run out Offline
+        presenceChanged:
+            Updates a client's Online status when it stops or starts
+            sending heartbeats
+        handleMessage:
+            Runs processMessage and records how long it took
+        admit/throttle:
+            Checks a request against the rate limits before it goes to a
+            worker, and tells a client that goes over them when to retry
+        backlogged:
+            Whether the worker of a client has no room for its requests
+        storeMessage/deliverMessage:
+            Sends a message to a client that is online or stores it, and
+            lets the sender know what happened
+        markOffline:
+            Marks a client we couldn't reach Offline
+        lookupUser:
+            Sends a client the entry of one other client
+        sendStats:
+            Sends the metrics to a local client that asked with 'stats:'
+        joinChannel/leaveChannel:
+            Adds a client to a channel or takes it out
+        postMessage:
+            Sends a post to every other member of a channel
+        initFiles:
+            Lets clients send files through us, if we have a spoolDir
+        offerFile/finishFile:
+            Spool a file sent to a client that is offline
+        forwardFiles/sendFiles/sendFile:
+            Pass the spooled files on to a client once it is back
+        initSnapshots:
+            Loads the last snapshot of our state, if there is one, and
+            starts saving new ones
+        captureState/restoreState:
+            Copies the state a snapshot holds, or puts it back
     Attributes:
         udp: Will hold the udp socket that can be used to send and recieve
             data.
-        threads = will hold all the threads
-        messages = This will hold all stored messages
+        pool = The worker threads that process messages, messages from the
+               same client are always processed in order
+        store = This will hold all stored messages. It is a MemoryStore
+                unless a different store (like a LogStore) is given
+        pageSize: How many stored messages are read from the store at a
+                  time when a client comes back for them
         clientTable: This will hold the IP addresses and Port numbers of
                     clients that are connected. The Client Table will hold 
                     the nick names of the clients in a nested dictionary of 
@@ -41,23 +98,281 @@ class Server:
                                    status online
                             }
                         }
-                            
+        tableVersion: Goes up by one every time the clientTable changes
+        changeLog: The most recent changes to the clientTable, as tuples of
+                   (tableVersion,Nick)
+        flushedVersion: The tableVersion the clients were last updated to
+        coalesceDelay: How long we wait to collect changes into one update
+        keepalive: How often the clients send a heartbeat
+        misses: How many heartbeats in a row a client can miss before we
+                mark it Offline
+        wheel: A TimerWheel with a timer for each client that is online
+        addresses: The Nickname of the client at each (IP,PORT)
+        metrics: The MetricsRegistry shared with the socket, it can also be
+                 served in the Prometheus format on metricsPort
+        commandTime: A histogram of how long each command takes to process
+        channels: The Nicknames of the members of each channel
+        memberOf: The channels each Nickname is a member of
+        channelLock: Has to be held to change the channels
+        snapshots: The Snapshotter saving our state, if we were given a
+                   snapshotDir
+        limiter: The RateLimiter with the token buckets of every address
+                 and Nickname
+        throttledCount: How many requests of each command went over the
+                        limits
+        busyCount: How many requests of each command were turned down
+                   because their worker had no room for them
+        files: The FileTransfer spooling files for clients that are
+               offline, if we were given a spoolDir
+        fileReplies: The queue of every file we are passing on that is
+                     waiting for the client to answer
+        forwarding: The Nicknames we are passing files on to
 
+    Table Updates:
+        Clients are sent the full table as 'update:<tableVersion>' when they
+        register and the changes as 'delta:' after that. The data of a delta
+        is of the form {'from':version,'to':version,'changes':{Nick:entry}}.
+        A client that is missing changes asks for the table again with
+        'table:' and the version it has.
+        A client that registers with 'reg:zlib' can read compressed packets,
+        so the table it gets is 'update:<tableVersion>:zlib' to tell it we
+        can too, and big packets between us are compressed from then on.
+
+    Presence:
+        Clients send a heartbeat every keepalive seconds. Each heartbeat
+        restarts the client's timer on the wheel, and when a timer runs out
+        the client is marked Offline and the change goes out with the next
+        table update. A client that was marked Offline but is still sending
+        heartbeats is marked Online again and gets the table and its stored
+        messages.
+
+    Channels:
+        A client joins a channel with 'join:<channel>', leaves it with
+        'leave:<channel>' and posts to it with 'post:<channel>' and the
+        message, so a post is uploaded once however big the channel is. The
+        Server sends it to the members that are online all at once as
+        'post:<channel>' and stores it for the rest (and for anyone it
+        couldn't reach) in one go. Members stay in their channels while they
+        are offline so they get the posts they missed when they come back.
+
+    Snapshots:
+        With a snapshotDir the table, the channels and the stored messages
+        (unless the store keeps them on disk itself) are saved every
+        snapshotInterval seconds. A Server started on the same directory
+        loads them, so the clients don't have to register again. It sends
+        every client that was online the table once, they keep sending
+        heartbeats to the same Port, and the ones that don't are marked
+        Offline when their timers run out like always.
+
+    Files:
+        A client sends a file to a client that is offline (or doesn't
+        answer) through us, with the same 'offer:', 'chunk:' and 'done:'
+        packets it would send the other client (see FileTransfer). The
+        chunks are written to the spoolDir as they arrive, and a transfer
+        that is cut off resumes from the last chunk we have. Once the
+        client the file is for is back we offer it the same way, and delete
+        the file when it has all of it.
+
+    Rate Limits:
+        Every request takes a token from the buckets of its address and of
+        its Nickname (the one it registers, or the one registered at the
+        address) for its command. The socket asks admit before it ACKs the
+        packet, so one that goes over the limits is dropped without an ACK
+        and costs no work and no table updates. The client's socket still
+        has it and resends it once it has backed off, so nothing is lost,
+        and the client is told once each time it runs out, as
+        'throttled:<command>' with the seconds until it can try again.
     """
-    def __init__(self,PORT):
-        self.udp = UDPSocket(PORT)#We create an instance of the UDPsocket
-        self.clientTable = dict()#A dictionary that will hold the Client Info
+    #The commands the clients can send
+    COMMANDS = ('reg','dereg','MSG','table','stats','join','leave','post',
+                'lookup','offer','chunk','done','accept')
+
+    def __init__(self,PORT,codec='binary',workers=8,queueSize=256,
+                 store=None,keepalive=5.0,misses=3,metricsPort=None,
+                 compression=True,snapshotDir=None,snapshotInterval=1.0,
+                 limits=None,spoolDir=None):
+        #We create an instance of the UDPsocket
+        self.udp = UDPSocket(PORT,codec=codec,compression=compression)
+        #A fixed number of threads with bounded queues will do all the work
+        self.pool = WorkerPool(workers,queueSize)
+        self.initState(store,keepalive=keepalive,misses=misses,
+                       limits=limits)
+        if self.initSnapshots(snapshotDir,snapshotInterval):
+            #Everyone that was online gets the table we came back with
+            Thread(target=self.updateAllClients,daemon=True).start()
+        self.initFiles(spoolDir)
+        self.initMetrics(self.udp.metrics,metricsPort)
+        self.metrics.gauge('server_worker_queue_depth',
+                           'Messages waiting for a worker',self.pool.depth)
+        self.udp.onBeat = self.clientBeat
+        self.udp.admit = self.admit
+        self.watcher = Thread(target=self.watchSessions,daemon=True)
+        self.watcher.start()
         #we want to call the Main thread now
-        self.threads = []#will hold all threads
-        self.messages = dict()
         print("Server all set up! Waiting for Connections")
         self.MainThread()
+    def initState(self,store=None,coalesceDelay=0.05,logSize=1024,
+                  keepalive=5.0,misses=3,limits=None,pageSize=256):
+        """
+        This method will set up the client table, the stored messages, the
+        records we need to send table updates, the timers of the clients
+        and their rate limits
+
+        Parameters:
+            limits: {command:(requests per second,burst)} to use instead of
+                    the ones in RateLimiter.LIMITS
+            pageSize: How many stored messages are sent to a client at a time
+        """
+        self.clientTable = dict()#A dictionary that will hold the Client Info
+        self.store = store if store is not None else MemoryStore()
+        self.pageSize = pageSize
+        self.tableVersion = 0
+        self.changeLog = deque(maxlen=logSize)
+        self.flushedVersion = 0
+        self.coalesceDelay = coalesceDelay
+        self.tableLock = Lock()
+        self.flushTimer = None
+        self.keepalive = keepalive
+        self.misses = misses
+        #A tick of a quarter of the keepalive is plenty precise, and with 256
+         # slots the timers only go around the wheel once
+        self.wheel = TimerWheel(tick=keepalive/4)
+        self.addresses = dict()
+        self.channels = dict()
+        self.memberOf = dict()
+        self.channelLock = Lock()
+        self.snapshots = None
+        self.limiter = RateLimiter(limits)
+        self.files = None
+    def initSnapshots(self,directory,interval=1.0):
+        """
+        This method will load the last snapshot in a directory and start
+        saving new ones there
+
+        Output:
+            True - if we loaded a snapshot
+            False - otherwise
+        """
+        if directory is None:
+            return False
+        self.snapshots = Snapshotter(directory,self.captureState,interval)
+        state = self.snapshots.load()
+        if state is not None:
+            self.restoreState(state)
+            print("Restored {} clients from the snapshot".format(
+                len(self.clientTable)))
+        if not self.store.durable:
+            self.store.onChange = self.snapshots.changed
+        self.snapshots.start()
+        return state is not None
+    def initFiles(self,directory,timeout=5.0):
+        """
+        This method will let clients send files through us to clients that
+        are offline, spooling them in a directory until they are back
+
+        Parameters:
+            directory: Where the files are spooled, without one we turn
+                       down every file
+            timeout: How long we wait for a client to answer us when we
+                     pass a file on
+        """
+        if directory is None:
+            return None
+        self.files = FileTransfer(directory,spool=True)
+        self.fileTimeout = timeout
+        self.fileReplies = dict()
+        self.forwarding = set()
+        self.fileLock = Lock()
+    def captureState(self,nicks=None):
+        """
+        This method will copy the state of some clients for a snapshot. Only
+        the table entries are copied, the messages and everything else are
+        shared, so the snapshot can be packed and written without holding
+        up the Server.
+
+        Parameters:
+            nicks: The Nicknames to copy, None copies every client
+        Output:
+            The state, of the form the Snapshotter describes
+        """
+        with self.tableLock:
+            version = self.tableVersion
+            if nicks is None:
+                nicks = list(self.clientTable)
+            entries = [(nick,self.clientTable.get(nick)) for nick in nicks]
+        with self.channelLock:
+            channels = {nick:sorted(self.memberOf.get(nick,()))
+                        for nick in nicks}
+        durable = self.store.durable
+        saved = dict()
+        for nick,entry in entries:
+            if entry is None:
+                saved[nick] = None
+                continue
+            saved[nick] = [entry['IP'],entry['PORT'],entry['Online'],
+                           channels[nick],
+                           None if durable else self.store.dump(nick)]
+        return {'version':version,
+                'nextId':None if durable else self.store.nextId,
+                'nicks':saved}
+    def restoreState(self,state):
+        """
+        This method will put back the state from a snapshot. Clients that
+        were online get a timer, so they are marked Offline if they don't
+        send a heartbeat.
+        """
+        self.tableVersion = state['version']
+        self.flushedVersion = state['version']
+        for nick,saved in state['nicks'].items():
+            if saved is None:
+                continue
+            IP,PORT,online,channels,messages = saved
+            with self.tableLock:
+                self.clientTable[nick] = {'IP':IP,'PORT':PORT,
+                                          'Online':online}
+            for channel in channels:
+                self.addMember(channel,nick)
+            if messages and not self.store.durable:
+                self.store.load(nick,messages)
+            if online:
+                self.sessionStarted(nick,IP,PORT)
+        return None
+    def initMetrics(self,metrics,metricsPort=None):
+        """
+        This method will set up the Server's metrics in the registry and
+        serve them in the Prometheus format if we are given a Port
+        """
+        self.metrics = metrics
+        self.commandTime = metrics.histogram('server_command_seconds',
+            'Time spent processing each command','command')
+        metrics.gauge('server_stored_messages',
+                      'Messages waiting for clients that are offline',
+                      self.store.size)
+        metrics.gauge('server_clients_online','Clients that are online',
+                      lambda: sum(1 for entry in list(self.clientTable.values())
+                                  if entry['Online']))
+        metrics.gauge('server_table_version','Version of the client table',
+                      lambda: self.tableVersion)
+        self.throttledCount = metrics.counter('server_throttled_total',
+            'Requests dropped for going over the rate limits','command')
+        self.busyCount = metrics.counter('server_busy_total',
+            'Requests turned down because their worker had no room',
+            'command')
+        metrics.gauge('server_rate_buckets','Token buckets we are keeping',
+                      lambda: len(self.limiter))
+        if metricsPort is not None:
+            self.metricsServer = metrics.serve(metricsPort)
     def MainThread(self):
         """
         This method will serve as the main loop that the server will follow.
-        When the server needs to accomplish some task, it will create a new 
-        thread that will complete that task, so that the server can continue 
-        to listen for incoming connection requests
+        When the server needs to accomplish some task, it will hand it to the
+        worker pool, so that the server can continue to listen for incoming
+        connection requests. We never wait for a worker that is behind,
+        since that would hold up the requests of every other client too.
+        Instead admit turns down the requests of a client whose worker has
+        no room before they are ACKed, so the client slows down and resends
+        them instead of the server running out of memory. A request that
+        still finds no room (others came in behind it) is dropped.
 
         """
         while True:
@@ -68,12 +383,77 @@ class Server:
                 # And the program crashes
                 continue
             if data != None:
-                #We want to create a thread and send it to Process Message
-                x=th(target=self.processMessage,args=(data,address),daemon=True)
-                x.start()
-                self.threads.append(x)
+                #We want to send it to Process Message on the worker for
+                 # this client so its messages stay in order
+                if not self.pool.submit(address,self.handleMessage,data,
+                                        address,block=False):
+                    self.busyCount.inc(label=self.commandName(data))
+                    print("Dropped a request from {}:{}, its worker is "
+                          "behind".format(address[0],address[1]))
                 data = None
                 address = None
+    def admit(self,data,address):
+        """
+        This method will take a token for a request from the buckets of the
+        client that sent it. The socket's dispatcher calls it before the
+        request is ACKed, so one that is over the limits is only counted.
+
+        Output:
+            True - if the request should be ACKed and processed
+            False - if it was dropped and the client has to resend it
+        """
+        if self.backlogged(address):
+            #The client resends it once the worker has caught up
+            self.busyCount.inc(label=self.commandName(data))
+            return False
+        command = str(data[1]).split(':')[0]
+        nick = self.addresses.get(address)
+        if command == 'reg' and isinstance(data[2],str):
+            nick = data[2]
+        retryAfter,notify = self.limiter.admit(command,(address,nick))
+        if not retryAfter:
+            return True
+        self.throttledCount.inc(label=self.commandName(data))
+        if notify:
+            self.throttle(str(data[1]),retryAfter,address)
+        return False
+    def commandName(self,data):
+        """
+        This method will return the command of a request for the metrics,
+        'unknown' if it isn't one of ours
+        """
+        command = str(data[1]).split(':')[0]
+        return command if command in self.COMMANDS else 'unknown'
+    def backlogged(self,address):
+        """
+        This method will return whether the worker of a client has no room
+        for another request, the socket's dispatcher asks through admit
+        """
+        return self.pool.full(address)
+    def throttle(self,command,retryAfter,address):
+        """
+        This method will tell a client it went over the rate limits of a
+        command and how many seconds until it can try again
+        """
+        MSG = [1,'throttled:'+command,round(retryAfter,3)]
+        #A worker sends it so we don't wait on the ACK, and if they are all
+         # busy the client just doesn't hear about it
+        self.pool.submit(address,self.udp.secureSend,MSG,address[1],
+                         address[0],block=False)
+    def handleMessage(self,data,address):
+        """
+        This method will process a message and record how long it took under
+        the name of its command
+        """
+        start = time.perf_counter()
+        try:
+            self.processMessage(data,address)
+        finally:
+            name = str(data[1]).split(':')[0]
+            if name not in self.COMMANDS:
+                #Any other name would be a new series in the histogram
+                name = 'unknown'
+            self.commandTime.observe(time.perf_counter() - start,name)
     def processMessage(self,data,address):
         """
         This method will process any inputs that is receieved in the Main
@@ -83,6 +463,9 @@ class Server:
         command = data[1].split(':')
         data = data[2]
         if command[0] == 'reg':
+            if self.udp.compression in command[1:]:
+                #The client can read compressed packets
+                self.udp.allowCompression(address)
             #now we can register the user and update all other users
             self.registerUser(data,address[0],address[1])
         elif command[0] == 'dereg':
@@ -92,9 +475,54 @@ class Server:
             #In this case we want to store the message that the client is 
               #sending and send it later
               self.storeMessage(command[1],data,address)
+        elif command[0] == 'table':
+            #The client wants the table, data is the version it has
+            self.sendTable(address[0],address[1],data)
+        elif command[0] == 'stats':
+            self.sendStats(address)
+        elif command[0] == 'join':
+            self.joinChannel(command[1],address)
+        elif command[0] == 'leave':
+            self.leaveChannel(command[1],address)
+        elif command[0] == 'post':
+            self.postMessage(command[1],data,address)
+        elif command[0] == 'lookup':
+            self.lookupUser(command[1],address)
+        elif command[0] == 'offer':
+            self.offerFile(command[1],data,address)
+        elif command[0] == 'chunk':
+            if self.files is not None:
+                self.files.write(command[1],data)
+        elif command[0] == 'done':
+            self.finishFile(command[1],address)
+        elif command[0] == 'accept':
+            #A client answering a file we are passing on to it
+            self.fileReply(command[1],data)
         else:
             print("Incorrect Command")
             return None
+    def lookupUser(self,nick,address):
+        """
+        This method will send a client the entry of one client, as
+        [1,'found:<Nick>',entry] (None if we don't know it)
+        """
+        entry = self.clientTable.get(nick)
+        if entry is not None:
+            entry = dict(entry)
+        self.udp.secureSend([1,'found:'+nick,entry],address[1],address[0])
+        return None
+    def sendStats(self,address):
+        """
+        This method will send the metrics to a client that asked for them,
+        as [1,'stats:',{metric name:value}]. Only clients on this machine
+        can ask.
+        """
+        if not address[0].startswith('127.'):
+            print("Stats can only be asked for from this machine")
+            return None
+        MSG = [1,'stats:',self.metrics.snapshot()]
+        self.udp.secureSend(MSG,address[1],address[0])
+        return None
 
     def storeMessage(self,nick,MSG,address):
         """
@@ -105,61 +533,382 @@ class Server:
             MSG: the Message to relay to the client
             address: the address of the client making the request
         """
+        result = self.deliverMessage(nick,MSG)
+        if result == 'delivered':
+            #Then the client was online!
+            #we want to notify the client that made the request
+            Error = [1,"ERROR",'The client is online!']
+            self.udp.secureSend(Error,address[1],address[0])
+        elif result == 'full':
+            Error = [1,"ERROR","{} has too many messages waiting".format(nick)]
+            self.udp.secureSend(Error,address[1],address[0])
+        return None
+    def deliverMessage(self,nick,MSG):
+        """
+        This method will send a message to a client if it is online, or
+        store it otherwise
+
+        Output:
+            'delivered' - if the client got it
+            'stored' - if it is waiting for the client
+            'full' - if the client has too many messages waiting already
+        """
         #first we will get all the clients details
-        IP = self.clientTable[nick]['IP']
-        PORT = self.clientTable[nick]['PORT']
-        online = self.clientTable[nick]['Online']
+        with self.tableLock:
+            entry = self.clientTable[nick]
+            IP,PORT,online = entry['IP'],entry['PORT'],entry['Online']
         #first we will check to see if the client is online in our records
         if online:
             #If they are online, we want to try to send the message to them
-            response = self.udp.secureSend(MSG,PORT,IP)
+            response = self.udp.secureSend([1,"MSG:",MSG],PORT,IP)
             if response == 200:
-                #Then the client was online!
-                #we want to notify the client
-                Error = [1,"ERROR",'The client is online!']
-                self.udp.secureSend(Error,PORT,IP)
+                return 'delivered'
+            #We want to update the Status of the Client
+            self.markOffline(nick,IP,PORT)
+        #If the client is not online or the message was not send correctly,
+         # we want to store it
+        if not self.queueMessage(nick,MSG):
+            return 'full'
+        return 'stored'
+    def markOffline(self,nick,IP,PORT):
+        """
+        This method will mark a client we couldn't reach at IP and PORT
+        Offline. If it came back from another address while we were trying
+        it stays Online.
+        """
+        with self.tableLock:
+            entry = self.clientTable.get(nick)
+            if (entry is None or not entry['Online'] or
+                    (entry['IP'],entry['PORT']) != (IP,PORT)):
                 return None
-            else:
-                #We want to update the Status of the Client
-                self.clientTable[nick]['Online'] = False
-                #The message was not send correctly, so we want to store it
-                if nick in self.messages:
-                    #if there is a key then we wna to append a message
-                    self.messages[nick].append(MSG)
-                else:
-                    #if a key doesn't already exist we want to make on
-                    self.messages[nick] = [MSG]
+            entry['Online'] = False
+        self.tableChanged(nick)
+        return None
+    def queueMessage(self,nick,MSG):
+        """
+        This method will add a message to the list of messages waiting to be
+        sent to a client when they reregister
+        Parameters:
+            nick: the nickname of the client the message is for
+            MSG: the Message to store
+        Output:
+            True - if the message was stored
+            False - if the client has too many messages waiting already
+        """
+        return self.store.append(nick,MSG)
+    def joinChannel(self,channel,address):
+        """
+        This method will add the client at an address to a channel, making
+        the channel if it is new
+
+        Parameters:
+            channel: The name of the channel
+            address: The address of the client
+        """
+        nick = self.channelRequest(channel,address)
+        if nick is not None:
+            self.addMember(channel,nick)
+        return None
+    def leaveChannel(self,channel,address):
+        """
+        This method will take the client at an address out of a channel
+        """
+        nick = self.channelRequest(channel,address)
+        if nick is not None:
+            self.removeMember(channel,nick)
+        return None
+    def channelRequest(self,channel,address):
+        """
+        This method will find the Nickname of the client asking to do
+        something with a channel, and let it know if it can't
+
+        Output:
+            The Nickname - if the request can go ahead
+            None - otherwise
+        """
+        error = self.channelError(channel,address)
+        if error is not None:
+            self.udp.secureSend([1,"ERROR",error],address[1],address[0])
+            return None
+        return self.addresses[address]
+    def channelError(self,channel,address):
+        """
+        This method will check a request about a channel
+
+        Output:
+            None - if the request is fine
+            The error to send the client - otherwise
+        """
+        if address not in self.addresses:
+            return "You have to register before using channels"
+        if channel == '':
+            return "Channels need a name"
+        return None
+    def addMember(self,channel,nick):
+        with self.channelLock:
+            self.channels.setdefault(channel,set()).add(nick)
+            self.memberOf.setdefault(nick,set()).add(channel)
+        if self.snapshots is not None:
+            self.snapshots.changed(nick)
+    def removeMember(self,channel,nick):
+        if self.snapshots is not None:
+            self.snapshots.changed(nick)
+        with self.channelLock:
+            members = self.channels.get(channel)
+            if members is not None:
+                members.discard(nick)
+                if not members:
+                    del self.channels[channel]
+            channels = self.memberOf.get(nick)
+            if channels is not None:
+                channels.discard(channel)
+                if not channels:
+                    del self.memberOf[nick]
+    def channelMembers(self,channel,nick):
+        """
+        This method will return the other members of a channel the client is
+        in, or None if it isn't in the channel
+        """
+        with self.channelLock:
+            members = self.channels.get(channel)
+            if members is None or nick not in members:
                 return None
-        else:
-            #If the client is not online we, want to store the message
-            #The message was not send correctly, so we want to store it
-            if nick in self.messages.keys():
-                #if there is a key then we wna to append a message
-                self.messages[nick].append(MSG)
-            else:
-                #if a key doesn't already exist we want to make on
-                self.messages[nick] = [MSG]
+            return [member for member in members if member != nick]
+    def splitMembers(self,members):
+        """
+        This method will split the members of a channel into the ones that
+        are online and the ones that are offline
+
+        Output:
+            A tuple of {(IP,PORT):Nick} for the members that are online and a
+            list of the Nicknames of the ones that are offline
+        """
+        online = dict()
+        offline = []
+        with self.tableLock:
+            for member in members:
+                entry = self.clientTable.get(member)
+                if entry is None:
+                    continue
+                if entry['Online']:
+                    online[(entry['IP'],entry['PORT'])] = member
+                else:
+                    offline.append(member)
+        return online,offline
+    def postMessage(self,channel,MSG,address):
+        """
+        This method will send a post to every other member of a channel. The
+        members that are online get it at the same time, and the post is
+        stored for the ones that are offline or couldn't be reached.
+
+        Parameters:
+            channel: The name of the channel
+            MSG: The text of the post
+            address: The address of the client posting it
+        """
+        nick = self.channelRequest(channel,address)
+        if nick is None:
             return None
+        members = self.channelMembers(channel,nick)
+        if members is None:
+            Error = [1,"ERROR","You aren't in {}".format(channel)]
+            self.udp.secureSend(Error,address[1],address[0])
+            return None
+        text = '[{}] {}: {}'.format(channel,nick,MSG)
+        online,offline = self.splitMembers(members)
+        responses = self.udp.broadcastSend([1,'post:'+channel,text],
+                                           list(online))
+        for client,response in responses.items():
+            if response != 200:
+                #We couldn't reach this member so it is stored instead
+                member = online[client]
+                self.markOffline(member,client[0],client[1])
+                offline.append(member)
+        self.queueMessages(offline,text,address)
+        return None
+    def queueMessages(self,nicks,MSG,address):
+        """
+        This method will store a message for many clients at once, letting
+        the client that sent it know about the ones that have too many
+        messages waiting
+        """
+        if not nicks:
+            return None
+        full = self.store.appendMany(nicks,MSG)
+        if full:
+            Error = [1,"ERROR","{} have too many messages waiting".format(
+                ', '.join(sorted(full)))]
+            self.udp.secureSend(Error,address[1],address[0])
+        return None
     def sendStored(self,nick):
         """
-        This method will send registered users offline messages
+        This method will send registered users offline messages. They are
+        read from the store a page of pageSize messages at a time, so a
+        client with a long queue doesn't have all of it in memory at once.
+        """
+        #figure out the IP and Port of the client
+        with self.tableLock:
+            IP = self.clientTable[nick]['IP']
+            PORT = self.clientTable[nick]['PORT']
+        while True:
+            #we want to check to see if the user has any messages left
+            page = self.store.pending(nick,limit=self.pageSize)
+            batches = self.makeBatches(page)
+            if not batches:
+                #There aren't any messages so we can just return
+                return None
+            #we want to make a packet for each batch of messages
+            MSGS = [[1,"batch:",messages] for lastId,messages in batches]
+            #now we can send all of the batches through the sliding window
+             # instead of waiting for an ACK after each one. Once a batch is
+             # ACKed the client has its messages so we don't need to keep
+             # them, and the next page starts after it
+            response = self.udp.windowSend(MSGS,PORT,IP,
+                onAck=lambda index: self.store.ack(nick,batches[index][0]))
+            if response != 200 or len(page) < self.pageSize:
+                #The client went away, or that was the last page
+                return None
+
+    def offerFile(self,transferId,offer,address):
+        """
+        This method will take a file a client wants to send to a client
+        that is offline, answering with the first chunk we need, or None if
+        we can't take it
+        """
+        start = None
+        if (self.files is not None and isinstance(offer,dict) and
+                offer.get('to') in self.clientTable):
+            #The transfers it has open count against the client sending
+             # it, whatever the offer says it is from
+            sender = self.addresses.get(address,address)
+            start = self.files.accept(transferId,offer,sender)
+        self.udp.secureSend([1,'accept:'+transferId,start],address[1],
+                            address[0])
+    def finishFile(self,transferId,address):
+        """
+        This method will tell a client how much of a file we have once it
+        has sent all of it, and pass the file on if we have all of it and
+        the client it is for is back already
         """
-        #first we want to check to see if the user has any messages
-        if nick in self.messages:
-            #we want to iterate over the list of messages stored
-            for message in self.messages[nick]:
-                MSG = [1,"MSG:",message]
-                #figure out the IP and Port of the client
-                IP = self.clientTable[nick]['IP']
-                PORT = self.clientTable[nick]['PORT']
-                #now we can send the message
-                self.udp.secureSend(MSG,PORT,IP)
-            #After this we can return
+        have,path,offer = (None,None,None)
+        if self.files is not None:
+            have,path,offer = self.files.finish(transferId)
+        self.udp.secureSend([1,'accept:'+transferId,have],address[1],
+                            address[0])
+        if path is not None:
+            entry = self.clientTable.get(offer['to'])
+            if entry is not None and entry['Online']:
+                self.forwardFiles(offer['to'])
+    def forwardFiles(self,nick):
+        """
+        This method will pass the files spooled for a client on to it in a
+        thread of its own, a file can take a while and the client's worker
+        has its other messages to get to
+        """
+        if self.files is None:
             return None
-        else:
-            #There aren't any messages so we can just return
+        with self.fileLock:
+            if nick in self.forwarding or not self.files.spooled(nick):
+                return None
+            self.forwarding.add(nick)
+        Thread(target=self.sendFiles,args=(nick,),daemon=True).start()
+    def sendFiles(self,nick):
+        """
+        This method will send a client every file spooled for it, deleting
+        each one once the client has all of it. Whatever isn't sent is left
+        for the next time the client comes back.
+        """
+        try:
+            for offer,path in self.files.spooled(nick):
+                entry = self.clientTable.get(nick)
+                if entry is None or not entry['Online']:
+                    break
+                if self.sendFile(offer,path,entry['IP'],entry['PORT']) != 200:
+                    break
+                self.files.remove(offer['id'])
+                print("Passed {} on to {}".format(offer['name'],nick))
+        finally:
+            with self.fileLock:
+                self.forwarding.discard(nick)
+    def sendFile(self,offer,path,IP,PORT,attempts=3):
+        """
+        This method will send a file to a client in chunks through the
+        sliding window, starting from the chunk the client asks for
+
+        Output:
+            200 - if the client has all of the file
+            100 - otherwise
+        """
+        transferId = offer['id']
+        start = self.fileRequest(transferId,[1,'offer:'+transferId,offer],
+                                 IP,PORT)
+        for attempt in range(attempts):
+            if start is None:
+                return 100
+            for MSGS in self.files.batches(offer,path,start):
+                if self.udp.windowSend(MSGS,PORT,IP) != 200:
+                    return 100
+            #The client tells us the chunk it needs, all of them if it's done
+            start = self.fileRequest(transferId,[1,'done:'+transferId,None],
+                                     IP,PORT)
+            if start == offer['chunks']:
+                return 200
+        return 100
+    def fileRequest(self,transferId,MSG,IP,PORT):
+        """
+        This method will send a client a request about a file and wait for
+        its 'accept:' answer
+
+        Output:
+            The answer - if the client answered
+            None - otherwise
+        """
+        reply = queue.Queue(1)
+        self.fileReplies[transferId] = reply
+        try:
+            if self.udp.secureSend(MSG,PORT,IP) != 200:
+                return None
+            return reply.get(timeout=self.fileTimeout)
+        except queue.Empty:
+            return None
+        finally:
+            self.fileReplies.pop(transferId,None)
+    def fileReply(self,transferId,value):
+        if self.files is None:
             return None
+        reply = self.fileReplies.get(transferId)
+        if reply is not None:
+            try:
+                reply.put_nowait(value)
+            except queue.Full:
+                pass
+    def makeBatches(self,stored,batchSize=1300):
+        """
+        This method will pack stored messages into batches that fit in one
+        datagram. A message that is bigger than that gets a batch of its own.
 
+        Parameters:
+            stored: A list of (id,Message) tuples from the store
+            batchSize: About how many bytes of messages go in a batch
+        Output:
+            A list of (id of the last message,[Messages]) tuples
+        """
+        batches = []
+        messages = []
+        size = 0
+        for msgId,message in stored:
+            #Each message costs a few bytes on top of its text
+            cost = len(str(message).encode('utf-8')) + 5
+            if messages and size + cost > batchSize:
+                batches.append((lastId,messages))
+                messages = []
+                size = 0
+            messages.append(message)
+            size += cost
+            lastId = msgId
+        if messages:
+            batches.append((lastId,messages))
+        return batches
     def registerUser(self,Nick,IP,PORT):
         """
         This method is used to register a user by adding them to the 
@@ -170,32 +919,58 @@ class Server:
             IP: The IP of the Client
             PORT: The Port of the Client
         """
-        #we first want to check if the nickname already exists
-        if Nick in self.clientTable:
-            if not self.clientTable[Nick]['Online']:
-                #this means the client is logging back in
-                #if this is the case we want to just update the online status
-                self.clientTable[Nick]['Online']=True
-                #Now we want to send the updated table to the Client
-                self.updateAllClients()
-                self.sendStored(Nick)
-                return None
+        #we first want to check if the nickname already exists. It is
+         # checked and changed under the tableLock, so two clients
+         # registering the same nickname on different workers can't both
+         # get it, and nobody copies the table while it changes
+        with self.tableLock:
+            entry = self.clientTable.get(Nick)
+            if entry is None:
+                #First we will make an empty dictionary to hold the New
+                 # Client's Data
+                client = dict()
+                client['IP'] = IP
+                client['PORT'] = PORT
+                client['Online'] = True
+                #Now we need to add the data to the full Client Table
+                self.clientTable[Nick] = client
+                status = 'new'
+            elif not entry['Online']:
+                #this means the client is logging back in, maybe from a
+                 # different address, so we update where it is too
+                old = (entry['IP'],entry['PORT'])
+                entry['IP'] = IP
+                entry['PORT'] = PORT
+                entry['Online'] = True
+                status = 'back'
+            else:
+                status = 'taken'
+        if status == 'back':
+            if old != (IP,PORT):
+                #Nothing from the old address is this client anymore
+                if self.addresses.get(old) == Nick:
+                    self.addresses.pop(old,None)
+                self.udp.forget(old)
+            self.sessionStarted(Nick,IP,PORT)
+            self.tableChanged(Nick)
+            #Now we want to send the updated table to the Client
+            self.sendTable(IP,PORT)
+            self.sendStored(Nick)
+            self.forwardFiles(Nick)
+            return None
+        if status == 'taken':
             #If the nickname already exists, we dont want to allow it
             print("The Nickname already exist, please exit the program")
             #We want to send this to the client
             MSG = [1,1,"ERROR"]
             self.udp.secureSend(MSG,PORT,IP)
             return None
-        #First we will make an empty dictionary to hold the New Client's Data
-        client = dict()
-        client['IP'] = IP
-        client['PORT'] = PORT
-        client['Online'] = True
-        #Now we need to add the data to the full Client Table
-        self.clientTable[Nick] = client
         print("Registered {} at {}:{}".format(Nick,IP,PORT))
-        #Now that we have updated the table, we can tell all existing clients
-        self.updateAllClients()
+        self.sessionStarted(Nick,IP,PORT)
+        #Now that we have updated the table, we can send it to the new client
+         # and the other clients will get the change with the next update
+        self.tableChanged(Nick)
+        self.sendTable(IP,PORT)
         return None
     def updateAllClients(self):
         """
@@ -206,16 +981,12 @@ class Server:
         #We will create a base message as described in the secureSend method
         #A packer is of the form
         #[Current Seq,Total Packets,Message]
-        MSG = [1,'update:',self.clientTable]
-        for client,clientData in self.clientTable.items():
-            #Now we can send the packet with the secure send method
-            PORT = clientData['PORT']
-            IP = clientData['IP']
-            if clientData['Online'] == True:
-                #we only want to send the updated table to the clients online
-                response = self.udp.secureSend(MSG,PORT,IP)
-                
-                
+        MSG = self.tableMessage()
+        #we only want to send the updated table to the clients online
+        with self.tableLock:
+            clients = self.onlineClients()
+        #Now we can send the packet to all of them at the same time
+        self.udp.broadcastSend(MSG,clients)
         #we updated all the clients so we can print it to the console
         print("Updated All Clients")
         return None
@@ -225,13 +996,204 @@ class Server:
         table to Offline
 
         """
-        self.clientTable[nick]['Online'] = False
-        #then we need to send the Client an ACK
-        PORT = self.clientTable[nick]['PORT']
-        IP = self.clientTable[nick]['IP']
+        with self.tableLock:
+            entry = self.clientTable[nick]
+            entry['Online'] = False
+            #then we need to send the Client an ACK
+            PORT = entry['PORT']
+            IP = entry['IP']
+        #Heartbeats that were already on the way shouldn't bring it back
+        self.wheel.cancel(nick)
+        self.addresses.pop((IP,PORT),None)
+        self.udp.forget((IP,PORT))
+        self.tableChanged(nick)
         self.udp.secureSend([1,1,'ACK'],PORT,IP)
-        #now we need to update all the clients
-        self.updateAllClients()
+        return None
+    def sessionStarted(self,nick,IP,PORT):
+        """
+        This method will start the timer of a client that just registered
+        """
+        self.addresses[(IP,PORT)] = nick
+        self.wheel.schedule(nick,self.keepalive * self.misses)
+    def clientBeat(self,address):
+        """
+        This method is called by the socket's dispatcher for every heartbeat.
+        It only restarts the client's timer, unless the client was marked
+        Offline, then the worker for the client brings it back.
+        """
+        nick = self.addresses.get(address)
+        if nick is None:
+            return None
+        self.wheel.schedule(nick,self.keepalive * self.misses)
+        entry = self.clientTable.get(nick)
+        if entry is not None and not entry['Online']:
+            #It goes to the worker of the client's requests, so it happens
+             # in order with its reg: and dereg:
+            self.pool.submit(address,self.presenceChanged,nick,True,
+                             block=False)
+        return None
+    def watchSessions(self):
+        """
+        This method runs in its own thread and moves the timer wheel along,
+        handing every client whose timer ran out to its worker and closing
+        the file transfers nobody is sending anymore
+        """
+        while True:
+            time.sleep(self.wheel.tick)
+            for nick in self.wheel.advance():
+                self.sessionExpired(nick)
+            if self.files is not None:
+                #Transfers that were given up on don't keep their files open
+                self.files.expire()
+    def sessionExpired(self,nick):
+        """
+        This method will hand a client whose timer ran out to the worker of
+        its requests. We never wait for room, that would hold up the timers
+        of every other client, so if the worker has none the timer runs out
+        again on the next tick instead.
+        """
+        with self.tableLock:
+            entry = self.clientTable.get(nick)
+            if entry is None:
+                return None
+            address = (entry['IP'],entry['PORT'])
+        if not self.pool.submit(address,self.presenceChanged,nick,False,
+                                block=False):
+            self.wheel.schedule(nick,self.wheel.tick)
+        return None
+    def presenceChanged(self,nick,online):
+        """
+        This method will update a client's Online status when its heartbeats
+        stop or start again, and the change goes out with the next update
+
+        Parameters:
+            nick: The Nickname of the client
+            online: Whether the client is sending heartbeats
+        """
+        with self.tableLock:
+            entry = self.clientTable.get(nick)
+            if entry is None or entry['Online'] == online:
+                return None
+            entry['Online'] = online
+            IP,PORT = entry['IP'],entry['PORT']
+        self.tableChanged(nick)
+        if online:
+            print("{} is back".format(nick))
+            #It missed the updates while it was Offline
+            self.sendTable(IP,PORT)
+            self.sendStored(nick)
+            self.forwardFiles(nick)
+        else:
+            print("{} stopped responding".format(nick))
+            #If it was restarted it will start a new stream
+            self.udp.forget((IP,PORT))
+        return None
+    def onlineClients(self):
+        """
+        This method will return the (IP,PORT) tuples of the clients we send
+        table updates to, which is every client that is online. The tableLock
+        must be held when it is called.
+        """
+        return [(entry['IP'],entry['PORT'])
+                for entry in self.clientTable.values() if entry['Online']]
+    def tableMessage(self):
+        """
+        This method will make an update message holding a copy of the full
+        table and its version
+        """
+        with self.tableLock:
+            table = {nick:dict(entry) for nick,entry in self.clientTable.items()}
+            return [1,'update:{}'.format(self.tableVersion),table]
+    def sendTable(self,IP,PORT,version=None):
+        """
+        This method will send a client the table. If the client tells us the
+        version it has and we still have the changes since then, we only send
+        those changes.
+
+        Parameters:
+            IP: The IP of the Client
+            PORT: The Port of the Client
+            version: The tableVersion the client has, if it has one
+        """
+        delta = None
+        if version is not None:
+            with self.tableLock:
+                delta = self.deltaSince(version)
+        if delta is not None:
+            MSG = [1,'delta:',delta]
+        else:
+            MSG = self.tableMessage()
+            if self.udp.compresses((IP,PORT)):
+                #Let the client know it can compress what it sends us too
+                MSG[1] += ':' + self.udp.compression
+        self.udp.secureSend(MSG,PORT,IP)
+        return None
+    def tableChanged(self,nick):
+        """
+        This method will record that a client's entry in the table changed.
+        Changes that happen within coalesceDelay of each other are sent to
+        the clients together in one update.
+
+        Parameters:
+            nick: The Nickname of the client that changed
+        """
+        with self.tableLock:
+            self.recordChange(nick)
+            if self.flushTimer is None:
+                self.flushTimer = Timer(self.coalesceDelay,self.flushChanges)
+                self.flushTimer.daemon = True
+                self.flushTimer.start()
+        return None
+    def recordChange(self,nick):
+        """
+        This method will bump the tableVersion and add the change to the log,
+        the tableLock must be held when it is called
+        """
+        self.tableVersion += 1
+        self.changeLog.append((self.tableVersion,nick))
+        if self.snapshots is not None:
+            self.snapshots.changed(nick)
+    def deltaSince(self,version):
+        """
+        This method will make a delta of all the changes to the table after
+        the given version, the tableLock must be held when it is called
+
+        Output:
+            The delta - if the changeLog goes back far enough
+            None - if it doesn't, so the full table has to be sent
+        """
+        if version > self.tableVersion:
+            return None
+        if self.changeLog and version < self.changeLog[0][0] - 1:
+            return None
+        if not self.changeLog and version != self.tableVersion:
+            return None
+        changes = dict()
+        for changed,nick in self.changeLog:
+            if changed > version:
+                #Later changes to the same client replace earlier ones
+                changes[nick] = dict(self.clientTable[nick])
+        return {'from':version,'to':self.tableVersion,'changes':changes}
+    def flushChanges(self):
+        """
+        This method will send the changes since the last update to all of
+        the clients that are online
+        """
+        with self.tableLock:
+            self.flushTimer = None
+            delta = self.deltaSince(self.flushedVersion)
+            self.flushedVersion = self.tableVersion
+            clients = self.onlineClients()
+        if delta is None:
+            #We lost track of the changes so everyone gets the full table
+            self.updateAllClients()
+            return None
+        if not delta['changes']:
+            return None
+        MSG = [1,'delta:',delta]
+        self.udp.broadcastSend(MSG,clients)
+        print("Updated All Clients")
+        return None
         
         
 
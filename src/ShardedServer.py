@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds a version of the Server that runs as several processes
+# sharing the same Port, so the Server can use more than one core
+
+import os
+import queue
+import bisect
+import threading
+import multiprocessing
+from collections import deque
+from hashlib import md5 as md5
+from UDPSocket import UDPSocket
+from WorkerPool import WorkerPool
+from Server import Server
+
+class HashRing:
+    """
+    This class will map nicknames to shards with a consistent hash. Every
+    shard is put on the ring many times (replicas) so the nicknames are
+    spread out evenly, and adding or removing a shard only moves the
+    nicknames next to its points.
+
+    Methods:
+        lookup:
+            The shard that owns a nickname
+    """
+    def __init__(self,shards,replicas=64):
+        self.points = []
+        for shard in range(shards):
+            for replica in range(replicas):
+                key = '{}-{}'.format(shard,replica)
+                self.points.append((self.hash(key),shard))
+        self.points.sort()
+        self.hashes = [point for point,shard in self.points]
+
+    @staticmethod
+    def hash(key):
+        return int(md5(key.encode('utf-8')).hexdigest()[:8],16)
+
+    def lookup(self,nick):
+        index = bisect.bisect(self.hashes,self.hash(nick))
+        return self.points[index % len(self.points)][1]
+
+class ShardedServer(Server):
+    """
+    This class is one shard of a Server that runs as several processes. All
+    of the shards bind the same Port with SO_REUSEPORT, so clients still
+    talk to a single address, and the kernel picks the shard for each
+    datagram by the client's address. That means a client always talks to
+    the same shard, which we call its home. Only the home can send to the
+    client, since the client's ACKs will only ever reach the home.
+
+    Every nickname is owned by one shard, picked with a consistent hash of
+    the nickname. The owner decides whether a nickname can register, keeps
+    the client's real entry and stores its offline messages. Everything
+    else is forwarded to the shard that has to do it over a queue for each
+    shard, as a tuple of (operation,key,arguments). The owner sends changes
+    to an entry to every shard, so each shard has a copy of the whole table
+    and sends the table updates to the clients at home with it.
+
+    Methods:
+        serve:
+            Starts a shard in a process for each core and waits for them
+        startShard:
+            Makes the store of a shard and starts it, in its own process
+        forward:
+            Asks a shard (possibly this one) to do an operation
+        registerUser,deRegister,storeMessage,presenceChanged:
+            Forward the request to the shard that owns the nickname
+        ipcRegister,ipcDeregister,ipcMessage,ipcOffline,ipcAck,ipcPresence,
+        ipcMore:
+            Run on the owner of a nickname
+        storedPage:
+            Reads the next page of a client's stored messages as batches
+        ipcEntry:
+            Runs on every shard when an entry changes
+        ipcRegistered,ipcBatches,ipcDeregistered,ipcDeliver,ipcSend:
+            Run on the home of a client, to send it something
+        joinChannel,leaveChannel,postMessage:
+            Forward the request to the shard that owns the channel
+        ipcJoin,ipcLeave,ipcPost:
+            Run on the owner of a channel
+        ipcFanout:
+            Runs on the home of some members of a channel, to send them a
+            post
+        ipcStore:
+            Runs on the owner of some nicknames, to store a post for them
+
+    Presence:
+        Heartbeats reach the home of a client, so the home keeps its timer
+        and tells the owner when the client stops or starts sending them.
+
+    Channels:
+        Every channel is owned by a shard too, picked with the same hash of
+        its name, which keeps its members. The owner of a channel splits each
+        post up by the home of the members that are online, so every home
+        gets one request to send it to all of its members at once, and by the
+        owner of the members that are offline, so every owner gets one
+        request to store it for all of them.
+    Attributes:
+        index: The number of this shard
+        ring: The HashRing that picks the owner of each nickname
+        inboxes: The queue of each shard
+        local: The operations we forward to ourselves. They are run by the
+               workers too, but a worker can't wait for room in its own
+               queue, so they wait in here instead
+        owned: The entries of the nicknames we own, they also remember the
+               home of the client
+        homes: The home of every client in the table
+    """
+    def __init__(self,PORT,index,inboxes,codec='binary',workers=8,
+                 queueSize=256,store=None,keepalive=5.0,misses=3,
+                 limits=None):
+        self.index = index
+        self.inboxes = inboxes
+        self.local = queue.SimpleQueue()
+        self.ring = HashRing(len(inboxes))
+        self.owned = dict()
+        self.homes = dict()
+        self.udp = UDPSocket(PORT,codec=codec,reusePort=True)
+        self.pool = WorkerPool(workers,queueSize)
+        self.initState(store,keepalive=keepalive,misses=misses,
+                       limits=limits)
+        #Every shard keeps its own metrics, a stats: query is answered by
+         # the home of the client that asks
+        self.initMetrics(self.udp.metrics)
+        self.metrics.gauge('server_worker_queue_depth',
+                           'Messages waiting for a worker',self.pool.depth)
+        self.udp.onBeat = self.clientBeat
+        self.udp.admit = self.admit
+        self.watcher = threading.Thread(target=self.watchSessions,daemon=True)
+        self.watcher.start()
+        self.reader = threading.Thread(target=self.readInbox,
+                                       args=(inboxes[index],),daemon=True)
+        self.reader.start()
+        self.localReader = threading.Thread(target=self.readInbox,
+                                            args=(self.local,),daemon=True)
+        self.localReader.start()
+        print("Shard {} all set up! Waiting for Connections".format(index))
+        self.MainThread()
+
+    @classmethod
+    def serve(cls,PORT,shards=None,codec='binary',makeStore=None,
+              limits=None):
+        """
+        This method will start the shards, each in its own process, and wait
+        for them
+
+        Parameters:
+            PORT: The Port all of the shards listen on
+            shards: How many shards to start, one for each core by default
+            codec: The codec the shards use
+            makeStore: A function that takes the number of a shard and
+                       returns its message store (a MemoryStore by default)
+            limits: The rate limits of every shard, like in Server
+        """
+        if shards is None:
+            shards = os.cpu_count() or 1
+        #SO_REUSEPORT only exists where fork does, and fork lets makeStore
+         # be any function
+        context = multiprocessing.get_context('fork')
+        inboxes = [context.Queue() for i in range(shards)]
+        processes = []
+        for index in range(shards):
+            process = context.Process(target=cls.startShard,daemon=True,
+                                      args=(PORT,index,inboxes,codec,
+                                            makeStore,limits))
+            process.start()
+            processes.append(process)
+        for process in processes:
+            process.join()
+        return None
+
+    @classmethod
+    def startShard(cls,PORT,index,inboxes,codec,makeStore,limits=None):
+        """
+        This method runs in the new process of a shard. The store is made
+        here since threads (like the flusher of a LogStore) don't survive
+        the fork.
+        """
+        store = makeStore(index) if makeStore is not None else None
+        cls(PORT,index,inboxes,codec,store=store,limits=limits)
+
+    def forward(self,shard,key,operation,*args):
+        """
+        This method will ask a shard to run one of its ipc methods. Operations
+        with the same key are run in the order they were forwarded.
+
+        Parameters:
+            shard: The number of the shard
+            key: Usually the nickname the operation is about
+            operation: The name of the method without 'ipc'
+            args: The arguments of the method
+        """
+        if shard == self.index:
+            #We are usually on a worker, which would wait forever if the
+             # queue it has to put this in is full (like its own)
+            self.local.put((operation,key,args))
+        else:
+            self.inboxes[shard].put((operation,key,args))
+        return None
+
+    def readInbox(self,inbox):
+        """
+        This method runs in its own thread and hands the operations other
+        shards (or we) forward to us to the worker pool. Like MainThread it
+        never waits for a worker that is behind, since that would hold up the
+        operations for every other worker too. An operation can't be dropped
+        though, so one whose worker has no room is held (along with the ones
+        after it with the same key, to keep them in order) and tried again
+        shortly.
+        """
+        held = deque()
+        while True:
+            try:
+                held.append(inbox.get(timeout=0.01 if held else None))
+            except queue.Empty:
+                pass
+            blocked = set()
+            waiting = deque()
+            for operation,key,args in held:
+                if key in blocked or not self.pool.submit(
+                        key,getattr(self,'ipc'+operation),*args,block=False):
+                    blocked.add(key)
+                    waiting.append((operation,key,args))
+            held = waiting
+
+    def owner(self,nick):
+        return self.ring.lookup(nick)
+
+    def publish(self,nick):
+        """
+        This method will send the entry of a nickname we own to every shard
+        """
+        entry = self.owned[nick]
+        table = {'IP':entry['IP'],'PORT':entry['PORT'],
+                 'Online':entry['Online']}
+        for shard in range(len(self.inboxes)):
+            self.forward(shard,nick,'Entry',nick,table,entry['Home'])
+        return None
+
+    def onlineClients(self):
+        """
+        This method will return the (IP,PORT) tuples of the clients that are
+        online and at home on this shard, since they are the only ones we
+        can send table updates to. The tableLock must be held.
+        """
+        return [(entry['IP'],entry['PORT'])
+                for nick,entry in self.clientTable.items()
+                if entry['Online'] and self.homes.get(nick) == self.index]
+
+    def registerUser(self,Nick,IP,PORT):
+        self.forward(self.owner(Nick),Nick,'Register',Nick,IP,PORT,
+                     self.index)
+        return None
+
+    def deRegister(self,nick):
+        self.forward(self.owner(nick),nick,'Deregister',nick)
+        return None
+
+    def storeMessage(self,nick,MSG,address):
+        self.forward(self.owner(nick),nick,'Message',nick,MSG,address,
+                     self.index)
+        return None
+
+    def presenceChanged(self,nick,online):
+        entry = self.clientTable.get(nick)
+        if not online and entry is not None:
+            #If it was restarted it will start a new stream
+            self.udp.forget((entry['IP'],entry['PORT']))
+        self.forward(self.owner(nick),nick,'Presence',nick,online,self.index)
+        return None
+
+    def joinChannel(self,channel,address):
+        nick = self.channelRequest(channel,address)
+        if nick is not None:
+            self.forward(self.owner(channel),channel,'Join',channel,nick)
+        return None
+
+    def leaveChannel(self,channel,address):
+        nick = self.channelRequest(channel,address)
+        if nick is not None:
+            self.forward(self.owner(channel),channel,'Leave',channel,nick)
+        return None
+
+    def postMessage(self,channel,MSG,address):
+        nick = self.channelRequest(channel,address)
+        if nick is not None:
+            self.forward(self.owner(channel),channel,'Post',channel,nick,MSG,
+                         address,self.index)
+        return None
+
+    def ipcRegister(self,Nick,IP,PORT,home):
+        """
+        This method will register a nickname we own, the same way
+        Server.registerUser does, and let the client's home send it the
+        table and its stored messages
+        """
+        entry = self.owned.get(Nick)
+        if entry is not None and entry['Online']:
+            print("The Nickname already exist, please exit the program")
+            self.forward(home,(IP,PORT),'Send',IP,PORT,[1,1,"ERROR"])
+            return None
+        batches,more = [],False
+        if entry is not None:
+            #The client is logging back in, maybe from a different address
+            batches,more = self.storedPage(Nick)
+        else:
+            print("Registered {} at {}:{}".format(Nick,IP,PORT))
+        self.owned[Nick] = {'IP':IP,'PORT':PORT,'Online':True,'Home':home}
+        #The home gets the new entry before it sends the table
+        self.publish(Nick)
+        self.forward(home,Nick,'Registered',Nick,IP,PORT,batches,self.index,
+                     more)
+        return None
+
+    def ipcDeregister(self,nick):
+        """
+        This method will set a nickname we own to Offline and let its home
+        send the client an ACK
+        """
+        entry = self.owned.get(nick)
+        if entry is None:
+            return None
+        entry['Online'] = False
+        self.publish(nick)
+        self.forward(entry['Home'],nick,'Deregistered',nick,entry['IP'],
+                     entry['PORT'])
+        return None
+
+    def ipcPresence(self,nick,online,home):
+        """
+        This method will update the Online status of a nickname we own when
+        its home notices its heartbeats stop or start again. Reports from a
+        shard that isn't the client's home anymore are ignored.
+        """
+        entry = self.owned.get(nick)
+        if entry is None or entry['Home'] != home or entry['Online'] == online:
+            return None
+        entry['Online'] = online
+        self.publish(nick)
+        if online:
+            #It missed the updates while it was Offline
+            batches,more = self.storedPage(nick)
+            self.forward(home,nick,'Registered',nick,entry['IP'],
+                         entry['PORT'],batches,self.index,more)
+        return None
+
+    def storedPage(self,nick):
+        """
+        This method will read the next pageSize messages stored for a nickname
+        we own and pack them into batches
+
+        Output:
+            The batches, and whether there might be more messages after them
+        """
+        page = self.store.pending(nick,limit=self.pageSize)
+        return self.makeBatches(page),len(page) == self.pageSize
+
+    def ipcMore(self,nick,home):
+        """
+        This method will send the home of a client the next page of its
+        stored messages, once it got every batch of the last one
+        """
+        entry = self.owned.get(nick)
+        if entry is None or entry['Home'] != home or not entry['Online']:
+            return None
+        batches,more = self.storedPage(nick)
+        if batches:
+            self.forward(home,nick,'Batches',nick,entry['IP'],entry['PORT'],
+                         batches,self.index,more)
+        return None
+
+    def ipcMessage(self,nick,MSG,address,home):
+        """
+        This method will handle a message for a nickname we own. If the
+        client is online its home tries to deliver it, otherwise we store it.
+
+        Parameters:
+            nick: The nickname the message is for
+            MSG: The message
+            address: The address of the client that sent it
+            home: The home of the client that sent it
+        """
+        entry = self.owned.get(nick)
+        if entry is None:
+            return None
+        if entry['Online']:
+            self.forward(entry['Home'],nick,'Deliver',nick,entry['IP'],
+                         entry['PORT'],MSG,address,home)
+            return None
+        self.ipcOffline(nick,MSG,address,home)
+        return None
+
+    def ipcOffline(self,nick,MSG,address,home):
+        """
+        This method will store a message for a nickname we own, marking the
+        client Offline if it was online (because it couldn't be reached)
+        """
+        entry = self.owned.get(nick)
+        if entry is None:
+            return None
+        if entry['Online']:
+            entry['Online'] = False
+            self.publish(nick)
+        if not self.queueMessage(nick,MSG):
+            Error = [1,"ERROR","{} has too many messages waiting".format(nick)]
+            self.forward(home,address,'Send',address[0],address[1],Error)
+        return None
+
+    def ipcAck(self,nick,uptoId):
+        """
+        This method will forget the stored messages a client has ACKed
+        """
+        self.store.ack(nick,uptoId)
+        return None
+
+    def ipcJoin(self,channel,nick):
+        self.addMember(channel,nick)
+        return None
+
+    def ipcLeave(self,channel,nick):
+        self.removeMember(channel,nick)
+        return None
+
+    def ipcPost(self,channel,nick,MSG,address,home):
+        """
+        This method will send a post to the other members of a channel we
+        own. Our copy of the table tells us which members are online and
+        where their homes are.
+
+        Parameters:
+            channel: The name of the channel
+            nick: The nickname of the client that posted it
+            MSG: The text of the post
+            address: The address of the client that posted it
+            home: The home of the client that posted it
+        """
+        members = self.channelMembers(channel,nick)
+        if members is None:
+            Error = [1,"ERROR","You aren't in {}".format(channel)]
+            self.forward(home,address,'Send',address[0],address[1],Error)
+            return None
+        text = '[{}] {}: {}'.format(channel,nick,MSG)
+        online,offline = self.splitMembers(members)
+        byHome = dict()
+        for client,member in online.items():
+            memberHome = self.homes.get(member)
+            byHome.setdefault(memberHome,[]).append((member,client))
+        for shard,clients in byHome.items():
+            if shard is not None:
+                self.forward(shard,channel,'Fanout',channel,text,clients,
+                             address,home)
+        self.storePost(channel,offline,text,address,home)
+        return None
+
+    def storePost(self,channel,nicks,text,address,home):
+        """
+        This method will ask the owner of each nickname to store a post, with
+        one request for each owner
+        """
+        byOwner = dict()
+        for nick in nicks:
+            byOwner.setdefault(self.owner(nick),[]).append(nick)
+        for shard,owned in byOwner.items():
+            self.forward(shard,channel,'Store',owned,text,address,home)
+        return None
+
+    def ipcFanout(self,channel,text,clients,address,home):
+        """
+        This method will send a post to members of a channel at home with us
+        all at once, the ones we can't reach get it stored by their owners
+
+        Parameters:
+            clients: A list of (nickname,(IP,PORT)) tuples
+        """
+        online = {client:member for member,client in clients}
+        responses = self.udp.broadcastSend([1,'post:'+channel,text],
+                                           list(online))
+        failed = [online[client] for client,response in responses.items()
+                  if response != 200]
+        self.storePost(channel,failed,text,address,home)
+        return None
+
+    def ipcStore(self,nicks,MSG,address,home):
+        """
+        This method will store a post for nicknames we own, marking the ones
+        that were online (but couldn't be reached) Offline
+        """
+        owned = [nick for nick in nicks if nick in self.owned]
+        for nick in owned:
+            if self.owned[nick]['Online']:
+                self.owned[nick]['Online'] = False
+                self.publish(nick)
+        full = self.store.appendMany(owned,MSG)
+        if full:
+            Error = [1,"ERROR","{} have too many messages waiting".format(
+                ', '.join(sorted(full)))]
+            self.forward(home,address,'Send',address[0],address[1],Error)
+        return None
+
+    def ipcEntry(self,nick,entry,home):
+        """
+        This method will update our copy of the table when the owner of a
+        nickname changes its entry. If the client was at home with us and
+        moved, its old address isn't it anymore.
+        """
+        with self.tableLock:
+            old = self.clientTable.get(nick)
+            wasHome = self.homes.get(nick) == self.index
+            self.clientTable[nick] = entry
+            self.homes[nick] = home
+        if wasHome and old is not None:
+            address = (old['IP'],old['PORT'])
+            if home != self.index or address != (entry['IP'],entry['PORT']):
+                if self.addresses.get(address) == nick:
+                    self.addresses.pop(address,None)
+                self.udp.forget(address)
+            if home != self.index:
+                #Its new home keeps its timer now
+                self.wheel.cancel(nick)
+        if home == self.index and entry['Online']:
+            #We keep the timer of the clients at home with us
+            self.sessionStarted(nick,entry['IP'],entry['PORT'])
+        self.tableChanged(nick)
+        return None
+
+    def ipcRegistered(self,nick,IP,PORT,batches,owner,more=False):
+        """
+        This method will send a client that just registered with us the table
+        and the first page of the messages that were stored for it
+        """
+        self.sendTable(IP,PORT)
+        self.ipcBatches(nick,IP,PORT,batches,owner,more)
+        return None
+
+    def ipcBatches(self,nick,IP,PORT,batches,owner,more=False):
+        """
+        This method will send a client at home with us a page of its stored
+        messages. The owner is told as each batch is ACKed so it can forget
+        those messages, and asked for the next page once all of them are.
+        """
+        if not batches:
+            return None
+        MSGS = [[1,"batch:",messages] for lastId,messages in batches]
+        response = self.udp.windowSend(MSGS,PORT,IP,onAck=lambda index:
+            self.forward(owner,nick,'Ack',nick,batches[index][0]))
+        if response == 200 and more:
+            #The ACKs were forwarded first, so the owner has forgotten them
+             # by the time it reads the next page
+            self.forward(owner,nick,'More',nick,self.index)
+        return None
+
+    def ipcDeregistered(self,nick,IP,PORT):
+        """
+        This method will stop the timer of a client at home with us that
+        deregistered and send it an ACK
+        """
+        self.wheel.cancel(nick)
+        self.addresses.pop((IP,PORT),None)
+        self.udp.forget((IP,PORT))
+        self.udp.secureSend([1,1,'ACK'],PORT,IP)
+        return None
+
+    def ipcDeliver(self,nick,IP,PORT,MSG,address,home):
+        """
+        This method will try to send a message to a client at home with us.
+        The sender is told if it got through, otherwise the owner stores it.
+        """
+        response = self.udp.secureSend([1,"MSG:",MSG],PORT,IP)
+        if response == 200:
+            Error = [1,"ERROR",'The client is online!']
+            self.forward(home,address,'Send',address[0],address[1],Error)
+        else:
+            self.forward(self.owner(nick),nick,'Offline',nick,MSG,address,
+                         home)
+        return None
+
+    def ipcSend(self,IP,PORT,MSG):
+        """
+        This method will send a message to a client at home with us
+        """
+        self.udp.secureSend(MSG,PORT,IP)
+        return None
+
+if __name__ == '__main__':
+    ShardedServer.serve(50000)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds the code that saves the Server's state to disk every so often
+# so that a Server that is restarted can pick up where it left off instead of
+# every client having to register again
+
+import os
+import struct
+import time
+import zlib
+from threading import Lock,Thread
+from WireCodec import BinaryCodec
+
+class Snapshotter:
+    """
+    This class will save snapshots of the Server's state to a directory,
+    a full one every so often and the changes since then in between, and
+    load them back when the Server starts.
+
+    State:
+        The state is a dictionary of the form
+            {'version':tableVersion,'nextId':next message id,
+             'nicks':{Nick:[IP,PORT,Online,[channels],
+                            [[id,Message,expires]]]}}
+        which capture makes for every client (a full snapshot) or for the
+        clients that changed (an increment). A client is a flat list
+        rather than a dictionary since there can be millions of them and
+        every value costs time to load. The state is packed with the
+        BinaryCodec, so loading it never runs code, and compressed with
+        zlib since the same values repeat for every client.
+
+    Files:
+        snapshot.full holds one record with the last full snapshot. It is
+        written to a temporary file and moved into place, so there is
+        always a whole one on disk. snapshot.inc holds a record for every
+        increment since then, which replaces the entries of the clients it
+        has. Every full snapshot starts a new generation, and increments of
+        an older generation (left behind if we stopped between writing the
+        full snapshot and clearing the increments) are ignored.
+
+    Saves:
+        Changes are only noted while the Server runs, the saver thread
+        captures the clients that changed every interval and does the
+        packing and writing on its own, so the Server only waits for the
+        copy. Once fullEvery increments have been written the next save is
+        a full one, so loading never has to read too many of them.
+
+    Methods:
+        changed:
+            Notes that a client's state changed
+        load:
+            Reads the last snapshot and its increments
+        start/close:
+            Starts the saver thread, or stops it after one last save
+        save:
+            Saves the clients that changed, or everything
+    Attributes:
+        directory: Where the snapshot files are kept
+        capture: A function that returns the state for a list of Nicknames,
+                 or for every client if it is given None
+        interval: How often the saver thread saves
+        fullEvery: How many increments are written between full snapshots
+        dirty: The Nicknames that changed since the last save
+        generation: The generation of the last full snapshot
+        increments: How many increments were written since then
+    """
+    FULL = 1
+    INCREMENT = 2
+    HEADER = struct.Struct('!BII')
+
+    def __init__(self,directory,capture,interval=1.0,fullEvery=60):
+        self.directory = directory
+        self.capture = capture
+        self.interval = interval
+        self.fullEvery = fullEvery
+        self.codec = BinaryCodec()
+        self.dirty = set()
+        self.generation = 0
+        self.increments = 0
+        self.running = False
+        self.saver = None
+        self.lock = Lock()
+        self.saveLock = Lock()
+        os.makedirs(directory,exist_ok=True)
+
+    def path(self,name):
+        return os.path.join(self.directory,name)
+
+    def changed(self,nick):
+        with self.lock:
+            self.dirty.add(nick)
+
+    def load(self):
+        """
+        This method will read the last full snapshot and apply the
+        increments written after it
+
+        Output:
+            The state - if there is a snapshot
+            None - otherwise
+        """
+        records = self.records('snapshot.full')
+        if not records or records[0][0] != self.FULL:
+            return None
+        state = records[0][1]
+        self.generation = state['generation']
+        for kind,increment in self.records('snapshot.inc'):
+            if (kind != self.INCREMENT or
+                    increment['generation'] != self.generation):
+                continue
+            state['version'] = increment['version']
+            state['nextId'] = increment['nextId']
+            state['nicks'].update(increment['nicks'])
+            self.increments += 1
+        return state
+
+    def records(self,name):
+        """
+        This method will read the records of a file as a list of (type,body)
+        tuples. A record that was only half written when we stopped is cut
+        off the end of the file, so the next one is written after the last
+        whole one.
+        """
+        try:
+            with open(self.path(name),'rb') as snapshot:
+                data = snapshot.read()
+        except FileNotFoundError:
+            return []
+        view = memoryview(data)
+        records = []
+        offset = 0
+        while offset + self.HEADER.size <= len(view):
+            kind,length,crc = self.HEADER.unpack_from(view,offset)
+            start = offset + self.HEADER.size
+            body = view[start:start+length]
+            if len(body) != length or zlib.crc32(body) != crc:
+                break
+            try:
+                state = memoryview(zlib.decompress(body))
+            except zlib.error:
+                break
+            records.append((kind,self.codec.unpackValue(state,0)[0]))
+            offset = start + length
+        if offset != len(view):
+            with open(self.path(name),'r+b') as snapshot:
+                snapshot.truncate(offset)
+        return records
+
+    def start(self):
+        self.running = True
+        self.saver = Thread(target=self.saveLoop,daemon=True)
+        self.saver.start()
+
+    def saveLoop(self):
+        while self.running:
+            time.sleep(self.interval)
+            try:
+                self.save()
+            except OSError as e:
+                print("Couldn't save a snapshot: {}".format(e))
+
+    def save(self,full=False):
+        """
+        This method will save the clients that changed since the last save,
+        or everything if it is time for a full snapshot
+
+        Parameters:
+            full: Whether to save a full snapshot now
+        """
+        with self.saveLock:
+            with self.lock:
+                nicks,self.dirty = self.dirty,set()
+            full = (full or self.generation == 0 or
+                    self.increments >= self.fullEvery)
+            if not nicks and not full:
+                return None
+            if full:
+                self.writeFull(self.capture(None))
+            else:
+                self.writeIncrement(self.capture(list(nicks)))
+        return None
+
+    def pack(self,kind,state):
+        packed = bytearray()
+        self.codec.packValue(state,packed)
+        #The fastest level already does most of the work on this
+        packed = zlib.compress(packed,1)
+        return self.HEADER.pack(kind,len(packed),zlib.crc32(packed)) + packed
+
+    def writeFull(self,state):
+        """
+        This method will write a full snapshot and start a new generation
+        """
+        state['generation'] = self.generation + 1
+        temporary = self.path('snapshot.full.tmp')
+        with open(temporary,'wb') as snapshot:
+            snapshot.write(self.pack(self.FULL,state))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary,self.path('snapshot.full'))
+        self.syncDirectory()
+        self.generation += 1
+        #The increments belong to the last generation now
+        open(self.path('snapshot.inc'),'wb').close()
+        self.increments = 0
+
+    def writeIncrement(self,state):
+        state['generation'] = self.generation
+        with open(self.path('snapshot.inc'),'ab') as increments:
+            increments.write(self.pack(self.INCREMENT,state))
+            increments.flush()
+            os.fsync(increments.fileno())
+        self.increments += 1
+
+    def syncDirectory(self):
+        #The rename is only safe once the directory has been synced too
+        try:
+            descriptor = os.open(self.directory,os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            os.fsync(descriptor)
+        except OSError:
+            pass
+        finally:
+            os.close(descriptor)
+
+    def close(self):
+        """
+        This method will stop the saver thread and save the last changes
+        """
+        self.running = False
+        if self.saver is not None:
+            self.saver.join()
+            self.saver = None
+        self.save()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds a hashed timer wheel, which the Server uses to notice when
+# a client stops sending heartbeats
+
+import time
+import math
+from threading import Lock
+
+class TimerWheel:
+    """
+    This class will keep a timer for each key in a hashed timer wheel. The
+    wheel is a ring of slots, each one tick long, and a timer goes in the
+    slot its deadline falls in. Setting, resetting and cancelling a timer
+    only touches one slot, and moving the wheel forward only looks at the
+    slots it passes, so the cost doesn't depend on how many timers there are.
+
+    Methods:
+        schedule:
+            Starts (or restarts) the timer for a key
+        cancel:
+            Stops the timer for a key
+        advance:
+            Moves the wheel up to the current time and returns the keys
+            whose timers ran out
+    Attributes:
+        tick: How many seconds each slot covers
+        slots: The ring of slots, each one is {key:deadline tick}
+        timers: The slot each key's timer is in
+        current: The last tick the wheel was moved to
+    """
+    def __init__(self,tick=0.25,slots=256):
+        self.tick = tick
+        self.slots = [dict() for i in range(slots)]
+        self.timers = dict()
+        self.current = int(time.monotonic() / tick)
+        self.lock = Lock()
+
+    def schedule(self,key,delay):
+        """
+        This method will make the timer for a key run out in delay seconds,
+        replacing the timer it already had
+        """
+        with self.lock:
+            self.remove(key)
+            deadline = self.current + max(1,math.ceil(delay / self.tick))
+            index = deadline % len(self.slots)
+            self.slots[index][key] = deadline
+            self.timers[key] = index
+
+    def cancel(self,key):
+        with self.lock:
+            self.remove(key)
+
+    def remove(self,key):
+        """
+        This method will take a key's timer out of its slot, the lock must be
+        held when it is called
+        """
+        index = self.timers.pop(key,None)
+        if index is not None:
+            del self.slots[index][key]
+
+    def advance(self,now=None):
+        """
+        This method will move the wheel up to now and return the keys whose
+        timers ran out. A slot can hold timers from later trips around the
+        wheel, so we check each deadline before expiring it.
+        """
+        if now is None:
+            now = time.monotonic()
+        target = int(now / self.tick)
+        expired = []
+        with self.lock:
+            #If we fell behind by more than a full turn every slot is due
+            steps = min(target - self.current,len(self.slots))
+            for step in range(1,steps+1):
+                slot = self.slots[(self.current + step) % len(self.slots)]
+                for key,deadline in list(slot.items()):
+                    if deadline <= target:
+                        del slot[key]
+                        del self.timers[key]
+                        expired.append(key)
+            self.current = max(self.current,target)
+        return expired
+
+    def __len__(self):
+        return len(self.timers)
@@ -5,17 +5,52 @@
 # Based on the inputs given when running the script
 
 #import stuff
+import os
 import sys #this will handle the command line Arguements
+import json
+import queue
+from UDPSocket import UDPSocket
 from Server import Server
+from AsyncServer import AsyncServer
+from ShardedServer import ShardedServer
+from FederatedServer import FederatedServer
 from Client import Client
 """
 The Arguements will be taken in the following form:
 
     Server:
-        -s <Port>
+        -s <Port> [async|sharded]
+        (async runs the asyncio version of the Server and sharded runs a
+         Server process for each core on the same Port)
+    Federated Server:
+        -f <Port> <node-IP:Port>...
+        (runs a Server that shares its clients with the other nodes, with
+         FEDERATION_SECRET set nodes started with the same one can join)
     Client:
         -c <nick-name> <server-IP> <server-Port> <client-Port>
+    Stats:
+        -m <server-Port>
+        (prints the metrics of a Server running on this machine as JSON)
 """
+def queryStats(PORT,IP='127.0.0.1',timeout=5.0):
+    """
+    This method will ask a Server on this machine for its metrics
+
+    Output:
+        The metrics as a dictionary - if the Server answered
+        None - otherwise
+    """
+    udp = UDPSocket(0)
+    try:
+        if udp.secureSend([1,'stats:',None],PORT,IP) != 200:
+            return None
+        try:
+            data,address = udp.inbound.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return data[2]
+    finally:
+        udp.close()
 def Main(arguments):
     """
     This method will use the system arguments in order to run the correct 
@@ -23,15 +58,35 @@ def Main(arguments):
     """
     if arguments[0] == '-s':
         #then we want to call the server
-        if len(arguments) > 2:
+        if len(arguments) > 3:
             #we have too many arguments
             print("Too many Arguments!")
         elif len(arguments) < 2:
             #Too few arguments
             print("Not enough Arguments")
+        elif len(arguments) == 3:
+            if arguments[2] == 'async':
+                print("Starting the asyncio Server")
+                server = AsyncServer(int(arguments[1]))
+            elif arguments[2] == 'sharded':
+                print("Starting the sharded Server")
+                ShardedServer.serve(int(arguments[1]))
+            else:
+                print("Wrong arguments")
         else:
             print("Starting the Server")
             server = Server(int(arguments[1]))
+    elif arguments[0] == '-f':
+        if len(arguments) < 2:
+            print("Not enough Arguments")
+        else:
+            nodes = []
+            for node in arguments[2:]:
+                IP,colon,PORT = node.rpartition(':')
+                nodes.append((IP,int(PORT)))
+            print("Starting the federated Server")
+            server = FederatedServer(int(arguments[1]),nodes,
+                secret=os.environ.get('FEDERATION_SECRET'))
     elif arguments[0] == '-c':
         #We want to start the Client Server
         if len(arguments) < 5:
@@ -47,6 +102,15 @@ def Main(arguments):
             serverPort = int(arguments[3])
             clientPort = int(arguments[4])
             client = Client(nick,'127.0.0.1',clientPort,serverPort,serverIP)
+    elif arguments[0] == '-m':
+        if len(arguments) != 2:
+            print("Wrong arguments")
+        else:
+            stats = queryStats(int(arguments[1]))
+            if stats is None:
+                print("The Server didn't answer")
+            else:
+                print(json.dumps(stats,indent=2))
     else:
         print("Wrong arguments")
     return None
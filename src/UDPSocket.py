@@ -6,9 +6,25 @@
 
 #Import Required Modules
 import socket
-import pickle #This will allow us to Serialize data 
-from hashlib import md5 as md5
+import select
 import time
+import queue
+import zlib
+from threading import Lock,Thread
+from concurrent.futures import Future,wait
+from WireCodec import makeCodec
+from Fragmenter import Fragmenter
+from RTTEstimator import RTTEstimator
+from DuplicateCache import DuplicateCache
+from Metrics import MetricsRegistry,TrafficMetrics,peerLabel
+
+#Lets the dispatcher read without blocking once the socket is ready, where
+# the platform has it (without it we read one datagram per wakeup)
+DONTWAIT = getattr(socket,'MSG_DONTWAIT',0)
+#The most bytes we read from the socket for one datagram, every packet
+# bigger than a fragment is split up well below it
+BUFFERSIZE = 20 * 1024
+
 class UDPSocket:
     """
     This Class will abstract the Socket communications from the Server and
@@ -19,33 +35,184 @@ class UDPSocket:
             Takes the Host IP and the PORT number and binds a socket to listen
             on that PORT
         send:
-            Sends Python objects to desired IP and Port using Pickle
+            Sends packets to desired IP and Port using the socket's codec
         secureSend:
             Sends data using a simple Stop and Wait Protocol
+        windowSend:
+            Sends a list of messages using a Go-Back-N sliding window so many
+            packets can be in flight at the same time
+        broadcastSend:
+            Sends one message to many peers at the same time
+        peerStats:
+            The round trip time estimates and timeouts for each peer
+        forget:
+            Forgets the stream we were recieving from a peer
+        allowCompression/compresses:
+            Records that a peer can read compressed packets, or checks it
         Receive:
             Waits for and receives a message,decodes it, and returns it
+        dispatchLoop:
+            The only place that reads from the socket. Sends ACKs to the
+            sends waiting on them and data packets to the inbound queue
+        dispatch:
+            Hands one datagram to the dispatchLoop's handlers, a datagram it
+            raises on is dropped and counted instead of stopping the loop
+        sendAck/flushAcks:
+            Queues a cumulative ACK for a peer, and sends the ones that
+            are due
         secureRecieve:
             Recieves data using a simple Stop and Wait protocol and works in
             conjunction with the secureSend method
+        close:
+            Stops the dispatchLoop and closes the socket
 
     Attributes:
         HOST: Holds the Host IP
         PORT: Holds the Port Number the Socket will send/receive from
         socket: Will facilitate the communication
+        codec: Turns packets into bytes and back, 'binary' by default or
+               'pickle' to talk to peers using the old format
+        fragmenter: Splits packets that are too big for one datagram into
+                    fragments and puts them back together
+        compression: The name of the compression our codec offers (like
+                     'zlib'), or None if it can't or we turned it off
+        compressPeers: The peers that told us they can read compressed
+                       packets, packets to anyone else are never compressed
+        windowSize: The default number of unacknowledged packets windowSend
+                    will allow in flight
+        retries: How many timeouts in a row a send will put up with before
+                 giving up
+        rtt: Estimates the round trip time to each peer and decides how long
+             a send waits for an ACK before resending. Every timeout doubles
+             the wait (up to maxRto) until an ACK comes back
+        metrics: The MetricsRegistry our metrics (and those of a Server
+                 using us) are kept in
+        traffic: Our metrics, datagrams and bytes in and out, ACK round
+                 trip times, retransmissions and failures for each peer
+        sendSeq: The next sequence number we will use for each peer
+        sentSeq: The newest packet of the current stream to each peer that
+                 we have sent, ACKs past it are from an older stream
+        sendLocks: The [lock,users,failures] of every peer we are sending
+                   to. A send holds its peer's lock from numbering its
+                   packets until it is done, so sends to the same peer go
+                   one at a time and their packets are never mixed up on
+                   the wire. failures counts the sends that gave up, so the
+                   sends that were waiting behind one give up with it
+        expectSeq: The next sequence number we expect from each peer
+        pending: The futures of the packets waiting to be ACKed, keyed by
+                 peer and then by sequence number
+        inbound: A bounded queue of the data packets that have been
+                 recieved. When it is full new packets are dropped without
+                 an ACK, so the sender has to slow down and resend them
+        duplicates: Remembers the packets we recently accepted from each
+                    peer so a resent packet is ACKed again without being
+                    put on the inbound queue twice
+        dispatcher: The thread running the dispatchLoop
+        onBeat: Called by the dispatcher with the (IP,PORT) tuple of the
+                peer whenever a heartbeat arrives, heartbeats aren't
+                numbered or ACKed. It runs on the dispatcher so it has to
+                be quick
+        admit: If it is set, the dispatcher calls it with the packet and
+               the (IP,PORT) tuple of the peer before it ACKs each new
+               packet. A packet it returns False for is dropped without an
+               ACK, so the sender keeps it and resends it later. It has to
+               be quick too
+        reusePort: Whether other sockets (like the other shards of a
+                   ShardedServer) can bind the same Port
+        batchSize: The most datagrams the dispatcher reads each time it
+                   wakes up
+        ackDelay: How long an ACK can wait for later packets from the same
+                  peer, 0 sends them as soon as the socket has been drained
+        ackDue: The ACK we owe each peer that hasn't been sent yet
+        ackSince: When the oldest ACK in ackDue was queued
+
+    Sequence Numbers:
+        Every packet sent to a peer gets the next sequence number for that
+        peer. A receiver only accepts packets in order and ACKs the last
+        packet it accepted, so ACKs are cumulative. A packet with sequence
+        number 0 starts a new stream, which lets a peer that restarted (or
+        gave up on a send) resynchronize with us. A packet 0 that we
+        already accepted (because our ACK was lost) is recognized by the
+        duplicates cache and isn't treated as a new stream. Only packet 0
+        can start a stream, any other packet from a peer we have no stream
+        from (because we restarted or forgot it) is dropped and answered
+        with ['NACK',seq]. The sender then numbers what it hasn't had ACKed
+        as a new stream and sends it again from packet 0.
+
+    Compression:
+        A client that can read compressed packets adds the name of the
+        compression to its reg: command (like 'reg:zlib'), and the Server
+        adds it to the update it answers with. Each of them then calls
+        allowCompression for the other, and from then on the bodies of
+        big packets sent between them are compressed by the codec. Peers
+        that never said so (like older clients) get what they always did.
+
+    Threads:
+        Only the dispatcher reads from the socket, so any number of threads
+        can send and recieve at the same time without taking each other's
+        ACKs or packets. Sends to the same peer wait for each other (see
+        sendLocks), sends to different peers don't.
+
+    Batches:
+        Each time the socket is ready the dispatcher reads every datagram
+        that has arrived (up to batchSize) before it goes back to waiting.
+        The ACKs for a batch are queued instead of sent, and since they are
+        cumulative only the last one for each peer is sent once the batch
+        is done, so a window of packets from a peer costs one ACK instead
+        of one each. With an ackDelay the ACKs also wait for the batches
+        that arrive in the next ackDelay seconds, at the cost of making the
+        sender wait that much longer.
     """
-    def __init__(self,PORT,HOST='127.0.0.1'):
+    def __init__(self,PORT,HOST='127.0.0.1',windowSize=8,codec='binary',
+                 inboundSize=1024,retries=5,minRto=0.05,maxRto=4.0,
+                 reusePort=False,metrics=None,compression=True,
+                 batchSize=64,ackDelay=0.0):
         #Here we will specify the HOST IP and PORT
         self.HOST = HOST
         self.PORT = PORT
-        #Create a UDP Socket
+        self.fragmenter = Fragmenter()
+        self.windowSize = windowSize
+        self.retries = retries
+        self.rtt = RTTEstimator(minRto=minRto,maxRto=maxRto)
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.traffic = TrafficMetrics(self.metrics)
+        self.codec = makeCodec(codec,self.traffic)
+        self.compression = self.codec.compression if compression else None
+        self.compressPeers = set()
+        #These will keep track of the sequence numbers of each peer, they are
+         # keyed by the (IP,PORT) tuple of the peer
+        self.sendSeq = dict()
+        self.sentSeq = dict()
+        self.expectSeq = dict()
+        self.seqLock = Lock()
+        self.sendLocks = dict()
+        self.pending = dict()
+        self.inbound = queue.Queue(maxsize=inboundSize)
+        self.metrics.gauge('udp_inbound_depth',
+                           'Packets waiting on the inbound queue',
+                           self.inbound.qsize)
+        self.duplicates = DuplicateCache()
+        self.onBeat = None
+        self.admit = None
+        self.batchSize = batchSize if DONTWAIT else 1
+        self.ackDelay = ackDelay
+        self.ackDue = dict()
+        self.ackSince = None
+        #Create a UDP Socket, the dispatcher waits on it with select so it
+         # can check if it should stop
         self.socket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
-        #We will set a time out for the socket
-        self.socket.settimeout(0.5)
+        if reusePort:
+            #Let other processes bind the same Port, the kernel will then
+             # spread the peers between us by their address
+            self.socket.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEPORT,1)
         
         #We will bind to the Port since both the Client and the Server need
         # be able to receive messages. We wouldn't need to if the Client or
         # Server only sent messages
         self.socket.bind((self.HOST,self.PORT)) 
+        self.running = True
+        self.dispatcher = Thread(target=self.dispatchLoop,daemon=True)
+        self.dispatcher.start()
     def secureSend(self,MSG,PORT,IP='127.0.0.1'):
         """
         This method will securely send data using the simple Stop and Wait
@@ -54,88 +221,697 @@ class UDPSocket:
         Parameters:
             MSG: Is a list of length 3 with the following data in the
                 Respective Index
-                    Oth - Sequence Number of the Current Packet
+                    Oth - Sequence Number of the Current Packet (this is
+                          filled in with the peer's next sequence number)
                     1st - The Command
                     2nd - Message/Data to send
 
         What will be sent:
-            A checksum will be sent prior to sending the message
-            A serialized list with the following information in its indices
-                Oth - Sequence Number of the Current Packet
-                1st - The Command
-                2nd - Message/Data to send
-                3rd - Checksum Hash
+            The packet encoded by the socket's codec, which adds a checksum
+            of the packet so the reciever can check its integrity
         Output:
             200 - if the Message was sent successfully
             100 - if the Message was not sent Successfully
         """
-        #We need to first pickle the message
-        Data = pickle.dumps(MSG[2])
-        #Calculate the Hash
-        checksum = md5(Data).hexdigest()
-        MSG.append(checksum)
-        self.send(MSG,PORT,IP)
-        #We now need to start a timeout counter
-        for i in range(5):
-            try:
-                ACK,_ = self.recieve()
-                if ACK == 'ACK':
-                    #Everything went well so we want to return 200
-                    return 200
-            except socket.timeout as e:
+        #A Stop and Wait send is just a window that only has room for one
+         # packet
+        return self.windowSend([MSG],PORT,IP,windowSize=1)
+
+    def windowSend(self,MSGS,PORT,IP='127.0.0.1',windowSize=None,
+                   onAck=None):
+        """
+        This method will send a list of messages using the Go-Back-N
+        algorithm. Up to windowSize packets can be sent before we have to wait
+        for an ACK and the ACKs are cumulative, so one ACK can acknowledge
+        many packets at once. If we time out we go back and resend every
+        packet that hasn't been acknowledged yet.
+
+        Parameters:
+            MSGS: A list of messages of the same form secureSend takes. The
+                  sequence number in the 0th index is replaced by the real
+                  sequence number for the peer
+            PORT: Destination Port number
+            IP: The IP info of the Destination Host
+            windowSize: How many packets can be in flight at once, if it is
+                        not given the socket's windowSize is used
+            onAck: If it is given, it is called with the index of each
+                   message in MSGS once it is ACKed, in order
+        Output:
+            200 - if all of the Messages were sent successfully
+            100 - if the Messages were not sent Successfully
+        """
+        if windowSize is None:
+            windowSize = self.windowSize
+        #The ACKs will come from the resolved address of the peer
+        peer = (socket.gethostbyname(IP),PORT)
+        #Only one send to a peer at a time, so its packets go out in order
+        response = 100
+        try:
+            if self.lockPeers([peer]):
+                #The send we waited on gave up on the peer, and so would we
+                self.traffic.sendFailures.inc(1,peerLabel(peer))
+                return response
+            response = self.goBackN(MSGS,peer,windowSize,onAck)
+            return response
+        finally:
+            self.unlockPeer(peer,response != 200)
+
+    def goBackN(self,MSGS,peer,windowSize,onAck):
+        """
+        This method does the sending for windowSend, once it holds the
+        peer's send lock
+        """
+        firstSeq,packets,futures = self.preparePackets(MSGS,peer)
+        base = 0 #The oldest packet that hasn't been ACKed
+        nextPacket = 0 #The next packet we need to send
+        highest = 0 #Every packet before this one has been sent at least once
+        timeouts = 0
+        #When each packet was first sent, None once it has been resent since
+         # we can't tell which copy an ACK is for (Karn's rule)
+        sentAt = [None] * len(packets)
+        while base < len(packets):
+            #Fill up the window, the first packet of a new stream goes out on
+             # its own so that it is sure to arrive before the rest
+            window = 1 if firstSeq + base == 0 else windowSize
+            while nextPacket < len(packets) and nextPacket < base+window:
+                resend = nextPacket < highest
+                sentAt[nextPacket] = None if resend else time.monotonic()
+                if not resend:
+                    self.markSent(peer,firstSeq+nextPacket)
+                self.sendPacket(packets[nextPacket],peer,resend)
+                nextPacket += 1
+                highest = max(highest,nextPacket)
+            #The dispatcher will let us know when the oldest packet is ACKed
+            done,notDone = wait([futures[base]],timeout=self.rtt.rto(peer))
+            if done and futures[base].result() is None:
+                #The peer NACKed us, what is left goes out as a new stream
+                self.finishPackets(firstSeq,packets,peer)
+                restartSeq,restart,waiting = self.restartStream(MSGS[base:],
+                                                                peer)
+                firstSeq = restartSeq - base
+                packets[base:] = restart
+                futures[base:] = waiting
+                nextPacket = highest = base
+                continue
+            if notDone:
+                timeouts += 1
+                if timeouts >= self.retries:
+                    break
                 print("Timed Out, will try again...")
-                self.send(MSG,PORT,IP)
-        #We tried multiple times and it failed
+                self.rtt.backoff(peer)
+                #Go back and resend everything that wasn't ACKed
+                nextPacket = base
+                continue
+            if sentAt[base] is not None:
+                #The future holds the time the ACK arrived
+                sample = futures[base].result() - sentAt[base]
+                self.rtt.sample(peer,sample)
+                self.traffic.ackRtt.observe(sample)
+            #The ACK is cumulative, so it might have covered more packets
+            while (base < len(packets) and futures[base].done() and
+                   futures[base].result() is not None):
+                if onAck is not None:
+                    onAck(base)
+                base += 1
+            timeouts = 0
+        else:
+            #Everything went well so we want to return 200
+            self.finishPackets(firstSeq,packets,peer)
+            return 200
+        #We tried multiple times and it failed, the peer's idea of our
+         # sequence numbers is now unknown so we start a new stream
+        self.finishPackets(firstSeq,packets,peer)
+        with self.seqLock:
+            self.sendSeq[peer] = 0
+            self.sentSeq.pop(peer,None)
+        self.traffic.sendFailures.inc(1,peerLabel(peer))
         print("Message was not Sent Successfully")
         return 100
 
+    def broadcastSend(self,MSG,peers):
+        """
+        This method will send the same message to many peers at once. All of
+        the packets are sent right away and then we wait for all of the ACKs
+        together, resending to each peer that hasn't answered once its own
+        timeout runs out.
+
+        Parameters:
+            MSG: A message of the same form secureSend takes
+            peers: A list of (IP,PORT) tuples
+        Output:
+            A dictionary of the response (200 or 100) for each (IP,PORT)
+
+        We hold the send lock of every peer until its packet is ACKed (or
+        we give up on it), so the packet is the only one in flight to the
+        peer, which a packet 0 has to be.
+        """
+        resolved = {(IP,PORT):(socket.gethostbyname(IP),PORT)
+                    for IP,PORT in peers}
+        #Two addresses of the same peer only get one packet
+        unique = dict()
+        for address,peer in resolved.items():
+            unique.setdefault(peer,address)
+        failed = self.lockPeers(unique)
+        held = set(unique)
+        responses = dict()
+        try:
+            sends = dict()
+            for peer,address in unique.items():
+                if peer in failed:
+                    #The send we waited on gave up on the peer
+                    responses[address] = 100
+                    self.traffic.sendFailures.inc(1,peerLabel(peer))
+                    held.remove(peer)
+                    self.unlockPeer(peer)
+                    continue
+                firstSeq,packets,futures = self.preparePackets([MSG],peer)
+                sentAt = time.monotonic()
+                #[peer,firstSeq,packets,future,timeouts,sentAt,deadline]
+                sends[address] = [peer,firstSeq,packets,futures[0],0,sentAt,
+                                  sentAt + self.rtt.rto(peer)]
+                self.markSent(peer,firstSeq)
+                self.sendPacket(packets[0],peer,False)
+            while sends:
+                #We wait until everyone answers or the first timeout runs out
+                deadline = min(send[6] for send in sends.values())
+                wait([send[3] for send in sends.values()],
+                     timeout=max(0,deadline - time.monotonic()))
+                now = time.monotonic()
+                for address,send in list(sends.items()):
+                    (peer,firstSeq,packets,future,timeouts,sentAt,
+                     deadline) = send
+                    if future.done() and future.result() is None:
+                        #The peer NACKed us, so we send it again as a new
+                         # stream
+                        self.finishPackets(firstSeq,packets,peer)
+                        firstSeq,packets,futures = self.restartStream([MSG],
+                                                                      peer)
+                        send[1:4] = [firstSeq,packets,futures[0]]
+                        send[5] = now
+                        send[6] = now + self.rtt.rto(peer)
+                        self.markSent(peer,firstSeq)
+                        self.sendPacket(packets[0],peer,False)
+                        continue
+                    if future.done():
+                        if timeouts == 0:
+                            sample = future.result() - sentAt
+                            self.rtt.sample(peer,sample)
+                            self.traffic.ackRtt.observe(sample)
+                        responses[address] = 200
+                    elif now < deadline:
+                        continue
+                    elif timeouts + 1 >= self.retries:
+                        responses[address] = 100
+                        with self.seqLock:
+                            self.sendSeq[peer] = 0
+                            self.sentSeq.pop(peer,None)
+                        self.traffic.sendFailures.inc(1,peerLabel(peer))
+                    else:
+                        send[4] += 1
+                        self.rtt.backoff(peer)
+                        send[6] = now + self.rtt.rto(peer)
+                        self.sendPacket(packets[0],peer,True)
+                        continue
+                    self.finishPackets(firstSeq,packets,peer)
+                    held.remove(peer)
+                    self.unlockPeer(peer,responses[address] != 200)
+                    del sends[address]
+        finally:
+            #Whatever went wrong, the other sends to them can't be stuck
+            for peer in held:
+                self.unlockPeer(peer)
+        for address,peer in resolved.items():
+            responses[address] = responses[unique[peer]]
+        return responses
+
+    def lockPeers(self,peers):
+        """
+        This method will take the send lock of every peer, waiting for the
+        sends to them that are already going. They are taken in order so two
+        broadcasts can never each hold a lock the other is waiting for.
+
+        Output:
+            The peers that a send we waited on gave up on. Sending to them
+            again would only time out the same way, one send after
+            another, so the sends that were waiting give up too.
+        """
+        entries = []
+        with self.seqLock:
+            for peer in sorted(set(peers)):
+                entry = self.sendLocks.setdefault(peer,[Lock(),0,0])
+                #The lock is only dropped once nobody is using it
+                entry[1] += 1
+                entries.append((peer,entry,entry[2]))
+        failed = set()
+        for peer,entry,failures in entries:
+            entry[0].acquire()
+            if entry[2] != failures:
+                failed.add(peer)
+        return failed
+
+    def unlockPeer(self,peer,failed=False):
+        """
+        This method will let the next send to a peer go, failed is whether
+        we gave up on the peer
+        """
+        with self.seqLock:
+            entry = self.sendLocks[peer]
+            if failed:
+                entry[2] += 1
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.sendLocks[peer]
+
+    def peerStats(self):
+        """
+        This method will return the round trip time estimates and the current
+        timeout for each peer, keyed by the (IP,PORT) tuple of the peer
+        """
+        return self.rtt.stats()
+
+    def forget(self,peer):
+        """
+        This method will forget the stream we were recieving from a peer, so
+        whatever it sends next (even a packet 0 we already have) starts a new
+        stream. The Server calls it once a client's session is over, since
+        the client might come back from the same address.
+        """
+        with self.seqLock:
+            self.expectSeq.pop(peer,None)
+            self.duplicates.forget(peer)
+            self.compressPeers.discard(peer)
+
+    def allowCompression(self,peer):
+        """
+        This method will record that a peer can read compressed packets
+
+        Output:
+            True - if packets to the peer will be compressed
+            False - if we don't compress packets
+        """
+        if self.compression is None:
+            return False
+        self.compressPeers.add(peer)
+        return True
+
+    def compresses(self,peer):
+        return peer in self.compressPeers
+
+    def preparePackets(self,MSGS,peer):
+        """
+        This method will number the messages for a peer, encode them once so
+        that resending them is cheap (splitting those that are too big into
+        fragments) and make a future for each of them that the dispatcher
+        completes with the time the ACK arrived
+
+        Output:
+            A tuple of the first sequence number, the list of (msgId,fragments)
+            tuples and the list of futures
+        """
+        with self.seqLock:
+            firstSeq = self.sendSeq.get(peer,0)
+            self.sendSeq[peer] = firstSeq + len(MSGS)
+            waiting = self.pending.setdefault(peer,dict())
+            futures = []
+            for i in range(len(MSGS)):
+                future = Future()
+                waiting[firstSeq+i] = future
+                futures.append(future)
+        packets = []
+        compress = peer in self.compressPeers
+        for i,MSG in enumerate(MSGS):
+            packet = self.makePacket(firstSeq+i,MSG[1],MSG[2])
+            data = self.codec.encode(packet,compress)
+            packets.append(self.fragmenter.split(data,peer))
+        return firstSeq,packets,futures
+
+    def restartStream(self,MSGS,peer):
+        """
+        This method will number messages as a new stream to a peer that
+        NACKed us, the same way preparePackets does
+        """
+        with self.seqLock:
+            self.sendSeq.pop(peer,None)
+            self.sentSeq.pop(peer,None)
+        return self.preparePackets(MSGS,peer)
+
+    def markSent(self,peer,seq):
+        """
+        This method will record the newest packet of the current stream we
+        have sent to a peer. The peer can't ACK anything after it, so an ACK
+        that does is from a stream we gave up on.
+        """
+        with self.seqLock:
+            self.sentSeq[peer] = seq
+
+    def sendPacket(self,packet,peer,resend):
+        """
+        This method will send the fragments of a packet made by
+        preparePackets. When it is being resent, only the fragments the peer
+        is missing are sent.
+        """
+        msgId,fragments = packet
+        if resend:
+            self.traffic.retransmits.inc(1,peerLabel(peer))
+            if msgId is not None:
+                fragments = self.fragmenter.resendList(peer,msgId)
+        for fragment in fragments:
+            self.sendRaw(fragment,peer[1],peer[0])
+
+    def finishPackets(self,firstSeq,packets,peer):
+        """
+        This method will forget about packets that are done being sent
+        """
+        with self.seqLock:
+            waiting = self.pending.get(peer,dict())
+            for i in range(len(packets)):
+                waiting.pop(firstSeq+i,None)
+            if not waiting:
+                self.pending.pop(peer,None)
+        self.fragmenter.releasePackets(packets,peer)
+
+    def handleAck(self,seq,Address):
+        """
+        This method is called by the dispatcher when an ACK arrives. Since
+        ACKs are cumulative, every packet up to seq has been recieved.
+        """
+        with self.seqLock:
+            waiting = self.pending.get(Address)
+            if not waiting:
+                return None
+            if seq > self.sentSeq.get(Address,-1):
+                #A late ACK from a stream we gave up on, the packets of
+                 # this one with the same numbers haven't been ACKed
+                return None
+            acked = [s for s in waiting if s <= seq]
+            futures = [waiting.pop(s) for s in acked]
+        arrived = time.monotonic()
+        for future in futures:
+            if not future.done():
+                future.set_result(arrived)
+        return None
+
+    def handleNack(self,seq,Address):
+        """
+        This method is called by the dispatcher when a NACK arrives. The peer
+        doesn't know the stream the packet seq is in, so every packet still
+        waiting on an ACK from it is finished with None, which tells the
+        send to start a new stream. A NACK for a packet we aren't waiting on
+        is from before that and is disregarded.
+        """
+        with self.seqLock:
+            waiting = self.pending.get(Address)
+            if not waiting or seq not in waiting:
+                return None
+            futures = list(waiting.values())
+            waiting.clear()
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+        return None
+
+    def handleData(self,rdata,Address,digest):
+        """
+        This method is called by the dispatcher when a data packet arrives.
+        Packets that are in order are ACKed and put on the inbound queue,
+        the rest are disregarded and we ACK the last packet that was in order.
+
+        Parameters:
+            rdata: The decoded packet
+            Address: The (IP,PORT) tuple of the sender
+            digest: The CRC32 of the packet's bytes, used to recognize
+                    packets we already accepted
+        """
+        seq = rdata[0]
+        if self.inbound.full():
+            #Nobody is keeping up with the packets, so we act like we never
+             # got this one and the sender will resend it later
+            return None
+        duplicate = False
+        with self.seqLock:
+            expected = self.expectSeq.get(Address)
+            if seq == 0:
+                #Packet 1 is only sent once packet 0 is ACKed, so once we have
+                 # accepted more than packet 0 a packet 0 has to be a new stream
+                if (expected in (None,1) and
+                        self.duplicates.seen(Address,seq,digest)):
+                    #We already have this one, our ACK must have been lost
+                    duplicate = True
+                else:
+                    #This is a new stream from this peer
+                    expected = seq
+        if seq == expected and not duplicate:
+            if self.admit is not None and not self.admit(rdata,Address):
+                #Like when the queue is full, we act like we never got it
+                 # and the sender will resend it once it has waited
+                return None
+            with self.seqLock:
+                self.expectSeq[Address] = seq + 1
+                self.duplicates.add(Address,seq,digest)
+        if expected is None:
+            #Only packet 0 can start a stream, so the peer has to start over
+            self.traffic.nacks.inc()
+            self.send(['NACK',seq],Address[1],Address[0])
+        elif duplicate:
+            self.traffic.duplicates.inc()
+            self.sendAck(seq,Address)
+        elif seq == expected:
+            #Everything checks out!
+            #we need to send an ACK
+            #The Address Tuple is of the form (IP,PORT)
+            self.sendAck(seq,Address)
+            self.inbound.put((rdata,Address))
+        elif expected > 0:
+            #This packet is a duplicate or came out of order, so we let
+             # the sender know which packet we are up to
+            if seq < expected:
+                self.traffic.duplicates.inc()
+            self.sendAck(expected-1,Address)
+        return None
+
+    def dispatchLoop(self):
+        """
+        This method runs in its own thread and is the only thing that reads
+        from the socket. Every ACK goes to the sends waiting on it and every
+        data packet goes to the inbound queue for secureRecieve.
+        """
+        while self.running:
+            try:
+                ready = select.select([self.socket],[],[],self.ackWait())[0]
+            except (OSError,ValueError):
+                #The socket was closed
+                break
+            if ready:
+                self.traffic.wakeups.inc()
+            for i in range(self.batchSize if ready else 0):
+                try:
+                    data,Address = self.recieveRaw(DONTWAIT)
+                except (BlockingIOError,InterruptedError):
+                    #We have read everything that arrived
+                    break
+                except OSError:
+                    #The socket was closed
+                    self.running = False
+                    break
+                if data is None:
+                    continue
+                try:
+                    self.dispatch(data,Address)
+                except Exception:
+                    #A datagram we can't handle is dropped, the dispatcher
+                    # has to keep going for everyone else
+                    self.traffic.dropped.inc()
+            self.flushAcks()
+        return None
+
+    def dispatch(self,data,Address):
+        """
+        This method will hand a datagram to whatever is waiting on it
+        """
+        rdata = self.codec.decode(data)
+        if self.isAck(rdata):
+            self.handleAck(rdata[1],Address)
+        elif self.isNack(rdata):
+            self.handleNack(rdata[1],Address)
+        elif self.isBeat(rdata):
+            if self.onBeat is not None:
+                self.onBeat(Address)
+        elif self.checkPacket(rdata):
+            self.handleData(rdata,Address,zlib.crc32(data))
+
+    def ackWait(self):
+        """
+        This method will return how long the dispatcher can wait for
+        datagrams before it has ACKs to send
+        """
+        if not self.ackDue:
+            return 0.5
+        due = self.ackSince + self.ackDelay - time.monotonic()
+        return min(0.5,max(0,due))
+
+    @staticmethod
+    def makePacket(seq,command,data):
+        """
+        This method will create a packet of the form described in the
+        secureSend method
+
+        Parameters:
+            seq: The sequence number of the packet
+            command: The Command
+            data: Message/Data to send
+        """
+        return [seq,command,data]
+
+    @staticmethod
+    def isAck(packet):
+        """
+        This method will check if a packet is an ACK packet. ACKs are of the
+        form ['ACK',Sequence Number of the last packet recieved in order]
+        """
+        return (isinstance(packet,list) and len(packet) == 2 and
+                packet[0] == 'ACK')
+
+    @staticmethod
+    def isNack(packet):
+        """
+        This method will check if a packet is a NACK. NACKs are of the form
+        ['NACK',Sequence Number of the packet that was dropped]
+        """
+        return (isinstance(packet,list) and len(packet) == 2 and
+                packet[0] == 'NACK')
+
+    @staticmethod
+    def isBeat(packet):
+        """
+        This method will check if a packet is a heartbeat. Heartbeats are of
+        the form ['BEAT',count]
+        """
+        return (isinstance(packet,list) and len(packet) == 2 and
+                packet[0] == 'BEAT')
+
+    @staticmethod
+    def checkPacket(rdata):
+        """
+        This method will check that a recieved object is a data packet. The
+        codec has already checked the checksum and returns None for packets
+        that were corrupted.
+
+        Output:
+            True - if the packet is a data packet
+            False - otherwise
+        """
+        return (isinstance(rdata,list) and len(rdata) == 3 and
+                isinstance(rdata[0],int))
+
     def secureRecieve(self):
         """
         This method is meant to recieve data from a host securely in
         accordance with the secureSend() method. If the data is recieved
-        correctly, the method will send an ACK back. If the data is not 
-        recieved correctly, the method will simply disregard the message
+        correctly, the dispatcher sends an ACK back. If the data is not
+        recieved correctly or is out of order, the dispatcher will simply
+        disregard the message and ACK the last packet that was in order.
 
         Output:
-            100 -  if the data as not recieved correctly
             The data -  if the data was recieved correctly
         """
-        #We want to continuously check for packets until we recieve one
-        while True:
-            try:
-                #recieve the Data
-                rdata,Address = self.recieve()
-                if rdata != None:
-                    break
-            except socket.timeout as e:
-                continue
+        #The dispatcher has already checked and ACKed the packet, so we
+         # just wait for one to show up
+        return self.inbound.get()
+
+    def sendAck(self,seq,Address):
+        """
+        This method will queue a cumulative ACK for the packet with the
+        given sequence number, replacing any ACK for the peer that hasn't
+        been sent yet. It is only called by the dispatcher, which sends it
+        with flushAcks.
+
+        Parameters:
+            seq: The sequence number of the last packet recieved in order
+            Address: The (IP,PORT) tuple of the peer
+        """
+        if Address in self.ackDue:
+            self.traffic.acksCoalesced.inc()
+        elif not self.ackDue:
+            self.ackSince = time.monotonic()
+        self.ackDue[Address] = seq
 
-        #Now we can check the checksum
-        dataToCheck = pickle.dumps(rdata[2])
-        checksum = md5(dataToCheck).hexdigest()
-        if len(rdata) >= 4:
-            if checksum == rdata[3]:
-                #Everything checks out!
-                #we need to send an ACK
-                #The Address Tuple is of the form (IP,PORT)
-                self.send('ACK',Address[1],Address[0])
-                #now we can return the Message to be processed
-                return rdata[0:-1],Address
+    def flushAcks(self):
+        """
+        This method will send the queued ACKs, once they have waited
+        ackDelay seconds
+        """
+        if not self.ackDue:
+            return None
+        if time.monotonic() - self.ackSince < self.ackDelay:
+            return None
+        due,self.ackDue = self.ackDue,dict()
+        for Address,seq in due.items():
+            self.send(['ACK',seq],Address[1],Address[0])
+            self.traffic.acksSent.inc()
+        return None
 
     def send(self,MSG,PORT,IP='127.0.0.1'):
         """
-        This method will send a pickled object to the destination Port and IP
+        This method will encode a packet and send it to the destination Port
+        and IP
         Parameters: 
             IP: The IP info of the Destination Host
             PORT: Destination Port number
         """
-        MSG = pickle.dumps(MSG)
-        self.socket.sendto(MSG,(IP,PORT))
+        self.sendRaw(self.codec.encode(MSG),PORT,IP)
+
+    def sendRaw(self,data,PORT,IP='127.0.0.1'):
+        """
+        This method will send bytes that have already been encoded to the
+        destination Port and IP
+        """
+        self.socket.sendto(data,(IP,PORT))
+        self.traffic.datagramsOut.inc()
+        self.traffic.bytesOut.inc(len(data))
             
     def recieve(self):
         """
-        This method will receive pickled objects
+        This method will receive a datagram and decode it, the data is None if
+        the datagram was corrupt or was a fragment of a packet that isn't
+        complete yet
         """ 
-        data,senderAddress = self.socket.recvfrom(20 * 1024)
-        data = pickle.loads(data)
+        data,senderAddress = self.recieveRaw()
+        if data is not None:
+            data = self.codec.decode(data)
+        return data,senderAddress
+
+    def recieveRaw(self,flags=0):
+        """
+        This method will receive a datagram and put fragments back together,
+        returning the bytes of a whole packet without decoding them (None if
+        the datagram was a fragment of a packet that isn't complete yet)
+
+        Parameters:
+            flags: The flags for recvfrom, DONTWAIT raises BlockingIOError
+                   instead of waiting when nothing has arrived
+        """
+        data,senderAddress = self.socket.recvfrom(BUFFERSIZE,flags)
+        self.traffic.datagramsIn.inc()
+        self.traffic.bytesIn.inc(len(data))
+        if self.fragmenter.isFragment(data):
+            data,status = self.fragmenter.add(data,senderAddress)
+            if status is not None:
+                #Let the sender know which fragments we are missing
+                self.sendRaw(status,senderAddress[1],senderAddress[0])
+            if data is None:
+                return None,senderAddress
+        elif self.fragmenter.isStatus(data):
+            #The peer is missing some fragments so we resend them right away
+            for fragment in self.fragmenter.handleStatus(data,senderAddress):
+                self.sendRaw(fragment,senderAddress[1],senderAddress[0])
+            return None,senderAddress
         return data,senderAddress
+
+    def close(self):
+        """
+        This method will stop the dispatcher and close the socket
+        """
+        self.running = False
+        self.socket.close()
+        self.dispatcher.join()
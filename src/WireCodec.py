@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds the codecs that turn packets into the bytes that are put on
+# the wire and back again. The binary codec is the default, the pickle codec
+# is only kept so we can still talk to peers using the old format
+
+import struct
+import pickle
+import time
+import zlib
+from hashlib import md5 as md5
+
+class BinaryCodec:
+    """
+    This class will encode packets with a fixed binary header followed by a
+    body of tagged values (similar to msgpack). Unlike pickle, decoding a
+    datagram can never run code, and the checksum is computed once over the
+    raw bytes.
+
+    Header (network byte order):
+        version: 1 byte, the version of the format
+        command: 1 byte, the code of the command (see COMMANDS)
+        flags: 1 byte, bit flags about the packet
+        seq: 4 bytes, the sequence number of the packet
+        length: 4 bytes, the length of the body
+        crc: 4 bytes, CRC32 of the header fields above and the body
+
+    Body:
+        Two tagged values, the rest of the command after its name (for
+        example ':bob' in 'MSG:bob') and the Message/Data. Commands we don't
+        have a code for use code 0 and the whole command is the first value.
+
+    Compression:
+        encode can compress a body of at least compressAbove bytes with raw
+        deflate, primed with DICTIONARY, and sets the COMPRESSED flag when
+        it does. The CRC and length are of the compressed body. It is only
+        done for peers that told us they understand it (see UDPSocket), and
+        a body that doesn't get smaller is sent as it is. decode never
+        inflates a body past maxBody bytes.
+
+    Packets:
+        Data packets are lists of the form [seq,command,data], ACKs are
+        lists of the form ['ACK',seq], NACKs (see UDPSocket) are lists of
+        the form ['NACK',seq] and heartbeats are lists of the form
+        ['BEAT',count]. ACKs, NACKs and heartbeats have an empty body. decode returns
+        None for anything that is corrupt or that we don't understand,
+        including lists and dicts nested more than MAXDEPTH deep and dicts
+        with keys that aren't a str, int or bytes, so a datagram someone
+        made up can never raise out of it.
+    """
+    VERSION = 1
+    HEADER = struct.Struct('!BBBIII')
+    #The fields of the header that are covered by the CRC
+    CHECKED = struct.Struct('!BBBII')
+    COMMANDS = {'reg':1,'dereg':2,'MSG':3,'update':4,'ERROR':5,'ACK':6,
+                'delta':7,'table':8,'batch':9,'BEAT':10,
+                'stats':11,'join':12,'leave':13,'post':14,
+                'lookup':15,'found':16,'gossip':17,'members':18,
+                'relay':19,'relayed':20,'throttled':21,'offer':22,
+                'chunk':23,'done':24,'accept':25,'NACK':26}
+    NAMES = {code:name for name,code in COMMANDS.items()}
+    ACK = 6
+    BEAT = 10
+    NACK = 26
+    RAW = 0
+    COMPRESSED = 0x01
+    #How deep lists and dicts can be nested in a body we decode
+    MAXDEPTH = 32
+    #The types a key of a dict we decode can be
+    KEYS = (str,int,bytes)
+    #What a peer that can read our compressed bodies calls it
+    compression = 'zlib'
+
+    def __init__(self,traffic=None,compressAbove=128,level=6,
+                 maxBody=16*1024*1024):
+        """
+        Parameters:
+            traffic: The TrafficMetrics the bytes and CPU time spent on
+                     compression are counted in, if there are any
+            compressAbove: The smallest body that is worth compressing
+            level: The zlib compression level
+            maxBody: The biggest body we will inflate a compressed one to
+        """
+        self.traffic = traffic
+        self.compressAbove = compressAbove
+        self.level = level
+        self.maxBody = maxBody
+
+    def encode(self,packet,compress=False):
+        """
+        This method will turn a packet into bytes
+
+        Parameters:
+            packet: A data packet or an ACK
+            compress: Whether the peer can read a compressed body
+        """
+        if packet[0] == 'ACK':
+            return self.frame(self.ACK,0,packet[1],b'')
+        if packet[0] == 'BEAT':
+            return self.frame(self.BEAT,0,packet[1],b'')
+        if packet[0] == 'NACK':
+            return self.frame(self.NACK,0,packet[1],b'')
+        seq,command,data = packet[0],packet[1],packet[2]
+        code = self.RAW
+        extra = command
+        if isinstance(command,str):
+            name,colon,rest = command.partition(':')
+            if name in self.COMMANDS:
+                code = self.COMMANDS[name]
+                extra = colon + rest
+        body = bytearray()
+        self.packValue(extra,body)
+        self.packValue(data,body)
+        flags = 0
+        if compress and len(body) >= self.compressAbove:
+            packed = self.compress(body)
+            if packed is not None:
+                flags = self.COMPRESSED
+                body = packed
+        return self.frame(code,flags,seq,bytes(body))
+
+    def compress(self,body):
+        """
+        This method will deflate a body, counting the bytes before and after
+        and the CPU time it took
+
+        Output:
+            The compressed bytes - if they are smaller than the body
+            None - otherwise
+        """
+        start = time.thread_time()
+        compressor = zlib.compressobj(self.level,zlib.DEFLATED,-15,
+                                      zdict=DICTIONARY)
+        packed = compressor.compress(body) + compressor.flush()
+        if len(packed) >= len(body):
+            packed = None
+        if self.traffic is not None:
+            self.traffic.compressed(len(body),
+                len(body) if packed is None else len(packed),
+                time.thread_time() - start)
+        return packed
+
+    def decompress(self,body):
+        """
+        This method will inflate a compressed body
+
+        Output:
+            The bytes of the body - if it is intact and isn't too big
+            None - otherwise
+        """
+        start = time.thread_time()
+        decompressor = zlib.decompressobj(-15,zdict=DICTIONARY)
+        try:
+            raw = decompressor.decompress(body,self.maxBody)
+        except zlib.error:
+            return None
+        if self.traffic is not None:
+            self.traffic.decompressed(time.thread_time() - start)
+        if not decompressor.eof or decompressor.unconsumed_tail:
+            #It is cut short, or it would inflate to more than maxBody
+            return None
+        return memoryview(raw)
+
+    def frame(self,code,flags,seq,body):
+        """
+        This method will put the header in front of a body
+
+        Parameters:
+            code: The command code
+            flags: The flags of the packet
+            seq: The sequence number
+            body: The bytes of the body
+        """
+        seq = seq & 0xFFFFFFFF
+        checked = self.CHECKED.pack(self.VERSION,code,flags,seq,len(body))
+        crc = zlib.crc32(body,zlib.crc32(checked))
+        return self.HEADER.pack(self.VERSION,code,flags,seq,len(body),
+                                crc) + body
+
+    def decode(self,data):
+        """
+        This method will turn bytes from the wire back into a packet
+
+        Output:
+            The packet - if the datagram is intact
+            None - if the datagram is corrupt or in a format we don't know
+        """
+        view = memoryview(data)
+        if len(view) < self.HEADER.size:
+            return None
+        version,code,flags,seq,length,crc = self.HEADER.unpack_from(view)
+        body = view[self.HEADER.size:]
+        if version != self.VERSION or len(body) != length:
+            return None
+        checked = self.CHECKED.pack(version,code,flags,seq,length)
+        if zlib.crc32(body,zlib.crc32(checked)) != crc:
+            return None
+        if code == self.ACK:
+            return ['ACK',seq]
+        if code == self.BEAT:
+            return ['BEAT',seq]
+        if code == self.NACK:
+            return ['NACK',seq]
+        if flags & self.COMPRESSED:
+            body = self.decompress(body)
+            if body is None:
+                return None
+        try:
+            extra,offset = self.unpackValue(body,0)
+            data,offset = self.unpackValue(body,offset)
+        except Exception:
+            #Whatever is wrong with it, it is just a bad packet
+            return None
+        if code == self.RAW:
+            command = extra
+        elif code in self.NAMES:
+            command = self.NAMES[code] + extra
+        else:
+            return None
+        return [seq,command,data]
+
+    def packValue(self,value,out):
+        """
+        This method will append a tagged value to a bytearray. The tags are
+        N - None, T - True, F - False, i - int, d - float, s - str,
+        b - bytes, l - list (or tuple) and m - dict
+
+        Parameters:
+            value: The value to pack
+            out: The bytearray the value is appended to
+        """
+        if value is None:
+            out += b'N'
+        elif value is True:
+            out += b'T'
+        elif value is False:
+            out += b'F'
+        elif isinstance(value,int):
+            out += b'i' + struct.pack('!q',value)
+        elif isinstance(value,float):
+            out += b'd' + struct.pack('!d',value)
+        elif isinstance(value,str):
+            raw = value.encode('utf-8')
+            out += b's' + struct.pack('!I',len(raw)) + raw
+        elif isinstance(value,(bytes,bytearray,memoryview)):
+            out += b'b' + struct.pack('!I',len(value))
+            out += value
+        elif isinstance(value,(list,tuple)):
+            out += b'l' + struct.pack('!I',len(value))
+            for item in value:
+                self.packValue(item,out)
+        elif isinstance(value,dict):
+            out += b'm' + struct.pack('!I',len(value))
+            for key,item in value.items():
+                self.packValue(key,out)
+                self.packValue(item,out)
+        else:
+            raise TypeError("Can't encode a {}".format(type(value).__name__))
+
+    def unpackValue(self,view,offset,depth=0):
+        """
+        This method will read a tagged value out of a memoryview without
+        copying the bytes around it
+
+        Parameters:
+            view: The memoryview of the body
+            offset: Where the value starts
+            depth: How many lists and dicts the value is inside of
+        Output:
+            A tuple of the value and the offset right after it
+        """
+        tag = view[offset]
+        offset += 1
+        if tag == 0x4E:#N
+            return None,offset
+        elif tag == 0x54:#T
+            return True,offset
+        elif tag == 0x46:#F
+            return False,offset
+        elif tag == 0x69:#i
+            return struct.unpack_from('!q',view,offset)[0],offset+8
+        elif tag == 0x64:#d
+            return struct.unpack_from('!d',view,offset)[0],offset+8
+        length = struct.unpack_from('!I',view,offset)[0]
+        offset += 4
+        if tag == 0x73:#s
+            end = offset + length
+            if end > len(view):
+                raise ValueError("String runs past the end of the body")
+            return str(view[offset:end],'utf-8'),end
+        elif tag == 0x62:#b
+            end = offset + length
+            if end > len(view):
+                raise ValueError("Bytes run past the end of the body")
+            return bytes(view[offset:end]),end
+        if tag in (0x6C,0x6D) and depth >= self.MAXDEPTH:
+            raise ValueError("Values are nested too deep")
+        if tag == 0x6C:#l
+            items = []
+            for i in range(length):
+                item,offset = self.unpackValue(view,offset,depth+1)
+                items.append(item)
+            return items,offset
+        elif tag == 0x6D:#m
+            items = dict()
+            for i in range(length):
+                key,offset = self.unpackValue(view,offset,depth+1)
+                if type(key) not in self.KEYS:
+                    raise ValueError("A key can't be a {}".format(
+                        type(key).__name__))
+                items[key],offset = self.unpackValue(view,offset,depth+1)
+            return items,offset
+        raise ValueError("Unknown tag {}".format(tag))
+
+def presetDictionary():
+    """
+    This function will make the bytes compression is primed with, which are
+    the encoded values that show up in most bodies, like the keys of a table
+    entry. Even a small table repeats them, so with the dictionary it only
+    takes a few bytes to say so. zlib finds the end of the dictionary
+    cheapest to refer to, so the most common values go last. Every peer has
+    to use the same dictionary, so changing it means a new VERSION.
+    """
+    codec = BinaryCodec()
+    out = bytearray()
+    for value in ({'from':1,'to':2,'changes':{}},'[',': ',
+                  {'IP':'127.0.0.1','PORT':50000,'Online':False},
+                  {'IP':'127.0.0.1','PORT':50001,'Online':True}):
+        codec.packValue(value,out)
+    return bytes(out)
+
+DICTIONARY = presetDictionary()
+
+class PickleCodec:
+    """
+    This class will encode packets the way the original version of the
+    application did, as pickled lists with an MD5 checksum of the data. It
+    is only here for compatibility, unpickling datagrams from the network
+    can run arbitrary code so it should only be used with trusted peers.
+    It can't compress packets.
+    """
+    compression = None
+
+    def __init__(self,traffic=None):
+        self.traffic = traffic
+
+    def encode(self,packet,compress=False):
+        """
+        This method will turn a packet into bytes, compress is ignored
+        """
+        if packet[0] in ('ACK','NACK','BEAT'):
+            return pickle.dumps(packet)
+        checksum = md5(pickle.dumps(packet[2])).hexdigest()
+        return pickle.dumps([packet[0],packet[1],packet[2],checksum])
+
+    def decode(self,data):
+        """
+        This method will turn bytes from the wire back into a packet
+
+        Output:
+            The packet - if the datagram is intact
+            None - if the datagram is corrupt
+        """
+        try:
+            rdata = pickle.loads(data)
+        except Exception:
+            return None
+        if (isinstance(rdata,list) and len(rdata) == 2 and
+                rdata[0] in ('ACK','NACK','BEAT')):
+            return rdata
+        if not isinstance(rdata,list) or len(rdata) < 4:
+            return None
+        #Now we can check the checksum
+        checksum = md5(pickle.dumps(rdata[2])).hexdigest()
+        if checksum != rdata[3]:
+            return None
+        return rdata[0:3]
+
+#The codecs that can be picked by name
+CODECS = {'binary':BinaryCodec,'pickle':PickleCodec}
+
+def makeCodec(name,traffic=None):
+    """
+    This function will create the codec with the given name, counting its
+    compression in traffic
+    """
+    if name not in CODECS:
+        raise ValueError("Unknown codec {}".format(name))
+    return CODECS[name](traffic)
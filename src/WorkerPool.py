@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+#Created by Adithya Shastry
+#This File holds a fixed size pool of worker threads that the Server and the
+# Client use to process messages instead of starting a thread for each one
+
+import queue
+import traceback
+from threading import Thread
+
+class WorkerPool:
+    """
+    This class will run tasks on a fixed number of worker threads. Every
+    worker has its own bounded queue and tasks are given to a worker based on
+    a key, so tasks with the same key (like messages from the same sender)
+    are always run in the order they were submitted.
+
+    Methods:
+        Constructor:
+            Starts the worker threads
+        submit:
+            Queues a task for the worker that owns its key
+        full:
+            Whether the queue of the worker that owns a key is full
+        depth:
+            The number of tasks waiting in all of the queues
+        close:
+            Stops the workers once they finish the tasks they have
+    Attributes:
+        queues: The queue of each worker
+        threads: The worker threads
+    """
+    def __init__(self,workers=8,queueSize=256):
+        self.queues = [queue.Queue(maxsize=queueSize) for i in range(workers)]
+        self.threads = []
+        for tasks in self.queues:
+            worker = Thread(target=self.work,args=(tasks,),daemon=True)
+            worker.start()
+            self.threads.append(worker)
+
+    def submit(self,key,target,*args,block=True,timeout=None):
+        """
+        This method will queue a task for the worker that owns the key. If
+        that worker's queue is full we wait for room (which slows down whoever
+        is submitting) or give up if we aren't allowed to wait.
+
+        Parameters:
+            key: Tasks with the same key are run in order
+            target: The function to run
+            args: The arguments for the function
+            block: Whether to wait for room in the queue
+            timeout: How long to wait for room if block is True
+        Output:
+            True - if the task was queued
+            False - if the queue was full
+        """
+        tasks = self.queues[hash(key) % len(self.queues)]
+        try:
+            tasks.put((target,args),block,timeout)
+        except queue.Full:
+            return False
+        return True
+
+    def full(self,key):
+        return self.queues[hash(key) % len(self.queues)].full()
+
+    def work(self,tasks):
+        """
+        This method is the loop each worker thread runs
+        """
+        while True:
+            target,args = tasks.get()
+            if target is None:
+                break
+            try:
+                target(*args)
+            except Exception:
+                #One bad message shouldn't take the worker down with it
+                traceback.print_exc()
+        return None
+
+    def depth(self):
+        """
+        This method will return how many tasks are waiting to be run
+        """
+        return sum(tasks.qsize() for tasks in self.queues)
+
+    def close(self):
+        """
+        This method will stop the workers after the tasks already queued
+        """
+        for tasks in self.queues:
+            tasks.put((None,()))
+        for worker in self.threads:
+            worker.join()
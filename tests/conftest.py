@@ -0,0 +1,6 @@
+#The modules live flat in src and import each other by name, so the tests
+# import them the same way
+import os
+import sys
+
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..','src'))
@@ -0,0 +1,71 @@
+#Created by Adithya Shastry
+#Tests that a client racing a direct send against the Server doesn't wait
+# through every retry for a client that is gone
+
+import time
+import socket
+import asyncio
+import unittest
+from AsyncUDPSocket import AsyncUDPSocket
+from AsyncClient import AsyncClient
+
+class ProbeTest(unittest.TestCase):
+    def setUp(self):
+        #A client that is gone, nothing answers on its Port
+        self.gone = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        self.gone.bind(('127.0.0.1',0))
+        self.addCleanup(self.gone.close)
+
+    def testServerWinsTheRace(self):
+        async def test():
+            server = await AsyncUDPSocket(0).bind()
+            client = AsyncClient('alice','127.0.0.1',0,server.PORT,
+                                 probe=0.1)
+            await client.open()
+            client.clientTable['bob'] = {'IP':'127.0.0.1',
+                                         'PORT':self.gone.getsockname()[1],
+                                         'Online':True}
+            start = time.monotonic()
+            result = await client.send('bob','hi')
+            elapsed = time.monotonic() - start
+            packet,address = await server.secureRecieve()
+            self.assertEqual(packet[1:],['MSG:bob','alice: hi'])
+            #The next message goes straight to the Server
+            self.assertTrue(client.peers.unreachable(
+                'bob',('127.0.0.1',self.gone.getsockname()[1])))
+            await client.close()
+            server.close()
+            return result,elapsed
+        result,elapsed = asyncio.run(test())
+        self.assertEqual(result,'stored')
+        #Going through the retries would take seconds
+        self.assertLess(elapsed,0.5)
+
+    def testSlowClientStillWins(self):
+        #The client ACKs after the probe ran out, and the Server is gone too
+        server = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1',0))
+        self.addCleanup(server.close)
+        async def test():
+            client = AsyncClient('alice','127.0.0.1',0,
+                                 server.getsockname()[1],probe=0.1)
+            await client.open()
+            client.clientTable['bob'] = {'IP':'127.0.0.1',
+                                         'PORT':self.gone.getsockname()[1],
+                                         'Online':True}
+            loop = asyncio.get_running_loop()
+            def slowAck():
+                data,address = self.gone.recvfrom(2048)
+                time.sleep(0.3)
+                seq = client.udp.codec.decode(data)[0]
+                self.gone.sendto(client.udp.codec.encode(['ACK',seq]),
+                                 address)
+            ack = loop.run_in_executor(None,slowAck)
+            result = await client.send('bob','hi')
+            await ack
+            await client.close()
+            return result
+        self.assertEqual(asyncio.run(test()),'delivered')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#Created by Adithya Shastry
+#Tests that the AsyncServer only changes the client table while holding the
+# tableLock, since the Snapshotter copies it from another thread
+
+import types
+import asyncio
+import unittest
+from AsyncServer import AsyncServer
+
+class CheckedEntry(dict):
+    """
+    A table entry that remembers every change made to it without the
+    tableLock held
+    """
+    def __init__(self,lock,unlocked,*args):
+        dict.__init__(self,*args)
+        self.lock = lock
+        self.unlocked = unlocked
+
+    def __setitem__(self,key,value):
+        if not self.lock.locked():
+            self.unlocked.append(key)
+        dict.__setitem__(self,key,value)
+
+class CheckedTable(CheckedEntry):
+    """
+    A client table whose new entries are checked too
+    """
+    def __setitem__(self,nick,entry):
+        entry = CheckedEntry(self.lock,self.unlocked,entry)
+        CheckedEntry.__setitem__(self,nick,entry)
+
+class TableLockTest(unittest.TestCase):
+    def setUp(self):
+        #A Server that isn't listening, we only call its methods
+        self.server = AsyncServer.__new__(AsyncServer)
+        self.server.initState(None)
+        self.unlocked = []
+        self.server.clientTable = CheckedTable(self.server.tableLock,
+                                               self.unlocked)
+        self.responses = []
+        async def secureSend(MSG,PORT,IP):
+            return self.responses.pop(0) if self.responses else 200
+        async def windowSend(MSGS,PORT,IP,onAck):
+            return None
+        self.server.udp = types.SimpleNamespace(
+            secureSend=secureSend,windowSend=windowSend,
+            compresses=lambda address: False,forget=lambda address: None)
+
+    def testChangesHoldTheLock(self):
+        async def test():
+            server = self.server
+            await server.registerUser('bob','127.0.0.1',5000)
+            await server.deRegister('bob')
+            await server.registerUser('bob','127.0.0.1',5001)
+            await server.presenceChanged('bob',False)
+            await server.presenceChanged('bob',True)
+            #The client doesn't answer when a message is stored for it
+            self.responses.append(100)
+            await server.storeMessage('bob','hi',('127.0.0.1',6000))
+            await server.registerUser('bob','127.0.0.1',5001)
+            await server.registerUser('alice','127.0.0.1',5002)
+            server.addMember('#room','bob')
+            server.addMember('#room','alice')
+            #Neither does the post to it
+            self.responses.append(100)
+            await server.postMessage('#room','hi',('127.0.0.1',5002))
+            return dict(server.clientTable['bob'])
+        entry = asyncio.run(test())
+        self.assertEqual(self.unlocked,[])
+        self.assertEqual(entry,{'IP':'127.0.0.1','PORT':5001,
+                                'Online':False})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+#Created by Adithya Shastry
+#Tests of the sequence numbers of the AsyncUDPSocket and how it ACKs
+
+import socket
+import asyncio
+import unittest
+from AsyncUDPSocket import AsyncUDPSocket
+
+class StreamTest(unittest.TestCase):
+    async def sockets(self):
+        server = await AsyncUDPSocket(0,retries=3).bind()
+        client = await AsyncUDPSocket(0,retries=3).bind()
+        return server,client
+
+    def testOnlyPacketZeroStartsAStream(self):
+        async def test():
+            server,client = await self.sockets()
+            peer = ('127.0.0.1',server.PORT)
+            client.sendSeq[peer] = 5
+            response = await client.windowSend(
+                [[0,'MSG:bob','a'],[0,'MSG:bob','b']],server.PORT)
+            self.assertEqual(response,200)
+            packets = [(await server.secureRecieve())[0] for i in range(2)]
+            self.assertEqual([packet[2] for packet in packets],['a','b'])
+            self.assertEqual([packet[0] for packet in packets],[0,1])
+            self.assertEqual(server.traffic.nacks.snapshot(),2)
+            server.close()
+            client.close()
+        asyncio.run(test())
+
+class AckTest(unittest.TestCase):
+    def setUp(self):
+        #A peer that never answers, the tests ACK for it
+        self.peer = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        self.peer.bind(('127.0.0.1',0))
+        self.address = self.peer.getsockname()
+
+    def tearDown(self):
+        self.peer.close()
+
+    def ack(self,client,seq):
+        client.datagramReceived(client.codec.encode(['ACK',seq]),
+                                self.address)
+
+    def testAcksBetweenWakeups(self):
+        #Two ACKs that come before the send looks still both count
+        async def test():
+            client = await AsyncUDPSocket(0,retries=3).bind()
+            send = asyncio.ensure_future(client.windowSend(
+                [[0,'MSG:bob',str(i)] for i in range(3)],self.address[1]))
+            await asyncio.sleep(0.05)
+            self.ack(client,0)
+            await asyncio.sleep(0.05)
+            self.ack(client,1)
+            self.ack(client,2)
+            self.assertEqual(await send,200)
+            self.assertEqual(client.traffic.retransmits.total(),0)
+            client.close()
+        asyncio.run(test())
+
+    def testCancelIsNotLost(self):
+        #A cancel that comes with the ACK still cancels the send
+        async def test():
+            client = await AsyncUDPSocket(0,retries=3).bind()
+            send = asyncio.ensure_future(client.windowSend(
+                [[0,'MSG:bob','a'],[0,'MSG:bob','b']],self.address[1]))
+            await asyncio.sleep(0.05)
+            self.ack(client,0)
+            send.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await send
+            self.assertEqual(client.sendSeq[('127.0.0.1',
+                                             self.address[1])],0)
+            client.close()
+        asyncio.run(test())
+
+    def testLateAckFromAnOldStream(self):
+        #An ACK past what we have sent is from a stream we gave up on, it
+         # doesn't skip the packets of this one
+        async def test():
+            client = await AsyncUDPSocket(0,retries=2).bind()
+            send = asyncio.ensure_future(client.windowSend(
+                [[0,'MSG:bob','a'],[0,'MSG:bob','b']],self.address[1]))
+            await asyncio.sleep(0.05)
+            self.ack(client,35)
+            self.assertEqual(await send,100)
+            client.close()
+        asyncio.run(test())
+
+    def testBadAdmitIsDropped(self):
+        #A datagram that blows up is counted and the socket keeps going
+        async def test():
+            client = await AsyncUDPSocket(0).bind()
+            def admit(data,address):
+                raise KeyError(address)
+            client.admit = admit
+            client.dispatch(client.codec.encode([0,'MSG:bob','a']),
+                            self.address)
+            self.assertEqual(client.traffic.dropped.snapshot(),1)
+            client.close()
+        asyncio.run(test())
+
+class CoalesceTest(unittest.TestCase):
+    def setUp(self):
+        #Peers that send us packets and read the ACKs we send back
+        self.peers = []
+        for i in range(2):
+            peer = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+            peer.bind(('127.0.0.1',0))
+            peer.settimeout(1)
+            self.addCleanup(peer.close)
+            self.peers.append(peer)
+
+    def acks(self,udp,peer,count):
+        return [udp.codec.decode(peer.recvfrom(2048)[0])
+                for i in range(count)]
+
+    def testOneAckPerPeerPerBatch(self):
+        async def test():
+            udp = await AsyncUDPSocket(0).bind()
+            first,second = [peer.getsockname() for peer in self.peers]
+            #A batch with five packets from one peer and two from another
+            for seq in range(5):
+                udp.dispatch(udp.codec.encode([seq,'MSG:bob',str(seq)]),
+                             first)
+            for seq in range(2):
+                udp.dispatch(udp.codec.encode([seq,'MSG:bob',str(seq)]),
+                             second)
+            udp.flushAcks()
+            self.assertEqual(self.acks(udp,self.peers[0],1),[['ACK',4]])
+            self.assertEqual(self.acks(udp,self.peers[1],1),[['ACK',1]])
+            self.assertEqual(udp.traffic.acksSent.snapshot(),2)
+            self.assertEqual(udp.traffic.acksCoalesced.snapshot(),5)
+            udp.close()
+        asyncio.run(test())
+
+    def testAckDelay(self):
+        #Packets that come within ackDelay of the batch share its ACK
+        async def test():
+            udp = await AsyncUDPSocket(0,ackDelay=0.05).bind()
+            peer = self.peers[0].getsockname()
+            udp.dispatch(udp.codec.encode([0,'MSG:bob','a']),peer)
+            udp.flushAcks()
+            await asyncio.sleep(0.01)
+            self.assertEqual(udp.traffic.acksSent.snapshot(),0)
+            udp.dispatch(udp.codec.encode([1,'MSG:bob','b']),peer)
+            udp.flushAcks()
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.acks(udp,self.peers[0],1),[['ACK',1]])
+            self.assertEqual(udp.traffic.acksSent.snapshot(),1)
+            self.assertEqual(udp.traffic.acksCoalesced.snapshot(),1)
+            udp.close()
+        asyncio.run(test())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#Created by Adithya Shastry
+#Tests that the duplicate cache recognizes packets it was given and forgets
+# them when it runs out of room or they get too old
+
+import time
+import unittest
+from DuplicateCache import DuplicateCache
+
+PEER = ('127.0.0.1',5000)
+
+class SeenTest(unittest.TestCase):
+    def testHit(self):
+        cache = DuplicateCache()
+        self.assertFalse(cache.seen(PEER,0,'abc'))
+        cache.add(PEER,0,'abc')
+        self.assertTrue(cache.seen(PEER,0,'abc'))
+        #A new stream starting at 0 has different bytes
+        self.assertFalse(cache.seen(PEER,0,'def'))
+        #And the same packet from someone else is new too
+        self.assertFalse(cache.seen(('127.0.0.1',5001),0,'abc'))
+
+    def testNewDigestReplacesOld(self):
+        cache = DuplicateCache()
+        cache.add(PEER,0,'abc')
+        cache.add(PEER,0,'def')
+        self.assertFalse(cache.seen(PEER,0,'abc'))
+        self.assertTrue(cache.seen(PEER,0,'def'))
+
+    def testForget(self):
+        cache = DuplicateCache()
+        cache.add(PEER,0,'abc')
+        cache.forget(PEER)
+        self.assertFalse(cache.seen(PEER,0,'abc'))
+
+class EvictionTest(unittest.TestCase):
+    def testPerPeer(self):
+        #The oldest packets of a peer go first
+        cache = DuplicateCache(perPeer=2)
+        for seq in range(3):
+            cache.add(PEER,seq,str(seq))
+        self.assertFalse(cache.seen(PEER,0,'0'))
+        self.assertTrue(cache.seen(PEER,1,'1'))
+        self.assertTrue(cache.seen(PEER,2,'2'))
+
+    def testMaxPeers(self):
+        #The peer we heard from least recently goes first
+        cache = DuplicateCache(maxPeers=2)
+        first,second,third = [('127.0.0.1',PORT) for PORT in range(3)]
+        cache.add(first,0,'a')
+        cache.add(second,0,'b')
+        cache.add(first,1,'c')
+        cache.add(third,0,'d')
+        self.assertTrue(cache.seen(first,0,'a'))
+        self.assertFalse(cache.seen(second,0,'b'))
+        self.assertTrue(cache.seen(third,0,'d'))
+
+    def testTtl(self):
+        cache = DuplicateCache(ttl=0.05)
+        cache.add(PEER,0,'abc')
+        time.sleep(0.1)
+        self.assertFalse(cache.seen(PEER,0,'abc'))
+        self.assertEqual(len(cache.peers[PEER]),0)
+
+if __name__ == '__main__':
+    unittest.main()
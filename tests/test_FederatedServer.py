@@ -0,0 +1,62 @@
+#Created by Adithya Shastry
+#Tests that only nodes of the federation can gossip with a node, and that
+# what they send is checked before it is used
+
+import types
+import unittest
+from FederatedServer import FederatedServer
+
+SEED = ('127.0.0.1',5001)
+STRANGER = ('127.0.0.1',6666)
+
+class TrustTest(unittest.TestCase):
+    def node(self,secret=None):
+        #A node that isn't listening, we only call its methods
+        node = FederatedServer.__new__(FederatedServer)
+        node.udp = types.SimpleNamespace(HOST='127.0.0.1',PORT=5000)
+        node.initFederation([SEED],secret=secret)
+        return node
+
+    def testGossipDoesNotMakeANode(self):
+        node = self.node()
+        digest = {'127.0.0.1:6666':[1,1],'127.0.0.1:7777':[1,1]}
+        self.assertIsNone(node.checkGossip(digest,STRANGER))
+        self.assertEqual(node.nodes,{SEED})
+
+    def testSecretLetsANodeJoin(self):
+        node = self.node('s3cret')
+        other = self.node('s3cret')
+        digest = {'127.0.0.1:6666':[1,1]}
+        proof = other.proof(node.nodeName(STRANGER))
+        self.assertEqual(node.checkGossip([digest,proof],STRANGER),digest)
+        self.assertIn(STRANGER,node.nodes)
+
+    def testWrongSecret(self):
+        node = self.node('s3cret')
+        proof = self.node('guess').proof(node.nodeName(STRANGER))
+        self.assertIsNone(node.checkGossip([{},proof],STRANGER))
+        #A proof for another address doesn't work either
+        proof = node.proof('127.0.0.1:5001')
+        self.assertIsNone(node.checkGossip([{},proof],STRANGER))
+        self.assertEqual(node.nodes,{SEED})
+
+    def testBadDigest(self):
+        node = self.node()
+        for digest in ([1,2,3],{'127.0.0.1:5002':'x'},{('a',):[1,1]},
+                       {'nowhere':[1,1]},{'127.0.0.1:5002':[1,'2']}):
+            self.assertIsNone(node.checkGossip(digest,SEED))
+
+    def testBadMembers(self):
+        node = self.node()
+        good = {'view':{'127.0.0.1:5002':[[1,1],{'bob':True}]},'want':[]}
+        self.assertTrue(node.isMembers(good))
+        for members in (None,[],{'view':[],'want':[]},
+                        {'view':{'127.0.0.1:5002':[[1,1],['bob']]},
+                         'want':[]},
+                        {'view':{'127.0.0.1:5002':[[1,1],{1:True}]},
+                         'want':[]},
+                        {'view':{},'want':[['127.0.0.1',1]]}):
+            self.assertFalse(node.isMembers(members))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#Created by Adithya Shastry
+#Tests that bad chunks and offers are turned down instead of crashing, and
+# that the spool and the clients keep to their quotas
+
+import os
+import time
+import zlib
+import shutil
+import tempfile
+import asyncio
+import unittest
+from FileTransfer import FileTransfer
+from AsyncClient import AsyncClient
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = FileTransfer(self.directory,spool=True,maxPerNick=100,
+                                  maxSpool=150,minCost=10)
+
+    def tearDown(self):
+        self.spool.close()
+        shutil.rmtree(self.directory)
+
+    def offer(self,transferId,size,to='bob'):
+        return {'id':transferId,'name':'note.txt','size':size,
+                'chunkSize':10,'chunks':-(-size // 10),'from':'alice',
+                'to':to}
+
+    def testBadChunks(self):
+        self.assertEqual(self.spool.accept('a1',self.offer('a1',20)),0)
+        for chunk in (None,[0,1],[0,0,'text'],['0',0,b'x'],{'a':1},
+                      [0,zlib.crc32(b'x'),b'x']):
+            self.assertFalse(self.spool.write('a1',chunk))
+        data = b'0123456789'
+        self.assertTrue(self.spool.write('a1',[0,zlib.crc32(data),data]))
+
+    def testBadOffers(self):
+        for offer in (None,[1,2],'offer',self.offer('b1',-5),
+                      dict(self.offer('b1',20),size='many')):
+            self.assertIsNone(self.spool.accept('b1',offer))
+
+    def testQuotas(self):
+        self.assertEqual(self.spool.accept('c1',self.offer('c1',60)),0)
+        #Too much for bob, but resuming the one he has is fine
+        self.assertIsNone(self.spool.accept('c2',self.offer('c2',60)))
+        self.spool.close()
+        self.assertEqual(self.spool.accept('c1',self.offer('c1',60)),0)
+        #carol has room of her own, until the spool is full
+        self.assertEqual(self.spool.accept('c3',self.offer('c3',80,'carol')),
+                         0)
+        self.assertIsNone(self.spool.accept('c4',self.offer('c4',20,'dave')))
+        self.assertFalse(os.path.exists(os.path.join(self.directory,
+                                                     'c4.part')))
+
+class OpenTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.directory)
+        self.spool = FileTransfer(self.directory,spool=True,maxPerNick=100,
+                                  minCost=40,maxOpen=2,idleTimeout=1.0)
+        self.addCleanup(self.spool.close)
+
+    def offer(self,transferId,size,to):
+        return {'id':transferId,'name':'note.txt','size':size,
+                'chunkSize':10,'chunks':-(-size // 10),'from':'alice',
+                'to':to}
+
+    def testEmptyFilesCount(self):
+        self.assertEqual(self.spool.accept('f1',self.offer('f1',0,'bob')),0)
+        self.assertEqual(self.spool.accept('f2',self.offer('f2',0,'bob')),0)
+        self.assertIsNone(self.spool.accept('f3',self.offer('f3',0,'bob')))
+
+    def testOpenPerSender(self):
+        for transferId in ('g1','g2'):
+            self.assertEqual(self.spool.accept(
+                transferId,self.offer(transferId,20,transferId),'alice'),0)
+        self.assertIsNone(self.spool.accept('g3',self.offer('g3',20,'g3'),
+                                            'alice'))
+        self.assertEqual(self.spool.accept('g3',self.offer('g3',20,'g3'),
+                                           'carol'),0)
+
+    def testIdleTransfersClose(self):
+        self.assertEqual(self.spool.accept('h1',self.offer('h1',20,'bob')),0)
+        data = b'0123456789'
+        self.assertTrue(self.spool.write('h1',[0,zlib.crc32(data),data]))
+        self.spool.expire(time.monotonic() + 2)
+        self.assertEqual(self.spool.incoming,{})
+        self.assertFalse(self.spool.write('h1',[1,zlib.crc32(data),data]))
+        #It picks up where it stopped
+        self.assertEqual(self.spool.accept('h1',self.offer('h1',20,'bob')),1)
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.directory)
+
+    def offer(self,transferId,size):
+        return {'id':transferId,'name':'note.txt','size':size,
+                'chunkSize':10,'chunks':-(-size // 10),'from':'alice',
+                'to':'bob'}
+
+    def testQuota(self):
+        #A client only takes in so much at once
+        files = FileTransfer(self.directory,maxPerNick=100,maxSpool=100,
+                             minCost=10)
+        self.addCleanup(files.close)
+        self.assertIsNone(files.accept('d1',self.offer('d1',200)))
+        self.assertEqual(files.accept('d2',self.offer('d2',60)),0)
+        self.assertIsNone(files.accept('d3',self.offer('d3',60)))
+
+    def testOnOffer(self):
+        #The program using the client decides which offers it takes
+        async def test():
+            client = AsyncClient('bob','127.0.0.1',0,50000,
+                                 downloadDir=self.directory)
+            answers = []
+            async def secureSend(MSG,PORT,IP):
+                answers.append(MSG[2])
+            client.udp.secureSend = secureSend
+            client.onOffer = lambda offer: offer['size'] < 50
+            for transferId,size in (('e1',60),('e2',20)):
+                await client.processMessage(
+                    [0,'offer:'+transferId,self.offer(transferId,size)],
+                    ('127.0.0.1',5000))
+            await asyncio.sleep(0)
+            client.files.close()
+            return answers
+        self.assertEqual(asyncio.run(test()),[None,0])
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['e2.offer','e2.part'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#Created by Adithya Shastry
+#Tests that fragments can't make the Fragmenter crash or hold on to more
+# memory than it is allowed
+
+import zlib
+import unittest
+from Fragmenter import Fragmenter
+
+PEER = ('127.0.0.1',5000)
+
+class AddTest(unittest.TestCase):
+    def fragment(self,msgId,index,count,total,start,chunk):
+        return Fragmenter.HEADER.pack(Fragmenter.MARK,msgId,index,count,
+                                      total,start,zlib.crc32(chunk)) + chunk
+
+    def testReassemble(self):
+        sender = Fragmenter(fragmentSize=10)
+        reciever = Fragmenter()
+        data = bytes(range(95))
+        msgId,fragments = sender.split(data,PEER)
+        for fragment in reversed(fragments[1:]):
+            self.assertIsNone(reciever.add(fragment,PEER)[0])
+        self.assertEqual(reciever.add(fragments[0],PEER)[0],data)
+        self.assertEqual(reciever.buffered,0)
+
+    def testCountChanges(self):
+        #Same total but a bigger count would index past the bitmap
+        reciever = Fragmenter()
+        reciever.add(self.fragment(7,0,2,100,0,b'x'),PEER)
+        self.assertEqual(reciever.add(self.fragment(7,50,60,100,0,b'y'),
+                                      PEER),(None,None))
+        self.assertEqual(reciever.incoming[(PEER,7)]['got'],1)
+
+    def testTotalChanges(self):
+        reciever = Fragmenter()
+        reciever.add(self.fragment(7,0,2,100,0,b'x'),PEER)
+        self.assertEqual(reciever.add(self.fragment(7,1,2,200,0,b'y'),PEER),
+                         (None,None))
+        self.assertEqual(len(reciever.incoming[(PEER,7)]['buffer']),100)
+
+    def testBudget(self):
+        reciever = Fragmenter(maxBuffered=1000)
+        for msgId in range(10):
+            reciever.add(self.fragment(msgId,0,2,400,0,b'x'),PEER)
+        #Only two packets of 400 bytes fit in 1000
+        self.assertEqual(len(reciever.incoming),2)
+        self.assertEqual(reciever.buffered,800)
+        reciever.add(self.fragment(0,1,2,400,1,b'y'),PEER)
+        self.assertEqual(reciever.buffered,400)
+        reciever.add(self.fragment(9,0,2,400,0,b'x'),PEER)
+        self.assertEqual(reciever.buffered,800)
+
+    def testCountTooBig(self):
+        reciever = Fragmenter()
+        self.assertEqual(reciever.add(self.fragment(1,0,5000,10,0,b'x'),
+                                      PEER),(None,None))
+        self.assertEqual(reciever.buffered,0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#Created by Adithya Shastry
+#Tests that the impairment proxy makes the same decisions for the same seed,
+# and that it forwards through the aliases
+
+import socket
+import unittest
+from ImpairmentProxy import ImpairmentProxy
+
+class SeedTest(unittest.TestCase):
+    def proxy(self,seed,**impairments):
+        #The proxy only binds the alias of the Server, which we don't use
+        proxy = ImpairmentProxy(9,seed=seed,**impairments)
+        self.addCleanup(proxy.close)
+        return proxy
+
+    def decisions(self,proxy,count=500):
+        return [proxy.impair(100,('127.0.0.1',5000),10.0)
+                for i in range(count)]
+
+    def testSameSeed(self):
+        impairments = dict(loss=0.2,duplicate=0.1,reorder=0.2,delay=0.01,
+                           jitter=0.005,reorderDelay=0.05)
+        first = self.proxy(7,**impairments)
+        second = self.proxy(7,**impairments)
+        self.assertEqual(self.decisions(first),self.decisions(second))
+        self.assertEqual(first.stats,second.stats)
+        #And another seed decides differently
+        other = self.proxy(8,**impairments)
+        self.assertNotEqual(self.decisions(other),self.decisions(
+            self.proxy(7,**impairments)))
+
+    def testLoss(self):
+        proxy = self.proxy(1,loss=0.25)
+        decisions = self.decisions(proxy,2000)
+        lost = decisions.count([])
+        self.assertEqual(lost,proxy.stats['lost'])
+        self.assertTrue(400 < lost < 600)
+        #Everything else goes out once, right away
+        self.assertTrue(all(times == [10.0] for times in decisions
+                            if times))
+
+    def testReorder(self):
+        #The datagrams held back are sent after the ones that came after
+         # them, and the rest keep their order
+        proxy = self.proxy(3,reorder=0.3,reorderDelay=0.05)
+        sendAt = [proxy.impair(100,('127.0.0.1',5000),10.0 + i * 0.01)[0]
+                  for i in range(100)]
+        late = [i for i in range(100) if sendAt[i] > 10.0 + i * 0.01]
+        self.assertEqual(len(late),proxy.stats['reordered'])
+        self.assertTrue(late)
+        for i in late[:-1]:
+            if i + 1 not in late:
+                self.assertGreater(sendAt[i],sendAt[i+1])
+
+    def testQueueLimit(self):
+        #A link of 1000 bytes a second can only queue 1s of datagrams
+        proxy = self.proxy(1,bandwidth=1000,queueLimit=1.0)
+        decisions = self.decisions(proxy,20)
+        sent = [times[0] for times in decisions if times]
+        self.assertEqual(len(sent),11)
+        for i,sendAt in enumerate(sent):
+            self.assertAlmostEqual(sendAt,10.0 + 0.1 * (i + 1))
+        self.assertEqual(proxy.stats['queueDrops'],9)
+
+class ForwardTest(unittest.TestCase):
+    def testThroughTheAliases(self):
+        server = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1',0))
+        server.settimeout(1)
+        self.addCleanup(server.close)
+        client = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        client.bind(('127.0.0.1',0))
+        client.settimeout(1)
+        self.addCleanup(client.close)
+        proxy = ImpairmentProxy(server.getsockname()[1],seed=1)
+        self.addCleanup(proxy.close)
+        client.sendto(b'hi',proxy.address)
+        alias = proxy.sockets[proxy.server]
+        proxy.receive(alias,proxy.server,0.0)
+        proxy.flush(0.0)
+        data,source = server.recvfrom(2048)
+        self.assertEqual(data,b'hi')
+        #The Server only sees the alias of the client, and its answer goes
+         # back through it
+        self.assertEqual(source,proxy.alias(client.getsockname()))
+        server.sendto(b'back',source)
+        proxy.receive(proxy.sockets[client.getsockname()],
+                      client.getsockname(),0.0)
+        proxy.flush(0.0)
+        self.assertEqual(client.recvfrom(2048),(b'back',proxy.address))
+        self.assertEqual(proxy.stats['forwarded'],2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#Created by Adithya Shastry
+#Tests that the LogStore comes back the same after compaction moved its
+# messages around
+
+import shutil
+import tempfile
+import unittest
+from MessageStore import LogStore
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open(self):
+        return LogStore(self.directory,segmentSize=300,compactInterval=3600)
+
+    def fill(self,store):
+        #The first message of a ends up behind the newer ones once
+         # compaction copies it out of the first segment
+        store.append('a','old')
+        while store.active == 1:
+            store.append('b','filler')
+        store.append('a','new 1')
+        store.append('a','new 2')
+        store.ack('b',store.nextId)
+        store.compact()
+        self.assertEqual(store.segments()[0],2)
+
+    def testRestartAfterCompaction(self):
+        store = self.open()
+        self.fill(store)
+        before = store.pending('a')
+        store.close()
+        store = self.open()
+        self.assertEqual(store.pending('a'),before)
+        self.assertEqual([MSG for msgId,MSG in before],
+                         ['old','new 1','new 2'])
+        #Acking the first one only removes the first one
+        store.ack('a',before[0][0])
+        self.assertEqual(store.pending('a'),before[1:])
+        self.assertEqual(store.size(),2)
+        store.close()
+
+    def testCopyLeftBehind(self):
+        #Compaction stopped after copying, before deleting the old segment
+        store = self.open()
+        store.append('a','old')
+        while store.active == 1:
+            store.append('b','filler')
+        store.ack('b',store.nextId)
+        store.copyForward(1)
+        store.close()
+        store = self.open()
+        self.assertEqual([MSG for msgId,MSG in store.pending('a')],['old'])
+        self.assertEqual(store.size(),1)
+        self.assertEqual(store.live[1],0)
+        store.close()
+
+if __name__ == '__main__':
+    unittest.main()
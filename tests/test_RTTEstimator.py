@@ -0,0 +1,94 @@
+#Created by Adithya Shastry
+#Tests of the round trip time estimates and the timeouts worked out from
+# them, and that the UDPSocket only measures packets it didn't resend
+
+import socket
+import unittest
+from threading import Thread
+from RTTEstimator import RTTEstimator
+from UDPSocket import UDPSocket
+
+PEER = ('127.0.0.1',5000)
+
+class EstimateTest(unittest.TestCase):
+    def setUp(self):
+        self.rtt = RTTEstimator(initialRto=0.5,minRto=0.05,maxRto=4.0)
+
+    def testFirstSample(self):
+        #The first sample is the SRTT and half of it the RTTVAR
+        self.assertEqual(self.rtt.rto(PEER),0.5)
+        self.rtt.sample(PEER,0.1)
+        stats = self.rtt.stats()[PEER]
+        self.assertAlmostEqual(stats['srtt'],0.1)
+        self.assertAlmostEqual(stats['rttvar'],0.05)
+        self.assertAlmostEqual(stats['rto'],0.3)
+
+    def testLaterSamples(self):
+        self.rtt.sample(PEER,0.1)
+        self.rtt.sample(PEER,0.3)
+        stats = self.rtt.stats()[PEER]
+        #RTTVAR = 3/4 0.05 + 1/4 |0.1 - 0.3|, SRTT = 7/8 0.1 + 1/8 0.3
+        self.assertAlmostEqual(stats['rttvar'],0.0875)
+        self.assertAlmostEqual(stats['srtt'],0.125)
+        self.assertAlmostEqual(stats['rto'],0.125 + 4 * 0.0875)
+
+    def testBounds(self):
+        self.rtt.sample(PEER,0.001)
+        self.assertEqual(self.rtt.rto(PEER),0.05)
+        self.rtt.sample(('127.0.0.1',5001),10.0)
+        self.assertEqual(self.rtt.rto(('127.0.0.1',5001)),4.0)
+
+    def testBackoff(self):
+        #Every timeout doubles the RTO up to maxRto, and the next sample
+         # starts from the estimates again
+        self.rtt.sample(PEER,0.1)
+        self.rtt.backoff(PEER)
+        self.assertAlmostEqual(self.rtt.rto(PEER),0.6)
+        for i in range(5):
+            self.rtt.backoff(PEER)
+        self.assertEqual(self.rtt.rto(PEER),4.0)
+        self.rtt.sample(PEER,0.1)
+        self.assertLess(self.rtt.rto(PEER),0.5)
+
+    def testBackoffBeforeASample(self):
+        self.rtt.backoff(PEER)
+        self.assertEqual(self.rtt.rto(PEER),1.0)
+        self.assertIsNone(self.rtt.stats()[PEER]['srtt'])
+
+    def testForgetsLeastRecentlyUsed(self):
+        rtt = RTTEstimator(maxPeers=2)
+        rtt.sample(('127.0.0.1',1),0.1)
+        rtt.sample(('127.0.0.1',2),0.1)
+        rtt.sample(('127.0.0.1',1),0.1)
+        rtt.sample(('127.0.0.1',3),0.1)
+        self.assertEqual(sorted(rtt.stats()),[('127.0.0.1',1),
+                                              ('127.0.0.1',3)])
+
+class KarnTest(unittest.TestCase):
+    def testResentPacketIsntMeasured(self):
+        #The peer ignores the first copy and ACKs the resent one, we can't
+         # tell which copy the ACK was for so there is no sample
+        client = UDPSocket(0,retries=3,minRto=0.05)
+        self.addCleanup(client.close)
+        client.rtt.initialRto = 0.1
+        peer = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        peer.bind(('127.0.0.1',0))
+        self.addCleanup(peer.close)
+        responses = []
+        def send():
+            responses.append(client.secureSend([0,'MSG:bob','hi'],
+                                               peer.getsockname()[1]))
+        thread = Thread(target=send)
+        thread.start()
+        peer.recvfrom(2048)
+        data,address = peer.recvfrom(2048)
+        seq = client.codec.decode(data)[0]
+        peer.sendto(client.codec.encode(['ACK',seq]),address)
+        thread.join()
+        self.assertEqual(responses,[200])
+        stats = client.rtt.stats()[('127.0.0.1',peer.getsockname()[1])]
+        self.assertIsNone(stats['srtt'])
+        self.assertAlmostEqual(stats['rto'],0.2)
+
+if __name__ == '__main__':
+    unittest.main()
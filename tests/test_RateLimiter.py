@@ -0,0 +1,115 @@
+#Created by Adithya Shastry
+#Tests of the token buckets that limit how fast clients send requests, and
+# the throttled: replies the Server sends when they go over
+
+import time
+import types
+import unittest
+from threading import Event
+from RateLimiter import RateLimiter
+from Server import Server
+from Metrics import MetricsRegistry
+from WorkerPool import WorkerPool
+
+CLIENT = ('127.0.0.1',5000)
+
+class BucketTest(unittest.TestCase):
+    def setUp(self):
+        #2 requests a second with a burst of 4
+        self.limiter = RateLimiter({'MSG':(2.0,4)})
+
+    def testBurstThenRefill(self):
+        for i in range(4):
+            self.assertEqual(self.limiter.admit('MSG',(CLIENT,),now=100.0),
+                             (0,False))
+        retryAfter,notify = self.limiter.admit('MSG',(CLIENT,),now=100.0)
+        self.assertAlmostEqual(retryAfter,0.5)
+        self.assertTrue(notify)
+        #Half a second later there is one more token, and only one
+        self.assertEqual(self.limiter.admit('MSG',(CLIENT,),now=100.5),
+                         (0,False))
+        self.assertNotEqual(self.limiter.admit('MSG',(CLIENT,),now=100.5)[0],
+                            0)
+
+    def testRefillStopsAtBurst(self):
+        for i in range(4):
+            self.limiter.admit('MSG',(CLIENT,),now=100.0)
+        admitted = [self.limiter.admit('MSG',(CLIENT,),now=200.0)[0] == 0
+                    for i in range(5)]
+        self.assertEqual(admitted,[True] * 4 + [False])
+
+    def testToldOnce(self):
+        #A client that keeps going isn't told again until it could have
+         # sent the request
+        for i in range(4):
+            self.limiter.admit('MSG',(CLIENT,),now=100.0)
+        self.assertTrue(self.limiter.admit('MSG',(CLIENT,),now=100.0)[1])
+        self.assertFalse(self.limiter.admit('MSG',(CLIENT,),now=100.2)[1])
+        #It gets the next token and goes over again
+        self.assertEqual(self.limiter.admit('MSG',(CLIENT,),now=100.5),
+                         (0,False))
+        self.assertTrue(self.limiter.admit('MSG',(CLIENT,),now=100.5)[1])
+
+    def testEveryKeyNeedsAToken(self):
+        #bob is out of tokens, so a request from a new address as bob isn't
+         # admitted and the new address doesn't lose its token
+        other = ('127.0.0.1',5001)
+        for i in range(4):
+            self.limiter.admit('MSG',(CLIENT,'bob'),now=100.0)
+        self.assertNotEqual(self.limiter.admit('MSG',(other,'bob'),
+                                               now=100.0)[0],0)
+        for i in range(4):
+            self.assertEqual(self.limiter.admit('MSG',(other,None),
+                                                now=100.0),(0,False))
+
+    def testCommandsAreSeparate(self):
+        for i in range(4):
+            self.limiter.admit('MSG',(CLIENT,),now=100.0)
+        self.assertEqual(self.limiter.admit('join',(CLIENT,),now=100.0),
+                         (0,False))
+
+    def testSweep(self):
+        #Buckets that are full again are dropped and their room reused
+        self.limiter.admit('MSG',(CLIENT,),now=100.0)
+        self.limiter.sweep(now=101.0)
+        self.assertEqual(len(self.limiter),1)
+        self.limiter.sweep(now=103.0)
+        self.assertEqual(len(self.limiter),0)
+        self.limiter.admit('MSG',(('127.0.0.1',5001),),now=103.0)
+        self.assertEqual(len(self.limiter.values),RateLimiter.SIZE)
+
+class ThrottledTest(unittest.TestCase):
+    def setUp(self):
+        #A Server that isn't listening, its worker sends the replies
+        self.server = Server.__new__(Server)
+        self.server.initState(None,limits={'MSG':(1.0,2)})
+        self.server.initMetrics(MetricsRegistry())
+        self.server.pool = WorkerPool(1,8)
+        self.addCleanup(self.server.pool.close)
+        self.sent = []
+        self.replied = Event()
+        def secureSend(MSG,PORT,IP):
+            self.sent.append((MSG,PORT))
+            self.replied.set()
+        self.server.udp = types.SimpleNamespace(secureSend=secureSend)
+
+    def testThrottledReply(self):
+        request = [0,'MSG:bob','hi']
+        self.assertTrue(self.server.admit(request,CLIENT))
+        self.assertTrue(self.server.admit(request,CLIENT))
+        #The third one is dropped and the client told when to try again
+        self.assertFalse(self.server.admit(request,CLIENT))
+        self.assertTrue(self.replied.wait(5))
+        (MSG,PORT), = self.sent
+        self.assertEqual(MSG[1],'throttled:MSG:bob')
+        self.assertGreater(MSG[2],0)
+        self.assertLessEqual(MSG[2],1.0)
+        self.assertEqual(PORT,CLIENT[1])
+        #Resending right away is dropped too, without another reply
+        self.assertFalse(self.server.admit(request,CLIENT))
+        time.sleep(0.05)
+        self.assertEqual(len(self.sent),1)
+        self.assertEqual(self.server.throttledCount.snapshot(),{'MSG':2})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+#Created by Adithya Shastry
+#Tests that the Server turns requests down before they are ACKed when their
+# worker has no room, instead of holding everyone else up, and that clients
+# registering at once on different workers don't trip over each other.
+# Also that posts to a channel go out to its members, or are stored for them
+
+import time
+import types
+import unittest
+from threading import Event,Thread,Barrier
+from Server import Server
+from Metrics import MetricsRegistry
+from WorkerPool import WorkerPool
+
+CLIENT = ('127.0.0.1',5000)
+
+class BacklogTest(unittest.TestCase):
+    def setUp(self):
+        #A Server that isn't listening, we only call its methods
+        self.server = Server.__new__(Server)
+        self.server.initState(None)
+        self.server.initMetrics(MetricsRegistry())
+        self.server.pool = WorkerPool(1,1)
+        self.server.udp = types.SimpleNamespace(
+            forget=lambda address: None,
+            broadcastSend=lambda MSG,clients: None)
+        self.gate = Event()
+
+    def tearDown(self):
+        self.gate.set()
+        self.server.pool.close()
+
+    def testBusyWorkerTurnsRequestsDown(self):
+        #The worker is stuck on one task and has another waiting
+        self.server.pool.submit(CLIENT,self.gate.wait)
+        self.server.pool.submit(CLIENT,time.sleep,0)
+        self.assertFalse(self.server.admit([0,'MSG:bob','hi'],CLIENT))
+        self.assertEqual(self.server.busyCount.snapshot(),{'MSG':1})
+        #Once it catches up the resent request gets in
+        self.gate.set()
+        while self.server.pool.depth():
+            time.sleep(0.01)
+        self.assertTrue(self.server.admit([0,'MSG:bob','hi'],CLIENT))
+        self.assertEqual(self.server.throttledCount.snapshot(),{})
+
+    def testExpiredTimerWaitsItsTurn(self):
+        #A timer that runs out goes to the worker of the client's requests,
+         # and when that worker is busy we try again on the next tick
+         # instead of holding up the other timers
+        self.server.clientTable['bob'] = {'IP':CLIENT[0],'PORT':CLIENT[1],
+                                          'Online':True}
+        self.server.pool.submit(CLIENT,self.gate.wait)
+        self.server.pool.submit(CLIENT,time.sleep,0)
+        self.server.sessionExpired('bob')
+        self.assertIn('bob',self.server.wheel.timers)
+        self.gate.set()
+        while self.server.pool.depth():
+            time.sleep(0.01)
+        self.server.sessionExpired('bob')
+        done = Event()
+        self.server.pool.submit(CLIENT,done.set)
+        self.assertTrue(done.wait(5))
+        self.assertFalse(self.server.clientTable['bob']['Online'])
+
+class SlowTable(dict):
+    """
+    A client table that takes a moment to look a nickname up, so another
+    worker gets in between the look up and the change
+    """
+    def __contains__(self,nick):
+        found = dict.__contains__(self,nick)
+        time.sleep(0.001)
+        return found
+
+    def get(self,nick,default=None):
+        entry = dict.get(self,nick,default)
+        time.sleep(0.001)
+        return entry
+
+class RegisterTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server.__new__(Server)
+        self.server.initState(None)
+        self.server.clientTable = SlowTable()
+        self.sent = []
+        #A socket that only remembers what we sent
+        self.server.udp = types.SimpleNamespace(
+            secureSend=lambda MSG,PORT,IP: self.sent.append((MSG[2],PORT)),
+            broadcastSend=lambda MSG,clients: None,
+            compresses=lambda address: False,
+            forget=lambda address: None,
+            windowSend=lambda MSGS,PORT,IP,onAck: self.sent.extend(
+                (MSG[2],PORT) for MSG in MSGS))
+
+    def testSameNicknameAtOnce(self):
+        #Clients on different workers register the same nicknames at once,
+         # only one of them gets each
+        nicks = ['user{}'.format(i) for i in range(20)]
+        barrier = Barrier(4)
+        def register(PORT):
+            barrier.wait()
+            for nick in nicks:
+                self.server.registerUser(nick,'127.0.0.1',PORT)
+        threads = [Thread(target=register,args=(PORT,))
+                   for PORT in range(5000,5004)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        errors = [PORT for data,PORT in self.sent if data == 'ERROR']
+        self.assertEqual(len(self.sent) - len(errors),len(nicks))
+        self.assertEqual(len(errors),3 * len(nicks))
+
+    def testBackFromNewPort(self):
+        #A client that comes back from another Port gets what was stored
+         # for it there, and the old Port isn't it anymore
+        self.server.registerUser('bob','127.0.0.1',5000)
+        self.server.deRegister('bob')
+        self.assertEqual(self.server.deliverMessage('bob','hi'),'stored')
+        del self.sent[:]
+        self.server.registerUser('bob','127.0.0.1',5001)
+        self.assertEqual(self.server.clientTable['bob']['PORT'],5001)
+        self.assertEqual(self.server.addresses,{('127.0.0.1',5001):'bob'})
+        self.assertEqual(self.sent[-1],(['hi'],5001))
+
+    def testFailedSendAfterMove(self):
+        #A send to the old Port that fails once the client moved doesn't
+         # mark it Offline
+        self.server.registerUser('bob','127.0.0.1',5000)
+        def send(MSG,PORT,IP):
+            if MSG[1] == 'MSG:':
+                self.server.deRegister('bob')
+                self.server.registerUser('bob','127.0.0.1',5001)
+                return 100
+            return 200
+        self.server.udp.secureSend = send
+        self.assertEqual(self.server.deliverMessage('bob','hi'),'stored')
+        self.assertTrue(self.server.clientTable['bob']['Online'])
+
+class StoredTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server.__new__(Server)
+        self.server.initState(None,pageSize=2)
+        self.server.clientTable['bob'] = {'IP':'127.0.0.1','PORT':5000,
+                                          'Online':True}
+        for i in range(5):
+            self.server.store.append('bob','hi {}'.format(i))
+        self.pages = []
+        self.responses = []
+        def windowSend(MSGS,PORT,IP,onAck):
+            #Every batch is ACKed, unless the client is gone
+            self.pages.append([MSG[2] for MSG in MSGS])
+            response = self.responses.pop(0) if self.responses else 200
+            if response == 200:
+                for index in range(len(MSGS)):
+                    onAck(index)
+            return response
+        self.server.udp = types.SimpleNamespace(windowSend=windowSend)
+
+    def testPages(self):
+        #The queue is read and ACKed a page at a time
+        self.server.sendStored('bob')
+        self.assertEqual(self.pages,[[['hi 0','hi 1']],[['hi 2','hi 3']],
+                                     [['hi 4']]])
+        self.assertEqual(self.server.store.pending('bob'),[])
+
+    def testClientGoneAfterAPage(self):
+        #Once a page doesn't get through the rest stays stored
+        self.responses = [200,100]
+        self.server.sendStored('bob')
+        self.assertEqual(len(self.pages),2)
+        self.assertEqual([MSG for msgId,MSG in
+                          self.server.store.pending('bob')],
+                         ['hi 2','hi 3','hi 4'])
+
+class ChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server.__new__(Server)
+        self.server.initState(None)
+        self.errors = []
+        self.posts = []
+        #The members we can't reach
+        self.gone = set()
+        def broadcastSend(MSG,clients):
+            if MSG[1].startswith('post:'):
+                self.posts.append((MSG[2],sorted(clients)))
+            return {client:100 if client in self.gone else 200
+                    for client in clients}
+        self.server.udp = types.SimpleNamespace(
+            secureSend=lambda MSG,PORT,IP: self.errors.append((MSG[2],PORT)),
+            broadcastSend=broadcastSend)
+        for PORT,nick in enumerate(['alice','bob','carol'],5000):
+            self.server.clientTable[nick] = {'IP':'127.0.0.1','PORT':PORT,
+                                             'Online':True}
+            self.server.addresses[('127.0.0.1',PORT)] = nick
+
+    def testFanOut(self):
+        #Every other member that is online gets the post at once, the ones
+         # that are offline get it stored
+        for PORT in (5000,5001,5002):
+            self.server.joinChannel('#room',('127.0.0.1',PORT))
+        self.server.clientTable['carol']['Online'] = False
+        self.server.postMessage('#room','hi',('127.0.0.1',5000))
+        self.assertEqual(self.posts,[('[#room] alice: hi',
+                                      [('127.0.0.1',5001)])])
+        self.assertEqual([MSG for msgId,MSG in
+                          self.server.store.pending('carol')],
+                         ['[#room] alice: hi'])
+        self.assertEqual(self.server.store.pending('alice'),[])
+
+    def testUnreachableMemberIsStored(self):
+        self.server.joinChannel('#room',('127.0.0.1',5000))
+        self.server.joinChannel('#room',('127.0.0.1',5001))
+        self.gone.add(('127.0.0.1',5001))
+        self.server.postMessage('#room','hi',('127.0.0.1',5000))
+        self.assertFalse(self.server.clientTable['bob']['Online'])
+        self.assertEqual(len(self.server.store.pending('bob')),1)
+
+    def testLeave(self):
+        #A member that left doesn't get posts, and the last one to leave
+         # takes the channel with it
+        self.server.joinChannel('#room',('127.0.0.1',5000))
+        self.server.joinChannel('#room',('127.0.0.1',5001))
+        self.server.leaveChannel('#room',('127.0.0.1',5001))
+        self.server.postMessage('#room','hi',('127.0.0.1',5000))
+        self.assertEqual(self.posts,[('[#room] alice: hi',[])])
+        self.server.leaveChannel('#room',('127.0.0.1',5000))
+        self.assertEqual(self.server.channels,{})
+        self.assertEqual(self.server.memberOf,{})
+
+    def testOnlyMembersPost(self):
+        self.server.joinChannel('#room',('127.0.0.1',5000))
+        self.server.postMessage('#room','hi',('127.0.0.1',5001))
+        self.assertEqual(self.errors,[("You aren't in #room",5001)])
+        self.server.joinChannel('#room',('127.0.0.1',6000))
+        self.assertEqual(self.errors[-1],
+                         ("You have to register before using channels",6000))
+        self.assertEqual(self.posts,[])
+
+if __name__ == '__main__':
+    unittest.main()
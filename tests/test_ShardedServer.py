@@ -0,0 +1,116 @@
+#Created by Adithya Shastry
+#Tests that a shard can forward operations to itself from its own workers
+
+import time
+import types
+import queue
+import unittest
+from threading import Event,Thread
+from ShardedServer import ShardedServer
+from WorkerPool import WorkerPool
+
+class ForwardTest(unittest.TestCase):
+    def testForwardToOurselves(self):
+        #A shard that isn't listening, with one worker and room for one
+         # task, so the worker's own queue fills up right away
+        shard = ShardedServer.__new__(ShardedServer)
+        shard.index = 0
+        shard.inboxes = [queue.SimpleQueue()]
+        shard.local = queue.SimpleQueue()
+        shard.pool = WorkerPool(1,1)
+        Thread(target=shard.readInbox,args=(shard.local,),daemon=True).start()
+        done = []
+        shard.ipcCount = done.append
+        def forwardMany():
+            for i in range(10):
+                shard.forward(0,'bob','Count',i)
+        shard.pool.submit('bob',forwardMany)
+        deadline = time.monotonic() + 5
+        while len(done) < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(done,list(range(10)))
+
+    def testBusyWorkerDoesntHoldUpTheRest(self):
+        #One worker is stuck with a full queue, operations for the other
+         # worker still get through, and the held one runs once it frees up
+        shard = ShardedServer.__new__(ShardedServer)
+        shard.index = 0
+        shard.inboxes = [queue.SimpleQueue()]
+        shard.local = queue.SimpleQueue()
+        shard.pool = WorkerPool(2,1)
+        stuck = [key for key in range(10) if hash(key) % 2 == 0][0]
+        free = [key for key in range(10) if hash(key) % 2 == 1][0]
+        release = Event()
+        self.addCleanup(release.set)
+        shard.pool.submit(stuck,release.wait)
+        shard.pool.submit(stuck,lambda: None)
+        Thread(target=shard.readInbox,args=(shard.local,),daemon=True).start()
+        done = []
+        shard.ipcCount = done.append
+        shard.forward(0,stuck,'Count','stuck 1')
+        shard.forward(0,stuck,'Count','stuck 2')
+        shard.forward(0,free,'Count','free')
+        deadline = time.monotonic() + 5
+        while not done and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(done,['free'])
+        release.set()
+        while len(done) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(done,['free','stuck 1','stuck 2'])
+
+class HandoffTest(unittest.TestCase):
+    def testMovedToAnotherShard(self):
+        #bob was at home with us and comes back through another shard, we
+         # don't think his old address is him anymore
+        shard = ShardedServer.__new__(ShardedServer)
+        shard.index = 0
+        shard.homes = dict()
+        shard.initState(None)
+        forgotten = []
+        shard.udp = types.SimpleNamespace(forget=forgotten.append,
+                                          broadcastSend=lambda *args: None)
+        shard.ipcEntry('bob',{'IP':'127.0.0.1','PORT':5000,'Online':True},0)
+        self.assertEqual(shard.addresses,{('127.0.0.1',5000):'bob'})
+        shard.ipcEntry('bob',{'IP':'127.0.0.1','PORT':5001,'Online':True},1)
+        self.assertEqual(shard.addresses,{})
+        self.assertEqual(forgotten,[('127.0.0.1',5000)])
+        #His timer is kept by his new home
+        self.assertNotIn('bob',shard.wheel.advance(time.monotonic() + 3600))
+
+class PagingTest(unittest.TestCase):
+    def testPagesFromTheOwner(self):
+        #A shard that owns bob and is its home too, it sends bob's stored
+         # messages to itself a page at a time
+        shard = ShardedServer.__new__(ShardedServer)
+        shard.index = 0
+        shard.inboxes = [queue.SimpleQueue()]
+        shard.local = queue.SimpleQueue()
+        shard.owned = dict()
+        shard.homes = dict()
+        shard.pool = WorkerPool(2,16)
+        shard.initState(None,pageSize=2)
+        Thread(target=shard.readInbox,args=(shard.local,),daemon=True).start()
+        pages = []
+        def windowSend(MSGS,PORT,IP,onAck):
+            pages.append([MSG[2] for MSG in MSGS])
+            for index in range(len(MSGS)):
+                onAck(index)
+            return 200
+        shard.udp = types.SimpleNamespace(windowSend=windowSend,
+                                          secureSend=lambda *args: 200,
+                                          broadcastSend=lambda *args: None,
+                                          compresses=lambda address: False)
+        shard.owned['bob'] = {'IP':'127.0.0.1','PORT':5000,'Online':False,
+                              'Home':0}
+        for i in range(5):
+            shard.store.append('bob','hi {}'.format(i))
+        shard.forward(0,'bob','Presence','bob',True,0)
+        deadline = time.monotonic() + 5
+        while len(pages) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(pages,[[['hi 0','hi 1']],[['hi 2','hi 3']],
+                                [['hi 4']]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#Created by Adithya Shastry
+#Tests that a Server restarted from a full snapshot and the increments
+# after it has the same clients, channels and stored messages
+
+import types
+import shutil
+import tempfile
+import unittest
+from Server import Server
+
+class RoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.directory)
+
+    def server(self):
+        #A Server that isn't listening, saving to the directory only when
+         # we tell it to
+        server = Server.__new__(Server)
+        server.initState(None)
+        server.udp = types.SimpleNamespace(broadcastSend=lambda *args: {})
+        restored = server.initSnapshots(self.directory,interval=3600)
+        self.addCleanup(setattr,server.snapshots,'running',False)
+        return server,restored
+
+    def register(self,server,nick,PORT):
+        with server.tableLock:
+            server.clientTable[nick] = {'IP':'127.0.0.1','PORT':PORT,
+                                        'Online':True}
+        server.tableChanged(nick)
+
+    def testFullThenIncrement(self):
+        server,restored = self.server()
+        self.assertFalse(restored)
+        self.register(server,'alice',5000)
+        self.register(server,'bob',5001)
+        server.addMember('#room','alice')
+        server.store.append('bob','hi')
+        server.snapshots.save(full=True)
+        #The changes after the full snapshot go in an increment
+        self.register(server,'carol',5002)
+        server.markOffline('bob','127.0.0.1',5001)
+        server.addMember('#room','bob')
+        server.store.append('bob','there')
+        server.store.ack('bob',server.store.pending('bob')[0][0])
+        server.snapshots.save()
+        self.assertEqual(server.snapshots.increments,1)
+        copy,restored = self.server()
+        self.assertTrue(restored)
+        self.assertEqual(copy.clientTable,server.clientTable)
+        self.assertEqual(copy.tableVersion,server.tableVersion)
+        self.assertEqual(copy.channels,{'#room':{'alice','bob'}})
+        self.assertEqual(copy.store.pending('bob'),
+                         server.store.pending('bob'))
+        #Only the clients that were online get a timer
+        self.assertEqual(sorted(copy.addresses.values()),['alice','carol'])
+        #And new messages don't reuse the ids of the restored ones
+        copy.store.append('bob','again')
+        self.assertEqual([MSG for msgId,MSG in copy.store.pending('bob')],
+                         ['there','again'])
+
+    def testHalfWrittenIncrement(self):
+        #An increment cut off when we stopped is dropped, the whole ones
+         # before it are still loaded
+        server,restored = self.server()
+        self.register(server,'alice',5000)
+        server.snapshots.save(full=True)
+        self.register(server,'bob',5001)
+        server.snapshots.save()
+        self.register(server,'carol',5002)
+        server.snapshots.save()
+        path = server.snapshots.path('snapshot.inc')
+        with open(path,'r+b') as increments:
+            increments.truncate(increments.seek(0,2) - 3)
+        copy,restored = self.server()
+        self.assertEqual(sorted(copy.clientTable),['alice','bob'])
+
+    def testOldGeneration(self):
+        #Increments left from before the last full snapshot are ignored
+        server,restored = self.server()
+        self.register(server,'alice',5000)
+        server.snapshots.save(full=True)
+        self.register(server,'bob',5001)
+        server.snapshots.save()
+        path = server.snapshots.path('snapshot.inc')
+        with open(path,'rb') as increments:
+            old = increments.read()
+        server.markOffline('bob','127.0.0.1',5001)
+        server.snapshots.save(full=True)
+        with open(path,'wb') as increments:
+            increments.write(old)
+        copy,restored = self.server()
+        self.assertFalse(copy.clientTable['bob']['Online'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#Created by Adithya Shastry
+#Tests that the timers on the wheel run out when they should, including
+# ones that go around the wheel more than once
+
+import unittest
+from TimerWheel import TimerWheel
+
+class ExpiryTest(unittest.TestCase):
+    def setUp(self):
+        #Whole second ticks so we can move the wheel to exact times
+        self.wheel = TimerWheel(tick=1.0,slots=8)
+        self.start = self.wheel.current
+
+    def at(self,ticks):
+        return self.wheel.advance(self.start + ticks)
+
+    def testRunsOutOnItsTick(self):
+        self.wheel.schedule('bob',3)
+        self.assertEqual(self.at(2),[])
+        self.assertEqual(self.at(3),['bob'])
+        self.assertEqual(len(self.wheel),0)
+        #It only runs out once
+        self.assertEqual(self.at(4),[])
+
+    def testPartialTicksRoundUp(self):
+        self.wheel.schedule('bob',0.1)
+        self.assertEqual(self.at(1),['bob'])
+
+    def testRescheduleAndCancel(self):
+        self.wheel.schedule('bob',2)
+        self.wheel.schedule('alice',2)
+        self.wheel.schedule('bob',5)
+        self.wheel.cancel('alice')
+        self.assertEqual(self.at(4),[])
+        self.assertEqual(self.at(5),['bob'])
+
+    def testLaterTripAroundTheWheel(self):
+        #10 ticks lands in the same slot as 2 on a wheel of 8 slots
+        self.wheel.schedule('bob',10)
+        self.wheel.schedule('alice',2)
+        self.assertEqual(self.at(2),['alice'])
+        self.assertEqual(self.at(9),[])
+        self.assertEqual(self.at(10),['bob'])
+
+    def testFallingBehind(self):
+        #Moving more than a full turn at once still expires everything due
+        self.wheel.schedule('bob',3)
+        self.wheel.schedule('alice',12)
+        self.assertEqual(sorted(self.at(20)),['alice','bob'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+#Created by Adithya Shastry
+#Tests of the UDPSocket dispatcher, its sequence numbers and when it
+# compresses what it sends
+
+import time
+import socket
+import unittest
+from threading import Thread
+from UDPSocket import UDPSocket
+
+class DispatchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = UDPSocket(0,retries=3)
+        self.client = UDPSocket(0,retries=3)
+        self.port = self.server.socket.getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+
+    def testBadDatagramIsDropped(self):
+        #The first datagram blows up in the dispatcher, the resent one
+        # still has to get through
+        decode = self.server.codec.decode
+        calls = []
+        def explode(data):
+            calls.append(data)
+            if len(calls) == 1:
+                raise TypeError("unhashable type: 'list'")
+            return decode(data)
+        self.server.codec.decode = explode
+        self.assertEqual(self.client.secureSend([0,'MSG:bob','hi'],
+                                                self.port),200)
+        packet,address = self.server.secureRecieve()
+        self.assertEqual(packet[1:],['MSG:bob','hi'])
+        self.assertEqual(self.server.traffic.dropped.snapshot(),1)
+        self.assertTrue(self.server.dispatcher.is_alive())
+
+    def testRefusedPacketIsResent(self):
+        #A packet admit turns down isn't ACKed, so it comes again
+        calls = []
+        def admit(data,address):
+            calls.append(data[1:])
+            return len(calls) > 1
+        self.server.admit = admit
+        self.assertEqual(self.client.secureSend([0,'MSG:bob','hi'],
+                                                self.port),200)
+        packet,address = self.server.secureRecieve()
+        self.assertEqual(packet[1:],['MSG:bob','hi'])
+        self.assertEqual(calls,[['MSG:bob','hi']] * 2)
+        self.assertEqual(self.server.inbound.qsize(),0)
+        self.assertEqual(self.client.traffic.retransmits.total(),1)
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.server = UDPSocket(0,retries=3)
+        self.client = UDPSocket(0,retries=3)
+        self.port = self.server.socket.getsockname()[1]
+        self.address = ('127.0.0.1',self.client.socket.getsockname()[1])
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+
+    def recieve(self,count):
+        return [self.server.secureRecieve()[0][1:] for i in range(count)]
+
+    def testOnlyPacketZeroStartsAStream(self):
+        #A packet from the middle of a stream we don't know is NACKed
+        self.client.sendSeq[('127.0.0.1',self.port)] = 5
+        self.assertEqual(self.client.windowSend(
+            [[0,'MSG:bob','a'],[0,'MSG:bob','b']],self.port),200)
+        self.assertEqual(self.recieve(2),[['MSG:bob','a'],['MSG:bob','b']])
+        #Both packets of the window were in flight
+        self.assertEqual(self.server.traffic.nacks.snapshot(),2)
+        #The client started over from packet 0
+        self.assertEqual(self.server.expectSeq[self.address],2)
+
+    def testForgottenStreamRestarts(self):
+        self.assertEqual(self.client.windowSend(
+            [[0,'MSG:bob',str(i)] for i in range(5)],self.port),200)
+        self.recieve(5)
+        self.server.forget(self.address)
+        self.assertEqual(self.client.secureSend([0,'MSG:bob','again'],
+                                                self.port),200)
+        self.assertEqual(self.recieve(1),[['MSG:bob','again']])
+        self.assertEqual(self.server.expectSeq[self.address],1)
+
+    def testBroadcastRestarts(self):
+        self.client.sendSeq[('127.0.0.1',self.port)] = 9
+        responses = self.client.broadcastSend([0,'MSG:bob','all'],
+                                              [('127.0.0.1',self.port)])
+        self.assertEqual(responses,{('127.0.0.1',self.port):200})
+        self.assertEqual(self.recieve(1),[['MSG:bob','all']])
+
+    def testConcurrentSendsStayInOrder(self):
+        #Two threads sending to the same peer never mix up their packets
+        def send(name):
+            MSGS = [[0,'MSG:bob','{} {}'.format(name,i)] for i in range(40)]
+            self.assertEqual(self.client.windowSend(MSGS,self.port),200)
+        threads = [Thread(target=send,args=(name,)) for name in 'xy']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        texts = [data for command,data in self.recieve(80)]
+        for name in 'xy':
+            mine = [text for text in texts if text.startswith(name)]
+            self.assertEqual(mine,['{} {}'.format(name,i) for i in range(40)])
+        #Nothing arrived out of order, so nothing had to be resent
+        self.assertEqual(self.client.traffic.retransmits.total(),0)
+        self.assertEqual(self.client.sendLocks,{})
+
+    def testQueuedSendsGiveUpTogether(self):
+        #Sends waiting behind one that gave up on a peer don't each wait
+         # out their own timeouts
+        dead = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        dead.bind(('127.0.0.1',0))
+        PORT = dead.getsockname()[1]
+        dead.close()
+        self.client.retries = 2
+        responses = []
+        def send():
+            responses.append(self.client.secureSend([0,'MSG:bob','hi'],PORT))
+        threads = [Thread(target=send) for i in range(4)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        #One send is two timeouts of 0.5 and 1 seconds
+        self.assertLess(time.monotonic() - start,3)
+        self.assertEqual(responses,[100] * 4)
+        self.assertEqual(self.client.sendLocks,{})
+
+    def testLateAckFromAnOldStream(self):
+        #An ACK past the packets of the stream we are sending is from one we
+         # gave up on, so it doesn't count for this one
+        peer = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        peer.bind(('127.0.0.1',0))
+        self.addCleanup(peer.close)
+        self.client.retries = 2
+        responses = []
+        def send():
+            responses.append(self.client.secureSend([0,'MSG:bob','hi'],
+                                                    peer.getsockname()[1]))
+        thread = Thread(target=send)
+        thread.start()
+        data,address = peer.recvfrom(2048)
+        self.assertEqual(self.client.codec.decode(data)[0],0)
+        peer.sendto(self.client.codec.encode(['ACK',35]),address)
+        thread.join()
+        self.assertEqual(responses,[100])
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = UDPSocket(0,retries=3)
+        self.client = UDPSocket(0,retries=3)
+        self.port = self.server.socket.getsockname()[1]
+        self.flags = []
+        #Remember the flags of every data packet the Server gets
+        decode = self.server.codec.decode
+        def record(data):
+            packet = decode(data)
+            if packet is not None and isinstance(packet[0],int):
+                self.flags.append(data[2])
+            return packet
+        self.server.codec.decode = record
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+
+    def send(self,MSG):
+        self.assertEqual(self.client.secureSend([0,'MSG:bob',MSG],
+                                                self.port),200)
+        return self.server.secureRecieve()[0][2]
+
+    def testOnlyAfterThePeerSaidSo(self):
+        text = 'hello there ' * 50
+        self.assertEqual(self.send(text),text)
+        self.assertTrue(self.client.allowCompression(('127.0.0.1',
+                                                       self.port)))
+        self.assertEqual(self.send(text),text)
+        #Small packets aren't worth it
+        self.assertEqual(self.send('hi'),'hi')
+        self.assertEqual(self.flags,[0,self.client.codec.COMPRESSED,0])
+
+    def testForgottenPeer(self):
+        #A peer that comes back has to say so again
+        peer = ('127.0.0.1',self.port)
+        self.client.allowCompression(peer)
+        self.client.forget(peer)
+        self.assertFalse(self.client.compresses(peer))
+
+    def testTurnedOff(self):
+        udp = UDPSocket(0,compression=False)
+        self.addCleanup(udp.close)
+        self.assertFalse(udp.allowCompression(('127.0.0.1',self.port)))
+        self.assertFalse(udp.compresses(('127.0.0.1',self.port)))
+
+class CoalesceTest(unittest.TestCase):
+    def testEveryPacketIsAckedOrCoalesced(self):
+        #A burst through the window is ACKed with fewer ACKs than packets,
+         # and every packet's ACK was either sent or replaced by a later one
+         # (resent packets are ACKed again, so there can be more)
+        server = UDPSocket(0)
+        client = UDPSocket(0,windowSize=32)
+        self.addCleanup(server.close)
+        self.addCleanup(client.close)
+        MSGS = [[0,'MSG:bob',str(i)] for i in range(200)]
+        self.assertEqual(client.windowSend(
+            MSGS,server.socket.getsockname()[1]),200)
+        #The last ACK is counted just after it is sent
+        time.sleep(0.05)
+        sent = server.traffic.acksSent.snapshot()
+        coalesced = server.traffic.acksCoalesced.snapshot()
+        self.assertGreaterEqual(sent + coalesced,len(MSGS))
+        self.assertLess(sent,len(MSGS))
+
+if __name__ == '__main__':
+    unittest.main()
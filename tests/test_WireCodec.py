@@ -0,0 +1,83 @@
+#Created by Adithya Shastry
+#Tests that datagrams someone made up can't get anything but None out of
+# BinaryCodec.decode, and that only bodies worth it are compressed
+
+import os
+import struct
+import unittest
+from WireCodec import BinaryCodec
+
+class DecodeTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = BinaryCodec()
+
+    def packet(self,data):
+        #A 'MSG:bob' packet whose data is the raw tagged bytes we give it
+        body = bytearray()
+        self.codec.packValue(':bob',body)
+        return self.codec.frame(3,0,1,bytes(body) + data)
+
+    def testRoundTrip(self):
+        packet = [4,'MSG:bob',{'text':'hi',1:[b'x',None,2.5]}]
+        self.assertEqual(self.codec.decode(self.codec.encode(packet)),packet)
+
+    def testListKey(self):
+        #{[]:None} would be a TypeError when it's put in the dict
+        data = b'm' + struct.pack('!I',1) + b'l' + struct.pack('!I',0) + b'N'
+        self.assertIsNone(self.codec.decode(self.packet(data)))
+
+    def testDeepNesting(self):
+        #A list inside a list inside ... deeper than the recursion limit
+        data = (b'l' + struct.pack('!I',1)) * 5000 + b'N'
+        self.assertIsNone(self.codec.decode(self.packet(data)))
+
+    def testNestingLimit(self):
+        value = None
+        for i in range(BinaryCodec.MAXDEPTH):
+            value = [value]
+        packet = [1,'MSG:bob',value]
+        self.assertEqual(self.codec.decode(self.codec.encode(packet)),packet)
+        packet = [1,'MSG:bob',[value]]
+        self.assertIsNone(self.codec.decode(self.codec.encode(packet)))
+
+    def testTruncated(self):
+        data = b's' + struct.pack('!I',100) + b'abc'
+        self.assertIsNone(self.codec.decode(self.packet(data)))
+
+class CompressTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = BinaryCodec(compressAbove=128)
+
+    def flags(self,data):
+        return self.codec.HEADER.unpack_from(data)[2]
+
+    def testBelowThreshold(self):
+        #A small body goes out the same whether the peer can read
+         # compressed ones or not
+        packet = [1,'MSG:bob','hi']
+        self.assertEqual(self.codec.encode(packet,True),
+                         self.codec.encode(packet))
+        self.assertEqual(self.flags(self.codec.encode(packet,True)),0)
+
+    def testBigBody(self):
+        packet = [1,'MSG:bob','hello there ' * 50]
+        plain = self.codec.encode(packet)
+        packed = self.codec.encode(packet,True)
+        self.assertEqual(self.flags(plain),0)
+        self.assertEqual(self.flags(packed),self.codec.COMPRESSED)
+        self.assertLess(len(packed),len(plain))
+        self.assertEqual(self.codec.decode(packed),packet)
+
+    def testIncompressibleBody(self):
+        #A body that wouldn't get smaller is sent as it is
+        packet = [1,'MSG:bob',os.urandom(512)]
+        self.assertEqual(self.codec.encode(packet,True),
+                         self.codec.encode(packet))
+
+    def testInflationLimit(self):
+        packet = [1,'MSG:bob','a' * 4096]
+        packed = self.codec.encode(packet,True)
+        self.assertIsNone(BinaryCodec(maxBody=1024).decode(packed))
+
+if __name__ == '__main__':
+    unittest.main()